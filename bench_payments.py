@@ -0,0 +1,189 @@
+# bench_payments.py
+#
+# Load test of the MobilePay purchase flow against the local Vipps stand-in
+# (vipps_mock.py). Starts the mock and the app on free local ports, then runs
+# concurrent users through cart -> initiate -> approve -> callback -> status
+# polling, and reports throughput, latency percentiles and how many Vipps
+# calls each purchase cost. No network access needed. Usage:
+#   python bench_payments.py                               # 20 users x 5 purchases
+#   python bench_payments.py --users 50 --purchases 10 --latency-ms 120 --jitter-ms 80
+#   python bench_payments.py --fail-rate 0.05              # injected upstream 503s
+#   python bench_payments.py --no-webhook                  # polls fall back to Vipps lookups
+#   python bench_payments.py --database-url mysql+pymysql://user:pw@localhost/bench_db
+#
+# Uses a throwaway SQLite database unless --database-url is given; that
+# database gets bench users and payments written to it, so never point it at
+# production.
+
+import argparse
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+
+import requests
+from werkzeug.security import generate_password_hash
+from werkzeug.serving import make_server
+
+parser = argparse.ArgumentParser(description="Benchmark MobilePay purchases against the local Vipps mock")
+parser.add_argument("--users", type=int, default=20, help="concurrent users")
+parser.add_argument("--purchases", type=int, default=5, help="purchases per user")
+parser.add_argument("--clips", type=int, default=5, choices=[1, 5])
+parser.add_argument("--poll-ms", type=float, default=250, help="status poll interval")
+parser.add_argument("--approve-ms", type=float, default=200, help="time the user takes to approve")
+parser.add_argument("--timeout", type=float, default=60, help="seconds before a purchase counts as stuck")
+parser.add_argument("--latency-ms", type=float, default=50, help="mock upstream latency")
+parser.add_argument("--jitter-ms", type=float, default=50)
+parser.add_argument("--fail-rate", type=float, default=0.0, help="share of Vipps calls answered 503")
+parser.add_argument("--hang-rate", type=float, default=0.0, help="share of Vipps calls that stall")
+parser.add_argument("--no-webhook", action="store_true", help="do not send webhooks; status polls look up Vipps")
+parser.add_argument("--database-url", help="default: a temporary SQLite file")
+args = parser.parse_args()
+
+os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{tempfile.mkdtemp()}/bench.db"
+
+from dgp_intra import create_app                            # noqa: E402  (after DATABASE_URL)
+from dgp_intra.extensions import db                         # noqa: E402
+from dgp_intra.models import User, PaymentIntent, PaymentState  # noqa: E402
+from dgp_intra.routes.klippekort import vipps               # noqa: E402
+from vipps_mock import create_mock_app                      # noqa: E402
+
+WEBHOOK_SECRET = "bench-webhook-secret"
+PASSWORD = "bench"
+
+
+def serve(wsgi_app):
+    """Run a WSGI app on a free local port in a background thread; returns its base URL"""
+    server = make_server("127.0.0.1", 0, wsgi_app, threaded=True)
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)  # no access log per request
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def percentiles(samples):
+    if not samples:
+        return "-"
+    samples = sorted(samples)
+    pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))]
+    return (f"p50 {pick(0.50) * 1000:7.1f} ms  p95 {pick(0.95) * 1000:7.1f} ms  "
+            f"p99 {pick(0.99) * 1000:7.1f} ms  max {samples[-1] * 1000:7.1f} ms")
+
+
+# ---- set up mock and app ----
+
+mock = create_mock_app(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                       fail_rate=args.fail_rate, hang_rate=args.hang_rate)
+mock_url = serve(mock)
+
+app = create_app()
+app.config.update(
+    VIPPS_API_BASE_URL=mock_url,
+    VIPPS_WEBHOOK_SECRET=WEBHOOK_SECRET,
+    # Without webhooks a poll may ask Vipps as soon as the payment has been quiet for a second
+    VIPPS_STATUS_STALE_SECONDS=1 if args.no_webhook else app.config["VIPPS_STATUS_STALE_SECONDS"],
+)
+app_url = serve(app)
+if not args.no_webhook:
+    requests.post(f"{mock_url}/mock/config", json={
+        "webhook_url": f"{app_url}/klippekort/webhook", "webhook_secret": WEBHOOK_SECRET,
+    }, timeout=5)
+
+with app.app_context():
+    if db.engine.url.get_backend_name() == "sqlite":
+        db.create_all()
+    emails = [f"bench-{i}@example.invalid" for i in range(args.users)]
+    existing = {u.email for u in User.query.filter(User.email.in_(emails))}
+    for email in emails:
+        if email not in existing:
+            db.session.add(User(name=email.split("@")[0], email=email, credit=0,
+                                password_hash=generate_password_hash(PASSWORD)))
+    db.session.commit()
+    vipps.metrics.reset()
+
+# ---- run ----
+
+lock = threading.Lock()
+timings = {"flow": [], "initiate": [], "callback": [], "status": []}
+outcomes = {}
+
+
+def record(kind, seconds):
+    with lock:
+        timings[kind].append(seconds)
+
+
+def purchase(http):
+    """One purchase; returns the final poll status"""
+    started = time.perf_counter()
+    t = time.perf_counter()
+    r = http.get(f"{app_url}/klippekort/initiate/{args.clips}", allow_redirects=False, timeout=30)
+    record("initiate", time.perf_counter() - t)
+    location = r.headers.get("Location", "")
+    if not location.startswith(mock_url):
+        return "initiate_failed"
+
+    time.sleep(args.approve_ms / 1000)
+    requests.post(location, timeout=30)  # the user approves in the app
+
+    t = time.perf_counter()
+    r = http.get(f"{app_url}/klippekort/callback", allow_redirects=False, timeout=30)
+    record("callback", time.perf_counter() - t)
+    reference = parse_qs(urlsplit(r.headers.get("Location", "")).query).get("ref", [None])[0]
+    if not reference:
+        return "callback_failed"
+
+    status = "timeout"
+    deadline = time.time() + args.timeout
+    while time.time() < deadline:
+        t = time.perf_counter()
+        r = http.get(f"{app_url}/klippekort/status/{reference}", timeout=30)
+        record("status", time.perf_counter() - t)
+        status = r.json().get("status") if r.ok else f"http_{r.status_code}"
+        if status != "pending":
+            break
+        time.sleep(args.poll_ms / 1000)
+    record("flow", time.perf_counter() - started)
+    return status
+
+
+def user_session(email):
+    http = requests.Session()
+    http.post(f"{app_url}/login", data={"email": email, "password": PASSWORD}, timeout=30)
+    for _ in range(args.purchases):
+        status = purchase(http)
+        with lock:
+            outcomes[status] = outcomes.get(status, 0) + 1
+
+
+print(f"Mock {mock_url}  app {app_url}  db {os.environ['DATABASE_URL'].split('@')[-1]}")
+print(f"{args.users} users x {args.purchases} purchases, upstream {args.latency_ms}+{args.jitter_ms} ms, "
+      f"fail {args.fail_rate:.0%}, webhooks {'off' if args.no_webhook else 'on'}")
+wall = time.perf_counter()
+with ThreadPoolExecutor(max_workers=args.users) as pool:
+    list(pool.map(user_session, emails))
+wall = time.perf_counter() - wall
+
+# ---- report ----
+
+total = sum(outcomes.values())
+print(f"\n{total} purchases in {wall:.1f} s  ->  {total / wall:.1f} purchases/s")
+print("outcomes:", ", ".join(f"{k} {v}" for k, v in sorted(outcomes.items())))
+for kind in ("flow", "initiate", "callback", "status"):
+    print(f"{kind:>9}: {len(timings[kind]):6d} calls  {percentiles(timings[kind])}")
+
+calls = requests.get(f"{mock_url}/mock/stats", timeout=5).json()["calls"]
+outbound = sum(v for k, v in calls.items() if not k.startswith(("webhook", "injected")))
+print(f"\nVipps calls: {outbound} ({outbound / max(total, 1):.2f} per purchase)  "
+      + ", ".join(f"{k} {v}" for k, v in sorted(calls.items())))
+for endpoint, m in sorted(vipps.metrics.snapshot()["endpoints"].items()):
+    print(f"  {endpoint:<50} {m['count']:5d} calls  {m['errors']:4d} errors  {m['retries']:4d} retries  "
+          f"avg {m['avg_ms']:6.1f} ms  p95 <= {m['p95_ms']} ms")
+
+with app.app_context():
+    states = dict(db.session.execute(
+        db.select(PaymentIntent.state, db.func.count()).group_by(PaymentIntent.state)
+    ).all())
+print("intents:", ", ".join(f"{s.name} {states.get(s, 0)}" for s in PaymentState))
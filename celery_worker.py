@@ -32,6 +32,11 @@ celery = make_celery(flask_app)
 # Import the functions *after* celery is defined to avoid circular imports
 from dgp_intra.tasks.email_tasks import send_daily_kitchen_email as send_email_logic
 from dgp_intra.tasks.payment_reminder_worker import send_weekly_payment_reminders as send_reminder_logic
+from dgp_intra.tasks.standing_orders import materialize_standing_orders as materialize_logic
+from dgp_intra.tasks.vacation_cleanup import cancel_vacation_registrations as vacation_cleanup_logic
+from dgp_intra.tasks.reconciliation import reconcile_balances as reconcile_logic
+from dgp_intra.tasks.archive import archive_old_rows as archive_logic
+from dgp_intra.tasks.payments import settle_pending_payments as settle_payments_logic
 
 @celery.task(name='dgp_intra.tasks.email_tasks.send_daily_kitchen_email')
 def send_daily_kitchen_email():
@@ -41,6 +46,26 @@ def send_daily_kitchen_email():
 def send_weekly_payment_reminders():
     return send_reminder_logic()
 
+@celery.task(name='dgp_intra.tasks.standing_orders.materialize_standing_orders')
+def materialize_standing_orders():
+    return materialize_logic()
+
+@celery.task(name='dgp_intra.tasks.vacation_cleanup.cancel_vacation_registrations')
+def cancel_vacation_registrations():
+    return vacation_cleanup_logic()
+
+@celery.task(name='dgp_intra.tasks.reconciliation.reconcile_balances')
+def reconcile_balances():
+    return reconcile_logic()
+
+@celery.task(name='dgp_intra.tasks.archive.archive_old_rows')
+def archive_old_rows():
+    return archive_logic()
+
+@celery.task(name='dgp_intra.tasks.payments.settle_pending_payments')
+def settle_pending_payments():
+    return settle_payments_logic()
+
 celery.conf.timezone = "Europe/Copenhagen"
 celery.conf.enable_utc = False
 
@@ -53,4 +78,27 @@ celery.conf.beat_schedule = {
         'task': 'dgp_intra.tasks.payment_reminder_worker.send_weekly_payment_reminders',
         'schedule': crontab(hour=8, minute=0, day_of_week='mon'),
     },
+    # Off-peak, and early enough that people can still adjust next week
+    'materialize-standing-orders-saturday-3am': {
+        'task': 'dgp_intra.tasks.standing_orders.materialize_standing_orders',
+        'schedule': crontab(hour=3, minute=0, day_of_week='sat'),
+    },
+    'cancel-vacation-registrations-nightly': {
+        'task': 'dgp_intra.tasks.vacation_cleanup.cancel_vacation_registrations',
+        'schedule': crontab(hour=2, minute=0),
+    },
+    # Incremental: only reads ledger rows added since the last run
+    'reconcile-balances-every-5-minutes': {
+        'task': 'dgp_intra.tasks.reconciliation.reconcile_balances',
+        'schedule': crontab(minute='*/5'),
+    },
+    # Payments whose browser stopped polling; Vipps expires unapproved ones
+    'settle-pending-payments-every-5-minutes': {
+        'task': 'dgp_intra.tasks.payments.settle_pending_payments',
+        'schedule': crontab(minute='*/5'),
+    },
+    'archive-old-rows-monthly': {
+        'task': 'dgp_intra.tasks.archive.archive_old_rows',
+        'schedule': crontab(hour=4, minute=0, day_of_month=1),
+    },
 }
\ No newline at end of file
@@ -17,6 +17,35 @@ class Config:
     MAIL_PASSWORD = os.environ.get("MAIL_PASSWORD")
     MAIL_DEFAULT_SENDER = os.environ.get("MAIL_DEFAULT_SENDER")
     
+    # Cache (Redis shared by all workers; falls back to in-process if unset/unreachable)
+    CACHE_REDIS_URL = os.environ.get("CACHE_REDIS_URL", "redis://localhost:6379/1")  # docker-compose.yml points it at the redis service
+    CACHE_REDIS_RETRY = int(os.environ.get("CACHE_REDIS_RETRY", 30))  # seconds between reconnect attempts
+    CACHE_LOCAL_TTL = int(os.environ.get("CACHE_LOCAL_TTL", 5))       # max age of in-process cached values
+    DASHBOARD_CACHE_TTL = int(os.environ.get("DASHBOARD_CACHE_TTL", 300))
+
+    # Ledger: rows counted for the "N transaktioner" total before showing "N+" (0 = no count)
+    LEDGER_COUNT_CAP = int(os.environ.get("LEDGER_COUNT_CAP", 1000))
+    # Ledger search: ranked results shown per search
+    LEDGER_SEARCH_LIMIT = int(os.environ.get("LEDGER_SEARCH_LIMIT", 100))
+
+    # Balance reconciliation (Celery, every 5 minutes)
+    RECONCILE_AUTO_REPAIR = os.environ.get("RECONCILE_AUTO_REPAIR", "False") == "True"
+    RECONCILE_BATCH_SIZE = int(os.environ.get("RECONCILE_BATCH_SIZE", 5000))
+
+    # Archival of old ledger, cleaning-log and meal rows (Celery, monthly)
+    ARCHIVE_HORIZON_DAYS = int(os.environ.get("ARCHIVE_HORIZON_DAYS", 730))
+    ARCHIVE_BATCH_SIZE = int(os.environ.get("ARCHIVE_BATCH_SIZE", 5000))
+
+    # Seconds a response is kept for replay when its Idempotency-Key is sent again
+    IDEMPOTENCY_TTL = int(os.environ.get("IDEMPOTENCY_TTL", 86400))
+
+    # Live room board (server-sent events over Redis pub/sub; off without Redis)
+    LIVE_EVENTS_BACKLOG = int(os.environ.get("LIVE_EVENTS_BACKLOG", 200))         # events kept for reconnects
+    LIVE_EVENTS_KEEPALIVE = int(os.environ.get("LIVE_EVENTS_KEEPALIVE", 15))       # seconds between pings
+    LIVE_EVENTS_STREAM_SECONDS = int(os.environ.get("LIVE_EVENTS_STREAM_SECONDS", 300))  # then the browser reconnects
+    # In-process events when Redis is missing: single-process servers only (run_dev.py)
+    LIVE_EVENTS_IN_PROCESS = os.environ.get("LIVE_EVENTS_IN_PROCESS", "False") == "True"
+    
     # Celery configuration
     broker_url = 'redis://localhost:6379/0'
     result_backend = 'redis://localhost:6379/0'
@@ -33,6 +62,16 @@ class Config:
     VIPPS_CLIENT_SECRET = os.environ.get('VIPPS_CLIENT_SECRET', 'mock')
     VIPPS_SUBSCRIPTION_KEY = os.environ.get('VIPPS_SUBSCRIPTION_KEY', 'mock')
     VIPPS_MSN = os.environ.get('VIPPS_MSN', 'mock')
+    VIPPS_CONNECT_TIMEOUT = float(os.environ.get('VIPPS_CONNECT_TIMEOUT', '3.05'))
+    VIPPS_READ_TIMEOUT = float(os.environ.get('VIPPS_READ_TIMEOUT', '10'))
+    VIPPS_MAX_RETRIES = int(os.environ.get('VIPPS_MAX_RETRIES', '2'))
+    VIPPS_RETRY_BACKOFF = float(os.environ.get('VIPPS_RETRY_BACKOFF', '0.25'))  # seconds, doubled per retry
+    VIPPS_POOL_SIZE = int(os.environ.get('VIPPS_POOL_SIZE', '10'))
+    VIPPS_WEBHOOK_SECRET = os.environ.get('VIPPS_WEBHOOK_SECRET')  # returned when the webhook is registered
+    VIPPS_STATUS_STALE_SECONDS = int(os.environ.get('VIPPS_STATUS_STALE_SECONDS', '15'))
+    PAYMENT_SETTLE_AFTER_MINUTES = int(os.environ.get('PAYMENT_SETTLE_AFTER_MINUTES', '10'))
+    PAYMENT_SETTLE_BATCH = int(os.environ.get('PAYMENT_SETTLE_BATCH', '200'))
+    VIPPS_SETTLE_WORKERS = int(os.environ.get('VIPPS_SETTLE_WORKERS', '8'))  # concurrent Vipps lookups
     
     # Klippekort pricing
     KLIPPEKORT_PRICE_PER_CLIP = int(os.environ.get('KLIPPEKORT_PRICE_PER_CLIP', '24'))
\ No newline at end of file
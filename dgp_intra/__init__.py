@@ -26,6 +26,10 @@ def create_app():
     from dgp_intra.routes import register_blueprints
     register_blueprints(app)
     
+    # Hidden idempotency key field for credit-changing forms
+    from dgp_intra.utils.idempotency import idempotency_field
+    app.jinja_env.globals['idempotency_field'] = idempotency_field
+    
     # Error handler
     @app.errorhandler(403)
     def forbidden(e):
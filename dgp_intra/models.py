@@ -1,6 +1,8 @@
 # models.py
 from .extensions import db
 from flask_login import UserMixin
+from sqlalchemy import event, DDL, inspect
+from sqlalchemy.orm import validates
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, date
 from enum import Enum
@@ -28,6 +30,12 @@ class User(db.Model):
     owes = db.Column(db.Integer, default=0)
     dob = db.Column(db.Date, nullable=True, index=True)
     pub_dob = db.Column(db.Boolean, nullable=False, default=False)
+    # month * 100 + day of dob (e.g. 0715), kept in sync by the listener below
+    dob_ordinal = db.Column(db.SmallInteger, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_user_pub_dob_dob_ordinal', 'pub_dob', 'dob_ordinal'),
+    )
     
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
@@ -79,20 +87,43 @@ class User(db.Model):
             UserRole.ADMIN: "Administrator"
         }
         return role_names.get(self.role, "Personale")
+
+
+def dob_to_ordinal(dob):
+    """Calendar position of a birthday as month * 100 + day, ignoring the year"""
+    if dob is None:
+        return None
+    return dob.month * 100 + dob.day
+
+
+@event.listens_for(User.dob, 'set')
+def _sync_dob_ordinal(target, value, oldvalue, initiator):
+    target.dob_ordinal = dob_to_ordinal(value)
     
 
 class LunchRegistration(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     date = db.Column(db.Date)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'))
+    # 0 = the user's own registration, 1.. = "+1" guests on the same day
+    slot = db.Column(db.SmallInteger, nullable=False, default=0, server_default='0')
     user = db.relationship('User', backref='lunch_registrations')
 
+    __table_args__ = (
+        db.Index('ix_lunch_registration_user_id_date', 'user_id', 'date'),
+        db.UniqueConstraint('user_id', 'date', 'slot', name='uq_lunch_registration_user_date_slot'),
+    )
+
 class BreakfastRegistration(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     date = db.Column(db.Date, nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'))
     user = db.relationship('User', backref='breakfast_registrations')
 
+    __table_args__ = (
+        db.Index('ix_breakfast_registration_user_id_date', 'user_id', 'date'),
+    )
+
 class WeeklyMenu(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     week = db.Column(db.String(10))  # e.g. "2025-W14"
@@ -133,6 +164,37 @@ class Vacation(db.Model):
     def __repr__(self):
         return f"<Vacation {self.user.name}: {self.start_date} to {self.end_date}>"
     
+class StandingOrder(db.Model):
+    """Recurring lunch registration, materialized a week ahead by a Celery job"""
+    __tablename__ = 'standing_orders'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False, unique=True)
+    # Bit i set = registered on weekday i (0 = Monday ... 4 = Friday)
+    weekday_mask = db.Column(db.SmallInteger, nullable=False, default=0)
+    start_date = db.Column(db.Date, nullable=False, default=date.today)
+    end_date = db.Column(db.Date, nullable=True)  # open-ended if None
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    user = db.relationship("User", backref=db.backref("standing_order", uselist=False,
+                                                      cascade="all, delete-orphan"))
+
+    @property
+    def weekdays(self):
+        return [i for i in range(5) if self.weekday_mask & (1 << i)]
+
+    def covers(self, day):
+        """True if the order asks for lunch on this date"""
+        if not self.weekday_mask & (1 << day.weekday()):
+            return False
+        if day < self.start_date:
+            return False
+        return self.end_date is None or day <= self.end_date
+
+    def __repr__(self):
+        return f"<StandingOrder user={self.user_id} weekdays={self.weekdays}>"
+
+
 class Event(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), nullable=False)
@@ -197,13 +259,158 @@ class CreditTransaction(db.Model):
 
     note = db.Column(db.String(280), nullable=True)
 
+    # Set by requests carrying an Idempotency-Key (utils/idempotency.py); a retry
+    # that would write the same row again fails on the unique index
+    idempotency_key = db.Column(db.String(64), nullable=True)
+
     user = db.relationship("User", foreign_keys=[user_id],
                            backref=db.backref("credit_transactions", lazy="dynamic"))
 
     __table_args__ = (
         db.CheckConstraint('delta_credits <> 0', name='ck_tx_nonzero_delta'),
+        db.Index('ix_credit_transaction_user_created_id', 'user_id', 'created_at', 'id'),
+        db.UniqueConstraint('idempotency_key', name='uq_credit_transaction_idempotency_key'),
+        # Full-text search on MySQL; see services/ledger_search.py
+        db.Index('ft_credit_transaction_source_note', 'source', 'note', mysql_prefix='FULLTEXT'),
+    )
+
+    # A row's effect on the balance is fixed once written (services/reconciliation.py
+    # counts each row once): corrections are new rows, and only rows without a
+    # delta may be canceled afterwards.
+    @validates('delta_credits')
+    def _validate_delta(self, key, value):
+        if inspect(self).persistent and value != self.delta_credits:
+            raise ValueError("delta_credits of a ledger row cannot change; add a new row")
+        return value
+
+    @validates('status')
+    def _validate_status(self, key, value):
+        if (value == TxStatus.CANCELED and inspect(self).persistent
+                and self.status != TxStatus.CANCELED and self.delta_credits):
+            raise ValueError("A ledger row with a delta cannot be canceled; add a reversing row")
+        return value
+
+
+# SQLite has no FULLTEXT indexes: keep an FTS5 shadow table of source/note in sync with
+# triggers instead. Created together with credit_transaction (db.create_all / tests).
+CREDIT_TRANSACTION_FTS_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS credit_transaction_fts USING fts5("
+    "source, note, content='credit_transaction', content_rowid='id')",
+    "CREATE TRIGGER IF NOT EXISTS credit_transaction_fts_ai AFTER INSERT ON credit_transaction BEGIN "
+    "INSERT INTO credit_transaction_fts(rowid, source, note) VALUES (new.id, new.source, new.note); END",
+    "CREATE TRIGGER IF NOT EXISTS credit_transaction_fts_ad AFTER DELETE ON credit_transaction BEGIN "
+    "INSERT INTO credit_transaction_fts(credit_transaction_fts, rowid, source, note) "
+    "VALUES ('delete', old.id, old.source, old.note); END",
+    "CREATE TRIGGER IF NOT EXISTS credit_transaction_fts_au AFTER UPDATE OF source, note ON credit_transaction BEGIN "
+    "INSERT INTO credit_transaction_fts(credit_transaction_fts, rowid, source, note) "
+    "VALUES ('delete', old.id, old.source, old.note); "
+    "INSERT INTO credit_transaction_fts(rowid, source, note) VALUES (new.id, new.source, new.note); END",
+)
+
+for _stmt in CREDIT_TRANSACTION_FTS_DDL:
+    event.listen(CreditTransaction.__table__, 'after_create', DDL(_stmt).execute_if(dialect='sqlite'))
+event.listen(CreditTransaction.__table__, 'before_drop',
+             DDL("DROP TABLE IF EXISTS credit_transaction_fts").execute_if(dialect='sqlite'))
+
+
+class CreditBalance(db.Model):
+    """
+    Per-user running totals of the ledger, kept up to date by services/credit.py
+    whenever a transaction is written or changes status. Lets the ledger page
+    read balances without aggregating the user's whole history.
+    """
+    __tablename__ = "credit_balance"
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete="CASCADE"), primary_key=True)
+    posted_total = db.Column(db.Integer, nullable=False, default=0)   # SUM(delta) of POSTED
+    pending_total = db.Column(db.Integer, nullable=False, default=0)  # SUM(delta) of PENDING
+    last_tx_id = db.Column(db.Integer, nullable=True)  # newest credit_transaction.id folded in
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<CreditBalance user={self.user_id} posted={self.posted_total} pending={self.pending_total}>"
+
+
+class ReconciliationState(db.Model):
+    """
+    Progress of an incremental reconciliation job: every ledger row with an id
+    at or below watermark_tx_id has been processed, except the ids listed in
+    open_gaps (JSON {id: first seen}), which were not yet committed when the
+    job passed them.
+    """
+    __tablename__ = "reconciliation_state"
+
+    name = db.Column(db.String(32), primary_key=True)  # e.g. "credit"
+    watermark_tx_id = db.Column(db.Integer, nullable=False, default=0)
+    open_gaps = db.Column(db.Text, nullable=True)
+    last_run_at = db.Column(db.DateTime, nullable=True)
+    last_processed = db.Column(db.Integer, nullable=False, default=0)   # ledger rows read by the last run
+    last_mismatches = db.Column(db.Integer, nullable=False, default=0)  # users flagged after the last run
+
+
+class CreditReconciliation(db.Model):
+    """
+    What User.credit should be according to the ledger: a baseline taken when the
+    user was first seen, plus every non-canceled ledger delta since. mismatch is
+    set (credit - expected) while the cached balance disagrees.
+    """
+    __tablename__ = "credit_reconciliation"
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete="CASCADE"), primary_key=True)
+    expected_credit = db.Column(db.Integer, nullable=False)
+    mismatch = db.Column(db.Integer, nullable=True)
+    flagged_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class PaymentState(Enum):
+    CREATED    = "created"     # stored, waiting for the user to approve in MobilePay
+    AUTHORIZED = "authorized"  # approved, not yet captured
+    CAPTURED   = "captured"    # money taken and clips granted (ledger_tx_id set)
+    FAILED     = "failed"      # aborted, expired, cancelled or never created at Vipps
+
+# Allowed moves; CAPTURED and FAILED are final
+PAYMENT_TRANSITIONS = {
+    PaymentState.CREATED: {PaymentState.AUTHORIZED, PaymentState.CAPTURED, PaymentState.FAILED},
+    PaymentState.AUTHORIZED: {PaymentState.CAPTURED, PaymentState.FAILED},
+    PaymentState.CAPTURED: set(),
+    PaymentState.FAILED: set(),
+}
+
+class PaymentIntent(db.Model):
+    """A MobilePay clip purchase, from initiate until the clips are granted"""
+    __tablename__ = "payment_intent"
+
+    id = db.Column(db.Integer, primary_key=True)
+    reference = db.Column(db.String(64), unique=True, nullable=False)  # our Vipps payment reference
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete="CASCADE"), nullable=False)
+
+    clips = db.Column(db.Integer, nullable=False)
+    amount_dkk_ore = db.Column(db.Integer, nullable=False)
+
+    state = db.Column(db.Enum(PaymentState), default=PaymentState.CREATED, nullable=False, index=True)
+    vipps_state = db.Column(db.String(20), nullable=True)  # last state reported by Vipps
+
+    # The PURCHASE ledger row once captured. No FK: archived rows keep their id.
+    ledger_tx_id = db.Column(db.Integer, nullable=True)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+    completed_at = db.Column(db.DateTime, nullable=True)
+
+    user = db.relationship("User")
+
+    __table_args__ = (
+        db.Index('ix_payment_intent_user_created', 'user_id', 'created_at'),
     )
 
+    def advance(self, state: PaymentState) -> bool:
+        """Move to `state` if the state machine allows it; returns whether it moved"""
+        if state not in PAYMENT_TRANSITIONS[self.state]:
+            return False
+        self.state = state
+        return True
+
 
 class CleaningStatus(enum.Enum):
     CLEAN = "clean"
@@ -356,4 +563,81 @@ class MealRegistration(db.Model):
         """Number of people who should be charged (relatives for lunch/dinner)"""
         if self.is_paid_meal:
             return self.relatives_count
-        return 0
\ No newline at end of file
+        return 0
+
+# ============================================================================
+# ARCHIVE (cold storage, see services/archive.py)
+# ============================================================================
+# Rows older than ARCHIVE_HORIZON_DAYS are moved out of the hot tables into
+# these copies (same ids and columns, no foreign keys), and the per-user /
+# per-room summaries carry their totals forward.
+
+class CreditTransactionArchive(db.Model):
+    __tablename__ = "credit_transaction_archive"
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    user_id = db.Column(db.Integer, index=True, nullable=False)
+    created_at = db.Column(db.DateTime, index=True, nullable=False)
+    posted_at = db.Column(db.DateTime, nullable=True)
+    delta_credits = db.Column(db.Integer, nullable=False)
+    tx_type = db.Column(db.Enum(TxType), nullable=False)
+    status = db.Column(db.Enum(TxStatus), nullable=False)
+    amount_dkk_ore = db.Column(db.Integer, nullable=True)
+    source = db.Column(db.String(64), nullable=True)
+    created_by_id = db.Column(db.Integer, nullable=True)
+    note = db.Column(db.String(280), nullable=True)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+
+class CreditLedgerSummary(db.Model):
+    """Carried-forward totals of a user's archived ledger rows (never PENDING ones)"""
+    __tablename__ = "credit_ledger_summary"
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete="CASCADE"), primary_key=True)
+    posted_total = db.Column(db.Integer, nullable=False, default=0)  # SUM(delta) of archived POSTED rows
+    tx_count = db.Column(db.Integer, nullable=False, default=0)
+    last_tx_id = db.Column(db.Integer, nullable=True)
+    archived_through = db.Column(db.DateTime, nullable=False)  # rows created before this are archived
+
+
+class CleaningLogArchive(db.Model):
+    __tablename__ = "cleaning_logs_archive"
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    room_id = db.Column(db.Integer, index=True, nullable=False)
+    cleaned_by_id = db.Column(db.Integer, nullable=False)
+    cleaned_at = db.Column(db.DateTime, index=True, nullable=False)
+    status_before = db.Column(db.Enum(CleaningStatus), nullable=False)
+    status_after = db.Column(db.Enum(CleaningStatus), nullable=False)
+    notes = db.Column(db.Text, nullable=True)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+
+class MealRegistrationArchive(db.Model):
+    __tablename__ = "meal_registrations_archive"
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    room_id = db.Column(db.Integer, index=True, nullable=False)
+    meal_type = db.Column(db.Enum(MealType), nullable=False)
+    date = db.Column(db.Date, index=True, nullable=False)
+    people_count = db.Column(db.Integer, nullable=False)
+    patients_count = db.Column(db.Integer, nullable=False)
+    relatives_count = db.Column(db.Integer, nullable=False)
+    registered_by_id = db.Column(db.Integer, nullable=False)
+    registered_at = db.Column(db.DateTime, nullable=False)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+
+class RoomArchiveSummary(db.Model):
+    """Carried-forward cleaning and meal totals of a room's archived rows"""
+    __tablename__ = "room_archive_summary"
+
+    room_id = db.Column(db.Integer, db.ForeignKey('rooms.id', ondelete="CASCADE"), primary_key=True)
+    cleanings = db.Column(db.Integer, nullable=False, default=0)
+    last_cleaned_at = db.Column(db.DateTime, nullable=True)
+    meal_registrations = db.Column(db.Integer, nullable=False, default=0)
+    people_total = db.Column(db.Integer, nullable=False, default=0)
+    patients_total = db.Column(db.Integer, nullable=False, default=0)
+    relatives_total = db.Column(db.Integer, nullable=False, default=0)
+    billable_total = db.Column(db.Integer, nullable=False, default=0)  # relatives at lunch/dinner
+    archived_through = db.Column(db.DateTime, nullable=False)
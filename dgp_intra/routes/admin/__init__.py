@@ -1,11 +1,20 @@
 # dgp_intra/routes/admin/__init__.py
-from flask import Blueprint, request, render_template, redirect, url_for, flash, abort, send_file
+from flask import Blueprint, request, render_template, redirect, url_for, flash, abort, send_file, current_app
+from flask import Response, stream_with_context, jsonify
 from flask_login import login_required, current_user
 from dgp_intra.extensions import db
 from dgp_intra.models import User, UserRole, Room, LunchRegistration, WeeklyMenu, BreakfastRegistration, PatientsMenu
-from dgp_intra.models import CreditTransaction, TxType, TxStatus
+from dgp_intra.models import CreditTransaction, TxType, TxStatus, CreditReconciliation, ReconciliationState
 from dgp_intra.utils.menu_extraction import extract_patients_menu_from_docx
 from dgp_intra.utils.menu_generator import generate_from_patients_menu_model
+from dgp_intra.services.dashboard import invalidate_shared
+from dgp_intra.services.credit import apply_balance_change
+from dgp_intra.services.ledger_search import parse_filters, apply_filters, search, search_terms
+from dgp_intra.services.exports import EXPORTS, FORMATS, stream_export
+from dgp_intra.services.reconciliation import run_reconciliation, repair_user, accept_user, STATE_NAME
+from dgp_intra.services.occupancy import summary as occupancy_summary
+from dgp_intra.utils.pagination import KeysetPage, keyset_paginate
+from dgp_intra.routes.klippekort.vipps import metrics as vipps_metrics
 from datetime import date, timedelta, datetime
 from collections import defaultdict
 from urllib.parse import urlparse, urljoin
@@ -63,11 +72,7 @@ def dashboard():
     total_owed = sum(u.owes for u in users_who_owe)
     
     # Room statistics
-    from dgp_intra.models import Room
-    rooms = Room.query.all()
-    total_rooms = len(rooms)
-    occupied_rooms = sum(1 for r in rooms if r.is_occupied)
-    rooms_need_cleaning = sum(1 for r in rooms if r.needs_cleaning)
+    rooms = occupancy_summary()
     
     # Recent activity (last 10 credit transactions)
     from dgp_intra.models import CreditTransaction
@@ -85,9 +90,9 @@ def dashboard():
         users_by_role=users_by_role,
         users_who_owe=users_who_owe,
         total_owed=total_owed,
-        total_rooms=total_rooms,
-        occupied_rooms=occupied_rooms,
-        rooms_need_cleaning=rooms_need_cleaning,
+        total_rooms=rooms.total_rooms,
+        occupied_rooms=rooms.occupied_rooms,
+        rooms_need_cleaning=rooms.rooms_need_cleaning,
         recent_transactions=recent_transactions
     )
 
@@ -166,6 +171,7 @@ def delete_user(user_id):
     user_name = user.name
     db.session.delete(user)
     db.session.commit()
+    invalidate_shared("absentees", "birthdays", "events")
     
     flash(f'Bruger {user_name} slettet', 'success')
     return redirect(url_for('admin.dashboard'))
@@ -231,12 +237,123 @@ def mark_paid(user_id):
     for tx in pending_purchases:
         tx.status = TxStatus.POSTED
         tx.posted_at = now
+    posted = sum(tx.delta_credits for tx in pending_purchases)
+    apply_balance_change(user.id, posted=posted, pending=-posted)
 
     db.session.commit()
     flash(f"{user.name} er markeret som betalt. ({len(pending_purchases)} køb bogført)")
     return redirect(url_for('admin.dashboard'))
 
 
+@bp.route("/transactions")
+def transactions():
+    """Search and browse the credit ledger across all users"""
+    # Admin-only route - handled by before_request
+    filters = parse_filters(request.args)
+    user_id = request.args.get("user_id", type=int)
+
+    q = apply_filters(CreditTransaction.query, filters)
+    if user_id:
+        q = q.filter(CreditTransaction.user_id == user_id)
+
+    if search_terms(filters["q"]):
+        limit = current_app.config.get("LEDGER_SEARCH_LIMIT", 100)
+        page = KeysetPage(items=search(q, filters["q"]).limit(limit).all())
+    else:
+        page = keyset_paginate(
+            q, CreditTransaction.created_at, CreditTransaction.id,
+            after=request.args.get("after"),
+            before=request.args.get("before"),
+            per_page=50,
+        )
+
+    return render_template(
+        'admin/transactions.html',
+        page=page,
+        users=User.query.order_by(User.name).all(),
+        filters=filters,
+        user_id=user_id,
+        f_from=request.args.get("from", ""),
+        f_to=request.args.get("to", ""),
+    )
+
+
+@bp.route("/export/<name>")
+def export(name):
+    """
+    Stream an export for accounting: /admin/export/transactions?format=csv&from=2025-01-01&to=2025-12-31
+    name: transactions, lunch or meals; format: csv (default) or jsonl (gzip).
+    Optional user_id filters by user (meals: who registered them).
+    """
+    # Admin-only route - handled by before_request
+    fmt = request.args.get("format", "csv")
+    if name not in EXPORTS or fmt not in FORMATS:
+        abort(404)
+
+    try:
+        first = datetime.strptime(request.args["from"], "%Y-%m-%d").date() if request.args.get("from") else None
+        last = datetime.strptime(request.args["to"], "%Y-%m-%d").date() if request.args.get("to") else None
+    except ValueError:
+        abort(400)
+    user_id = request.args.get("user_id", type=int)
+
+    mimetype, extension = FORMATS[fmt]
+    span = f"_{first or 'start'}_{last or date.today()}"
+    filename = f"{name}{span}.{extension}"
+    return Response(
+        stream_with_context(stream_export(name, fmt, first, last, user_id)),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+@bp.route("/reconciliation")
+def reconciliation():
+    """Users whose cached credit disagrees with the ledger"""
+    # Admin-only route - handled by before_request
+    state = db.session.get(ReconciliationState, STATE_NAME)
+    mismatches = (
+        db.session.query(CreditReconciliation, User)
+        .join(User, User.id == CreditReconciliation.user_id)
+        .filter(CreditReconciliation.mismatch.isnot(None))
+        .order_by(CreditReconciliation.flagged_at)
+        .all()
+    )
+    return render_template('admin/reconciliation.html', state=state, mismatches=mismatches)
+
+
+@bp.route("/reconciliation/run", methods=["POST"])
+def reconciliation_run():
+    result = run_reconciliation()
+    db.session.commit()
+    flash(f"Afstemning kørt: {result['processed']} nye transaktioner, {result['mismatches']} afvigelser.", 'success')
+    return redirect(url_for('admin.reconciliation'))
+
+
+@bp.route("/reconciliation/<int:user_id>/<action>", methods=["POST"])
+def reconciliation_resolve(user_id, action):
+    """repair: set the cached credit to the ledger balance; accept: keep the cached credit"""
+    if action == "repair":
+        ok = repair_user(user_id)
+    elif action == "accept":
+        ok = accept_user(user_id)
+    else:
+        abort(404)
+    if not ok:
+        flash("Bruger ikke fundet.", 'error')
+        return redirect(url_for('admin.reconciliation'))
+    db.session.commit()
+    flash("Saldoen er rettet." if action == "repair" else "Saldoen er godkendt.", 'success')
+    return redirect(url_for('admin.reconciliation'))
+
+
+@bp.route("/vipps/metrics")
+def vipps_metrics_view():
+    """Vipps call counts and latency for the worker answering this request"""
+    # Admin-only route - handled by before_request
+    return jsonify(vipps_metrics.snapshot())
+
+
 @bp.route("/menu", methods=["GET", "POST"])
 def menu_input():
     # Kitchen staff allowed - handled by before_request
@@ -283,6 +400,8 @@ def menu_input():
             flash("Patient menu gemt for denne uge.", "success")
         
         db.session.commit()
+        if menu_type == 'weekly':
+            invalidate_shared("menu")
         
         next_url = request.form.get('next') or url_for('admin.menu_input')
         if not _is_safe_url(next_url):
@@ -5,6 +5,7 @@ from datetime import datetime
 from dgp_intra.extensions import db
 from dgp_intra.models import BreakfastRegistration
 from dgp_intra.routes.shared import BREAKFAST_LOCK
+from dgp_intra.services.dashboard import invalidate_user
 
 bp = Blueprint("breakfast", __name__, url_prefix="/breakfast")
 
@@ -32,6 +33,7 @@ def register(date):
 
     db.session.add(BreakfastRegistration(date=reg_date, user_id=current_user.id))
     db.session.commit()
+    invalidate_user(current_user.id, "registrations")
     flash(f"Tilmeldt morgenmad {reg_date.strftime('%A %d/%m')} kl. 10:00")
     return redirect(url_for('dashboard.view'))
 
@@ -59,5 +61,6 @@ def cancel(date):
 
     db.session.delete(registration)
     db.session.commit()
+    invalidate_user(current_user.id, "registrations")
     flash(f"Din morgenmadstilmelding {reg_date.strftime('%A %d/%m')} er annulleret.")
     return redirect(url_for('dashboard.view'))
@@ -1,10 +1,13 @@
 # dgp_intra/routes/credit/__init__.py
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app
 from flask_login import login_required, current_user
 from datetime import datetime
-from sqlalchemy import func, or_
 from dgp_intra.extensions import db
-from dgp_intra.models import CreditTransaction, TxType, TxStatus
+from dgp_intra.models import CreditTransaction, TxType, TxStatus, CreditLedgerSummary
+from dgp_intra.services.credit import record_transaction, get_balance
+from dgp_intra.services.ledger_search import parse_filters, apply_filters, search, search_terms
+from dgp_intra.utils.idempotency import idempotent, next_idempotency_key
+from dgp_intra.utils.pagination import KeysetPage, keyset_paginate, capped_count
 
 bp = Blueprint("credit", __name__, url_prefix="/credit")
 
@@ -44,8 +47,10 @@ def _process_purchase(amount: int, success_redirect):
         source="purchase:web",
         created_by_id=user.id,
         note=f"Køb af {amount} klip (DKK {cost})",
+        idempotency_key=next_idempotency_key(),
     )
     db.session.add(tx)
+    record_transaction(tx)
 
     db.session.commit()
     flash(f"Du har købt {amount} klip. Du skylder nu {user.owes} DKK.")
@@ -54,6 +59,7 @@ def _process_purchase(amount: int, success_redirect):
 
 @bp.route("/buy", methods=["GET", "POST"])
 @login_required
+@idempotent()
 def buy():
     if request.method == "POST":
         amount = int(request.form.get('amount'))
@@ -62,6 +68,7 @@ def buy():
 
 @bp.route("/coupon", methods=["GET", "POST"])
 @login_required
+@idempotent()
 def coupon():
     if request.method == "POST":
         amount = int(request.form.get('amount'))
@@ -73,86 +80,60 @@ def coupon():
 # Ledger
 # -------------------------
 
-def _parse_date(s: str | None):
-    if not s:
-        return None
-    try:
-        return datetime.strptime(s, "%Y-%m-%d")
-    except Exception:
-        return None
-
 @bp.route("/ledger", methods=["GET"])
 @login_required
 def ledger():
-    # Filters
-    f_type   = request.args.get("type")      # purchase/spend/adjustment/refund
-    f_status = request.args.get("status")    # pending/posted/canceled
-    f_from   = _parse_date(request.args.get("from"))
-    f_to     = _parse_date(request.args.get("to"))
-    qtext    = (request.args.get("q") or "").strip()
-
-    q = CreditTransaction.query.filter(CreditTransaction.user_id == current_user.id)
-
-    if f_type:
-        try:
-            q = q.filter(CreditTransaction.tx_type == TxType(f_type))
-        except ValueError:
-            pass
-    if f_status:
-        try:
-            q = q.filter(CreditTransaction.status == TxStatus(f_status))
-        except ValueError:
-            pass
-    if f_from:
-        q = q.filter(CreditTransaction.created_at >= f_from)
-    if f_to:
-        end_of = f_to.replace(hour=23, minute=59, second=59, microsecond=999999)
-        q = q.filter(CreditTransaction.created_at <= end_of)
-    if qtext:
-        like = f"%{qtext}%"
-        q = q.filter(or_(CreditTransaction.source.ilike(like),
-                         CreditTransaction.note.ilike(like)))
-
-    # Pagination
-    try:
-        page = max(int(request.args.get("page", 1)), 1)
-    except Exception:
-        page = 1
-    per_page = 20
-    pagination = q.order_by(CreditTransaction.created_at.desc()).paginate(
-        page=page, per_page=per_page, error_out=False
-    )
-    items = pagination.items
-
-    # Totals (credits-based)
-    posted_balance = (
-        db.session.query(func.coalesce(func.sum(CreditTransaction.delta_credits), 0))
-        .filter(
-            CreditTransaction.user_id == current_user.id,
-            CreditTransaction.status == TxStatus.POSTED,
-        )
-        .scalar()
+    filters = parse_filters(request.args)
+    qtext = filters["q"]
+
+    q = apply_filters(
+        CreditTransaction.query.filter(CreditTransaction.user_id == current_user.id), filters
     )
-    pending_delta = (
-        db.session.query(func.coalesce(func.sum(CreditTransaction.delta_credits), 0))
-        .filter(
-            CreditTransaction.user_id == current_user.id,
-            CreditTransaction.status == TxStatus.PENDING,
-        )
-        .scalar()
+
+    if search_terms(qtext):
+        # Ranked full-text results: best matches first, capped instead of paginated
+        limit = current_app.config.get("LEDGER_SEARCH_LIMIT", 100)
+        items = search(q, qtext).limit(limit).all()
+        page = KeysetPage(items=items)
+        total, total_exact = len(items), len(items) < limit
+        return _render_ledger(page, total, total_exact, filters)
+
+    # Keyset pagination on (created_at, id): ?after=<cursor> for older rows,
+    # ?before=<cursor> for newer ones
+    page = keyset_paginate(
+        q, CreditTransaction.created_at, CreditTransaction.id,
+        after=request.args.get("after"),
+        before=request.args.get("before"),
+        per_page=20,
     )
 
+    # Approximate total, counted up to a cap (LEDGER_COUNT_CAP=0 disables it)
+    count_cap = current_app.config.get("LEDGER_COUNT_CAP", 1000)
+    total, total_exact = capped_count(q, CreditTransaction.id, count_cap) if count_cap else (None, False)
+
+    return _render_ledger(page, total, total_exact, filters)
+
+def _render_ledger(page, total, total_exact, filters):
+    # Totals (credits-based), read from the balance checkpoint
+    balance = get_balance(current_user.id)
+    posted_balance = balance.posted_total
+    pending_delta = balance.pending_total
+    db.session.commit()  # persist the checkpoint if it was just built
+
     return render_template(
         "ledger.html",
-        items=items,
-        pagination=pagination,
+        items=page.items,
+        page=page,
+        total=total,
+        total_exact=total_exact,
         TxType=TxType,
         TxStatus=TxStatus,
         posted_balance=posted_balance,
         pending_delta=pending_delta,
-        f_type=f_type,
-        f_status=f_status,
+        f_type=filters["type"],
+        f_status=filters["status"],
         f_from=request.args.get("from", ""),
         f_to=request.args.get("to", ""),
-        qtext=qtext,
+        qtext=filters["q"],
+        archived=db.session.get(CreditLedgerSummary, current_user.id),
     )
@@ -4,6 +4,7 @@ from flask_login import login_required, current_user
 from datetime import datetime, timedelta, date
 from dgp_intra.extensions import db
 from dgp_intra.models import Event, EventRegistration
+from dgp_intra.services.dashboard import invalidate_shared, invalidate_user
 
 bp = Blueprint("events", __name__, url_prefix="/events")
 
@@ -49,6 +50,7 @@ def create():
                       deadline=deadline, organizer_id=current_user.id)
         db.session.add(event)
         db.session.commit()
+        invalidate_shared("events")
         flash("Arrangementet er oprettet!", "success")
         return redirect(url_for('events.list'))
     return render_template('create_event.html')
@@ -62,6 +64,7 @@ def register(event_id):
     else:
         db.session.add(EventRegistration(user_id=current_user.id, event_id=event_id))
         db.session.commit()
+        invalidate_user(current_user.id, "registrations")
         flash("Du er tilmeldt arrangementet.")
     return redirect(url_for('events.list'))
 
@@ -74,6 +77,7 @@ def unregister(event_id):
     else:
         db.session.delete(reg)
         db.session.commit()
+        invalidate_user(current_user.id, "registrations")
         flash("Du er afmeldt arrangementet.", "success")
     return redirect(url_for('events.list'))
 
@@ -86,6 +90,7 @@ def delete(event_id):
         return redirect(url_for('events.list'))
     db.session.delete(event)
     db.session.commit()
+    invalidate_shared("events")
     flash("Arrangementet er slettet.", "success")
     return redirect(url_for('events.list'))
 
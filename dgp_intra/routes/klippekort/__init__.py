@@ -1,8 +1,9 @@
 from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app, session
 from flask_login import login_required, current_user
-from datetime import datetime
 from dgp_intra.extensions import db
-from dgp_intra.models import CreditTransaction, TxType, TxStatus, User
+from dgp_intra.models import PaymentState
+from dgp_intra.services import payments
+from dgp_intra.utils.idempotency import idempotent
 from .vipps import VippsClient, VippsAPIError
 import uuid
 
@@ -43,21 +44,8 @@ def initiate(amount):
     # Generate unique reference
     reference = f"dgp-{current_user.id}-{uuid.uuid4().hex[:8]}"
     
-    # Create pending transaction in our database
-    user = db.session.merge(current_user)
-    tx = CreditTransaction(
-        user_id=user.id,
-        created_at=datetime.utcnow(),
-        posted_at=None,
-        delta_credits=0,  # Will be granted after capture
-        tx_type=TxType.PURCHASE,
-        status=TxStatus.PENDING,
-        amount_dkk_ore=total_dkk * 100,
-        source=f"mobilepay:{reference}",
-        created_by_id=user.id,
-        note=f"MobilePay køb af {amount} klip - venter på betaling",
-    )
-    db.session.add(tx)
+    # Record the purchase; clips are granted when the payment is captured
+    payments.create_intent(current_user.id, reference, clips=amount, amount_dkk_ore=total_dkk * 100)
     db.session.commit()
     
     # Create payment with Vipps
@@ -78,10 +66,8 @@ def initiate(amount):
         current_app.logger.error(f"Vipps API error: {e}")
         flash("Der opstod en fejl ved oprettelse af betaling. Prøv igen senere.", "error")
         
-        # Mark transaction as failed
-        tx.status = TxStatus.CANCELED
-        tx.note = f"Fejl ved oprettelse: {str(e)}"
-        db.session.commit()
+        # Mark payment as failed
+        payments.fail_payment(reference, "CREATE_FAILED")
         
         return redirect(url_for('klippekort.cart'))
 
@@ -91,22 +77,14 @@ def initiate(amount):
 def callback():
     """User returns here after MobilePay"""
     
-    # Find the most recent PENDING MobilePay transaction for this user
-    tx = CreditTransaction.query.filter_by(
-        user_id=current_user.id,
-        status=TxStatus.PENDING
-    ).filter(
-        CreditTransaction.source.like('mobilepay:%')
-    ).order_by(
-        CreditTransaction.created_at.desc()
-    ).first()
+    # The user's most recent MobilePay payment
+    intent = payments.latest_intent(current_user.id)
     
-    if not tx:
+    if not intent:
         flash("Kunne ikke finde din betaling. Prøv venligst igen.", "error")
         return redirect(url_for('klippekort.cart'))
     
-    # Extract reference from source (format: "mobilepay:dgp-1-abc123")
-    reference = tx.source.split(':', 1)[1]
+    reference = intent.reference
     
     # Redirect to processing page WITH reference
     return redirect(url_for('klippekort.processing', ref=reference))
@@ -124,70 +102,94 @@ def processing():
     return render_template('klippekort/processing.html')
 
 
+def _status_final(response):
+    data = response.get_json(silent=True) or {}
+    return data.get("status") in ("success", "cancelled")
+
+
+def _status_response(intent):
+    """Poll answer from the payment's current state"""
+    if intent.state == PaymentState.CAPTURED:
+        return {
+            'status': 'success',
+            'message': f'Betaling gennemført! Du har fået {intent.clips} klip.',
+            'redirect': url_for('klippekort.success')
+        }
+    if intent.state == PaymentState.FAILED:
+        return {
+            'status': 'cancelled',
+            'message': 'Betaling annulleret',
+            'redirect': url_for('klippekort.cart')
+        }
+    if intent.state == PaymentState.AUTHORIZED:
+        return {'status': 'pending', 'message': 'Behandler betaling...'}
+    return {'status': 'pending', 'message': 'Venter på godkendelse...'}
+
+
 @bp.route("/status/<reference>")
 @login_required
+@idempotent(
+    # Overlapping polls are answered "pending"; a final outcome is replayed from the cache
+    key_func=lambda: f"mobilepay:{request.view_args['reference']}",
+    store_if=_status_final,
+    in_progress=lambda: {'status': 'pending', 'message': 'Behandler betaling...'},
+)
 def status(reference):
     """
     AJAX endpoint to check payment status
     Returns JSON with current state
+
+    Answered from the PaymentIntent, which the webhook keeps current. Vipps
+    is only asked when a payment has been quiet for VIPPS_STATUS_STALE_SECONDS,
+    by one poller per window.
+    """
+    intent = payments.find_intent(reference)
+    if intent is None or intent.user_id != current_user.id:
+        return {'status': 'error', 'message': 'Betaling ikke fundet'}
+
+    if intent.state in payments.OPEN_STATES and payments.is_stale(intent) and payments.claim_lookup(reference):
+        try:
+            intent = payments.lookup_payment(VippsClient(), reference)
+        except VippsAPIError as e:
+            current_app.logger.error(f"Error looking up payment {reference}: {e}")
+            return {'status': 'error', 'message': 'Kunne ikke hente status'}
+
+    return _status_response(intent)
+
+
+@bp.route("/webhook", methods=["POST"])
+def webhook():
+    """
+    Vipps ePayment webhook: payment state changes, signed with the webhook
+    secret (VIPPS_WEBHOOK_SECRET). Always acknowledged once verified, so Vipps
+    does not resend events for payments we do not know.
     """
+    secret = current_app.config.get('VIPPS_WEBHOOK_SECRET')
+    if not secret:
+        current_app.logger.error("Vipps webhook received but VIPPS_WEBHOOK_SECRET is not set")
+        return {'status': 'disabled'}, 503
+
+    body = request.get_data()
+    path = request.full_path if request.query_string else request.path
+    if not payments.verify_webhook(secret, request.method, path, request.host, request.headers, body):
+        return {'status': 'unauthorized'}, 401
+
+    event = request.get_json(silent=True) or {}
+    reference, state = event.get('reference'), event.get('name')
+    if not reference or not state:
+        return {'status': 'ignored'}, 200
+
+    if payments.find_intent(reference) is None:
+        current_app.logger.warning(f"Vipps webhook for unknown payment {reference} ({state})")
+        return {'status': 'ignored'}, 200
+
     try:
-        client = VippsClient()
-        payment = client.get_payment(reference)
-        
-        state = payment['state']
-        
-        if state == 'AUTHORIZED':
-            # Payment authorized - capture it!
-            try:
-                client.capture_payment(reference)
-                
-                # Find our transaction
-                tx = CreditTransaction.query.filter_by(
-                    source=f"mobilepay:{reference}"
-                ).first()
-                
-                if tx:
-                    # Grant credits
-                    user = db.session.get(User, tx.user_id)
-                    
-                    # Calculate amount from transaction
-                    amount_dkk = tx.amount_dkk_ore / 100
-                    clips = int(amount_dkk / current_app.config.get('KLIPPEKORT_PRICE_PER_CLIP', 24))
-                    
-                    user.credit += clips
-                    tx.delta_credits = clips
-                    tx.status = TxStatus.POSTED
-                    tx.posted_at = datetime.utcnow()
-                    tx.note = f"MobilePay betaling gennemført - {clips} klip"
-                    
-                    db.session.commit()
-                    
-                    return {
-                        'status': 'success',
-                        'message': f'Betaling gennemført! Du har fået {clips} klip.',
-                        'redirect': url_for('klippekort.success')
-                    }
-            
-            except Exception as e:
-                current_app.logger.error(f"Error capturing payment: {e}")
-                return {'status': 'error', 'message': 'Fejl ved gennemførelse'}
-        
-        elif state == 'ABORTED':
-            return {
-                'status': 'cancelled',
-                'message': 'Betaling annulleret',
-                'redirect': url_for('klippekort.cart')
-            }
-        
-        elif state == 'CREATED':
-            return {'status': 'pending', 'message': 'Venter på godkendelse...'}
-        
-        else:
-            return {'status': 'unknown', 'message': f'Ukendt status: {state}'}
-    
+        payments.apply_payment_state(VippsClient(), reference, state)
     except VippsAPIError as e:
-        return {'status': 'error', 'message': 'Kunne ikke hente status'}
+        # Not acknowledged: Vipps retries the event, and pollers fall back to a lookup
+        current_app.logger.error(f"Error handling Vipps webhook for {reference} ({state}): {e}")
+        return {'status': 'error'}, 502
+    return {'status': 'ok'}, 200
 
 
 @bp.route("/success")
@@ -1,11 +1,109 @@
 """
 Vipps MobilePay API client
 Works with both mock and production APIs
+
+Access tokens are shared by all workers through the app cache (Redis, or the
+in-process LRU when Redis is unavailable), so a new VippsClient per request
+does not mean a new /accesstoken/get round trip.
+
+Requests go through one pooled requests.Session per process (keep-alive, so
+no TCP/TLS setup per call) with connect/read timeouts. Calls are retried on
+connection errors and 429/502/503/504 with jittered backoff; payment POSTs
+carry an Idempotency-Key so a retry never creates or captures twice.
+Latency per endpoint is recorded in `metrics` (see /admin/vipps/metrics).
 """
+import hashlib
+import os
+import random
+import threading
+import time
 import requests
+from requests.adapters import HTTPAdapter
 from flask import current_app
+from dgp_intra.utils.cache import get_cache
 import uuid
 
+TOKEN_REFRESH_MARGIN = 60   # seconds before expiry a token is refreshed
+TOKEN_LOCK_TTL = 10         # seconds one worker may spend fetching a token
+TOKEN_WAIT = 5              # seconds other workers wait for that fetch
+
+RETRY_STATUSES = {429, 502, 503, 504}
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """The process-wide pooled session (recreated after a fork)"""
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _session_lock:
+            if _session is None or _session_pid != pid:
+                pool_size = current_app.config.get('VIPPS_POOL_SIZE', 10)
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session, _session_pid = session, pid
+    return _session
+
+
+class VippsMetrics:
+    """Per-endpoint call counts and latency histogram for this process"""
+
+    BUCKETS_MS = (25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def observe(self, endpoint, seconds, outcome, retry=False):
+        """outcome: HTTP status code, or 'timeout' / 'connection'"""
+        ms = seconds * 1000
+        with self._lock:
+            m = self._endpoints.setdefault(endpoint, {
+                'count': 0, 'errors': 0, 'retries': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                'buckets': [0] * (len(self.BUCKETS_MS) + 1), 'outcomes': {},
+            })
+            m['count'] += 1
+            m['retries'] += int(retry)
+            m['errors'] += int(not isinstance(outcome, int) or outcome >= 400)
+            m['total_ms'] += ms
+            m['max_ms'] = max(m['max_ms'], ms)
+            m['buckets'][sum(1 for b in self.BUCKETS_MS if ms > b)] += 1
+            m['outcomes'][str(outcome)] = m['outcomes'].get(str(outcome), 0) + 1
+
+    def _percentile(self, buckets, count, q):
+        """Upper bound (ms) of the bucket holding the q-th quantile; None above the last bucket"""
+        target, seen = q * count, 0
+        for bound, n in zip(self.BUCKETS_MS, buckets):
+            seen += n
+            if seen >= target:
+                return bound
+        return None
+
+    def snapshot(self):
+        with self._lock:
+            endpoints = {name: dict(m, buckets=list(m['buckets']), outcomes=dict(m['outcomes']))
+                         for name, m in self._endpoints.items()}
+        for m in endpoints.values():
+            m['avg_ms'] = round(m['total_ms'] / m['count'], 1)
+            m['p50_ms'] = self._percentile(m['buckets'], m['count'], 0.5)
+            m['p95_ms'] = self._percentile(m['buckets'], m['count'], 0.95)
+            m['p99_ms'] = self._percentile(m['buckets'], m['count'], 0.99)
+            m['total_ms'] = round(m['total_ms'], 1)
+            m['max_ms'] = round(m['max_ms'], 1)
+        return {'pid': os.getpid(), 'buckets_ms': list(self.BUCKETS_MS), 'endpoints': endpoints}
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+
+
+metrics = VippsMetrics()
+
 
 class VippsAPIError(Exception):
     """Raised when Vipps API returns an error"""
@@ -21,13 +119,62 @@ class VippsClient:
         self.client_secret = current_app.config['VIPPS_CLIENT_SECRET']
         self.subscription_key = current_app.config['VIPPS_SUBSCRIPTION_KEY']
         self.msn = current_app.config['VIPPS_MSN']
+        self.timeout = (current_app.config.get('VIPPS_CONNECT_TIMEOUT', 3.05),
+                        current_app.config.get('VIPPS_READ_TIMEOUT', 10))
+        self.max_retries = current_app.config.get('VIPPS_MAX_RETRIES', 2)
+        self.retry_backoff = current_app.config.get('VIPPS_RETRY_BACKOFF', 0.25)
+        self.session = get_session()
         self._access_token = None
+        self._cache = get_cache()
+        account = hashlib.sha256(f"{self.base_url}|{self.client_id}|{self.msn}".encode()).hexdigest()[:16]
+        self._token_key = f"vipps:token:{account}"
+        self._lock_key = f"vipps:token-lock:{account}"
     
     def _get_token(self):
-        """Get access token (cached for this request)"""
+        """
+        Get access token, shared by all workers until shortly before it expires.
+        Only one worker refreshes at a time; the others keep using the old
+        token while it is still valid, or wait briefly for the new one.
+        """
         if self._access_token:
             return self._access_token
         
+        cached = self._cache.get(self._token_key)
+        now = time.time()
+        if cached and cached[1] - TOKEN_REFRESH_MARGIN > now:
+            self._access_token = cached[0]
+            return self._access_token
+        
+        if not self._cache.add(self._lock_key, 1, ttl=TOKEN_LOCK_TTL):
+            if cached and cached[1] > now:
+                self._access_token = cached[0]
+                return self._access_token
+            deadline = now + TOKEN_WAIT
+            while time.time() < deadline and self._cache.get(self._lock_key) is not None:
+                time.sleep(0.1)
+                cached = self._cache.get(self._token_key)
+                if cached and cached[1] > time.time():
+                    self._access_token = cached[0]
+                    return self._access_token
+            # The fetch failed, is stuck, or the cache is down: fetch ourselves
+        
+        try:
+            token, expires_in = self._fetch_token()
+            self._cache.set(self._token_key, (token, time.time() + expires_in), ttl=expires_in)
+        finally:
+            self._cache.delete(self._lock_key)
+        self._access_token = token
+        return token
+    
+    def _invalidate_token(self):
+        """Drop the shared token (after a 401) unless another worker already replaced it"""
+        cached = self._cache.get(self._token_key)
+        if cached and cached[0] == self._access_token:
+            self._cache.delete(self._token_key)
+        self._access_token = None
+    
+    def _fetch_token(self):
+        """(access_token, expires_in seconds) from /accesstoken/get"""
         url = f"{self.base_url}/accesstoken/get"
         headers = {
             'client_id': self.client_id,
@@ -36,24 +183,65 @@ class VippsClient:
             'Merchant-Serial-Number': self.msn,
         }
         
-        response = requests.post(url, headers=headers)
-        response.raise_for_status()
+        response = self._send('POST', url, 'POST /accesstoken/get', headers)
+        if not response.ok:
+            raise VippsAPIError(f"Vipps token error: {response.status_code} - {response.text}")
         
-        self._access_token = response.json()['access_token']
-        return self._access_token
+        data = response.json()
+        try:
+            expires_in = int(data.get('expires_in', 3600))  # Vipps sends it as a string
+        except (TypeError, ValueError):
+            expires_in = 3600
+        return data['access_token'], max(expires_in, 1)
     
-    def _make_request(self, method, endpoint, json=None):
-        """Make authenticated request to Vipps API"""
-        token = self._get_token()
+    def _send(self, method, url, label, headers, json=None):
+        """
+        One logical call: retried with full-jitter backoff on connection errors
+        and RETRY_STATUSES. Only used for idempotent calls (GET, token, and POSTs
+        carrying an Idempotency-Key).
+        """
+        attempts = 1 + self.max_retries
+        for attempt in range(attempts):
+            if attempt:
+                time.sleep(random.uniform(0, self.retry_backoff * 2 ** (attempt - 1)))
+            last = attempt + 1 == attempts
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, url, headers=headers, json=json, timeout=self.timeout)
+            except requests.Timeout as e:
+                metrics.observe(label, time.perf_counter() - start, 'timeout', retry=bool(attempt))
+                if last:
+                    raise VippsAPIError(f"Vipps API timeout: {label}") from e
+                continue
+            except requests.ConnectionError as e:
+                metrics.observe(label, time.perf_counter() - start, 'connection', retry=bool(attempt))
+                if last:
+                    raise VippsAPIError(f"Vipps API unreachable: {e}") from e
+                continue
+            metrics.observe(label, time.perf_counter() - start, response.status_code, retry=bool(attempt))
+            if response.status_code in RETRY_STATUSES and not last:
+                continue
+            return response
+    
+    def _make_request(self, method, endpoint, json=None, label=None, idempotency_key=None):
+        """Make authenticated request to Vipps API (retried once with a fresh token on 401)"""
         url = f"{self.base_url}{endpoint}"
-        headers = {
-            'Authorization': f'Bearer {token}',
-            'Ocp-Apim-Subscription-Key': self.subscription_key,
-            'Merchant-Serial-Number': self.msn,
-            'Content-Type': 'application/json',
-        }
-        
-        response = requests.request(method, url, headers=headers, json=json)
+        label = label or f"{method} {endpoint}"
+        for attempt in range(2):
+            token = self._get_token()
+            headers = {
+                'Authorization': f'Bearer {token}',
+                'Ocp-Apim-Subscription-Key': self.subscription_key,
+                'Merchant-Serial-Number': self.msn,
+                'Content-Type': 'application/json',
+            }
+            if idempotency_key:
+                headers['Idempotency-Key'] = idempotency_key
+            
+            response = self._send(method, url, label, headers, json=json)
+            if response.status_code != 401:
+                break
+            self._invalidate_token()
         
         if not response.ok:
             raise VippsAPIError(f"Vipps API error: {response.status_code} - {response.text}")
@@ -93,7 +281,8 @@ class VippsClient:
         if phone:
             payload["customer"] = {"phoneNumber": phone}
         
-        return self._make_request('POST', '/epayment/v1/payments', json=payload)
+        return self._make_request('POST', '/epayment/v1/payments', json=payload,
+                                  idempotency_key=f"create-{reference}")
     
     def get_payment(self, reference):
         """
@@ -102,7 +291,8 @@ class VippsClient:
         Returns:
             dict with payment state and details
         """
-        return self._make_request('GET', f'/epayment/v1/payments/{reference}')
+        return self._make_request('GET', f'/epayment/v1/payments/{reference}',
+                                  label='GET /epayment/v1/payments/{reference}')
     
     def capture_payment(self, reference, amount_dkk=None):
         """
@@ -119,8 +309,12 @@ class VippsClient:
                 "value": int(amount_dkk * 100)
             }
         
-        return self._make_request('POST', f'/epayment/v1/payments/{reference}/capture', json=payload)
+        return self._make_request('POST', f'/epayment/v1/payments/{reference}/capture', json=payload,
+                                  label='POST /epayment/v1/payments/{reference}/capture',
+                                  idempotency_key=f"capture-{reference}")
     
     def cancel_payment(self, reference):
         """Cancel a payment"""
-        return self._make_request('POST', f'/epayment/v1/payments/{reference}/cancel')
\ No newline at end of file
+        return self._make_request('POST', f'/epayment/v1/payments/{reference}/cancel',
+                                  label='POST /epayment/v1/payments/{reference}/cancel',
+                                  idempotency_key=f"cancel-{reference}")
\ No newline at end of file
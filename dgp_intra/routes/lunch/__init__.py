@@ -1,12 +1,14 @@
 # dgp_intra/routes/lunch/__init__.py
-from flask import Blueprint, redirect, url_for, flash, abort, request
+from flask import Blueprint, redirect, url_for, flash, abort, request, jsonify
 from flask_login import login_required, current_user
 from datetime import datetime, time as time_cls
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.exc import IntegrityError
 from dgp_intra.extensions import db
-from dgp_intra.models import (
-    LunchRegistration,
-    CreditTransaction, TxType, TxStatus
-)
+from dgp_intra.services import lunch
+from dgp_intra.services.dashboard import invalidate_user
+from dgp_intra.utils.idempotency import idempotent
+from dgp_intra.models import LunchRegistration, BreakfastRegistration, User, StandingOrder
 
 bp = Blueprint("lunch", __name__, url_prefix="/lunch")
 
@@ -22,27 +24,9 @@ def _is_locked(reg_date, today, now):
         return True
     return reg_date == today and now >= time_cls(9, 0)
 
-def _post_spend(user_id: int, delta: int, reg_date, note: str):
-    """
-    Write a posted ledger entry for lunch spend/refund.
-    delta: -1 for spend, +1 for refund
-    """
-    tx = CreditTransaction(
-        user_id=user_id,
-        created_at=datetime.utcnow(),
-        posted_at=datetime.utcnow(),
-        delta_credits=delta,
-        tx_type=TxType.SPEND if delta < 0 else TxType.REFUND,
-        status=TxStatus.POSTED,
-        amount_dkk_ore=None,  # optional; you only track credits here
-        source=f"lunch:{reg_date.isoformat()}",
-        created_by_id=user_id,
-        note=note,
-    )
-    db.session.add(tx)
-
 @bp.route("/register/<date>", methods=["POST"])
 @login_required
+@idempotent()
 def register(date):
     reg_date = _parse_date(date)
     if not reg_date:
@@ -55,40 +39,36 @@ def register(date):
         flash("Registrering er lukket for i dag (efter kl. 9).")
         return redirect(url_for('dashboard.view'))
 
-    # Already registered?
-    existing = LunchRegistration.query.filter_by(user_id=current_user.id, date=reg_date).first()
-    if existing:
-        flash("Allerede tilmeldt den dag.")
-        return redirect(url_for('dashboard.view'))
-
-    # Wednesday is free (weekday 2)
-    is_free = (reg_date.weekday() == 2)
+    user_id = current_user.id
+    free = lunch.is_free(reg_date)
 
-    # Need credit if not free
-    if not is_free and current_user.credit < 1:
-        flash("Ikke nok klip.")
+    # Slot 0 is the user's own registration; the unique key rejects duplicates
+    db.session.add(LunchRegistration(date=reg_date, user_id=user_id, slot=0))
+    try:
+        db.session.flush()
+    except IntegrityError:
+        db.session.rollback()
+        flash("Allerede tilmeldt den dag.")
         return redirect(url_for('dashboard.view'))
 
-    # Create registration
-    reg = LunchRegistration(date=reg_date, user_id=current_user.id)
-    db.session.add(reg)
-
-    # Adjust credit + write ledger
-    if not is_free:
-        current_user.credit -= 1
-        _post_spend(
-            user_id=current_user.id,
-            delta=-1,
-            reg_date=reg_date,
-            note=f"Frokost {reg_date.strftime('%d/%m')}",
-        )
+    # Debit + ledger row in the same transaction as the insert
+    if not free:
+        if not lunch.debit_credits(user_id, 1):
+            db.session.rollback()
+            flash("Ikke nok klip.")
+            return redirect(url_for('dashboard.view'))
+        lunch.insert_ledger_rows([
+            lunch.ledger_row(user_id, -1, reg_date, f"Frokost {reg_date.strftime('%d/%m')}")
+        ])
 
     db.session.commit()
+    invalidate_user(user_id, "registrations")
     flash(f"Tilmeldt frokost {reg_date.strftime('%A %d/%m')}")
     return redirect(url_for('dashboard.view'))
 
 @bp.route("/plus-one/<date>", methods=["POST"])
 @login_required
+@idempotent()
 def plus_one(date):
     reg_date = _parse_date(date)
     if not reg_date:
@@ -101,30 +81,41 @@ def plus_one(date):
         flash("Du kan ikke tilføje ekstra frokost efter kl. 9.")
         return redirect(url_for('dashboard.view'))
 
-    is_free = (reg_date.weekday() == 2)
-    if not is_free and current_user.credit < 1:
-        flash("Ikke nok klip til +1.")
+    user_id = current_user.id
+    free = lunch.is_free(reg_date)
+
+    # “+1” is another registration row in the next free guest slot (1, 2, ...)
+    next_slot = (
+        db.session.query(func.coalesce(func.max(LunchRegistration.slot), 0))
+        .filter(LunchRegistration.user_id == user_id, LunchRegistration.date == reg_date)
+        .scalar()
+    ) + 1
+    db.session.add(LunchRegistration(date=reg_date, user_id=user_id, slot=next_slot))
+    try:
+        db.session.flush()
+    except IntegrityError:
+        # A concurrent +1 took the same slot (double-click); only one is kept
+        db.session.rollback()
+        flash("Din +1 blev allerede registreret.")
         return redirect(url_for('dashboard.view'))
 
-    # “+1” is simply another registration row
-    plus = LunchRegistration(date=reg_date, user_id=current_user.id)
-    db.session.add(plus)
-
-    if not is_free:
-        current_user.credit -= 1
-        _post_spend(
-            user_id=current_user.id,
-            delta=-1,
-            reg_date=reg_date,
-            note=f"+1 frokost {reg_date.strftime('%d/%m')}",
-        )
+    if not free:
+        if not lunch.debit_credits(user_id, 1):
+            db.session.rollback()
+            flash("Ikke nok klip til +1.")
+            return redirect(url_for('dashboard.view'))
+        lunch.insert_ledger_rows([
+            lunch.ledger_row(user_id, -1, reg_date, f"+1 frokost {reg_date.strftime('%d/%m')}")
+        ])
 
     db.session.commit()
+    invalidate_user(user_id, "registrations")
     flash(f"Tilføjet +1 til {reg_date.strftime('%A %d/%m')}")
     return redirect(url_for('dashboard.view'))
 
 @bp.route("/cancel/<date>", methods=["POST"])
 @login_required
+@idempotent()
 def cancel(date):
     reg_date = _parse_date(date)
     if not reg_date:
@@ -137,24 +128,244 @@ def cancel(date):
         flash("Du kan ikke afmelde efter kl. 9.")
         return redirect(url_for('dashboard.view'))
 
-    registration = LunchRegistration.query.filter_by(user_id=current_user.id, date=reg_date).first()
-    if not registration:
+    user_id = current_user.id
+
+    # Guests (+1) are cancelled before the user's own registration
+    reg_id = (
+        db.session.query(LunchRegistration.id)
+        .filter(LunchRegistration.user_id == user_id, LunchRegistration.date == reg_date)
+        .order_by(LunchRegistration.slot.desc())
+        .limit(1)
+        .scalar()
+    )
+    # Only the request whose DELETE actually removed the row refunds it
+    deleted = 0
+    if reg_id is not None:
+        deleted = db.session.execute(
+            delete(LunchRegistration)
+            .where(LunchRegistration.id == reg_id)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+    if not deleted:
+        db.session.rollback()
         flash("Du er ikke tilmeldt den dag.")
         return redirect(url_for('dashboard.view'))
 
-    db.session.delete(registration)
-
-    is_free = (reg_date.weekday() == 2)
-    if not is_free:
+    if not lunch.is_free(reg_date):
         # Refund a clip and record REFUND
-        current_user.credit += 1
-        _post_spend(
-            user_id=current_user.id,
-            delta=+1,
-            reg_date=reg_date,
-            note=f"Afmeldt frokost {reg_date.strftime('%d/%m')}",
-        )
+        lunch.refund_credits(user_id, 1)
+        lunch.insert_ledger_rows([
+            lunch.ledger_row(user_id, +1, reg_date, f"Afmeldt frokost {reg_date.strftime('%d/%m')}")
+        ])
 
     db.session.commit()
+    invalidate_user(user_id, "registrations")
     flash(f"Din tilmelding til {reg_date.strftime('%A %d/%m')} er annulleret.")
     return redirect(url_for('dashboard.view'))
+
+
+# -------------------------
+# Batch (whole week)
+# -------------------------
+
+def _parse_date_list(values):
+    """Parse a list of YYYY-MM-DD strings; None if any entry is invalid"""
+    if values is None:
+        return []
+    if not isinstance(values, list):
+        return None
+    dates = [_parse_date(v) if isinstance(v, str) else None for v in values]
+    if any(d is None for d in dates):
+        return None
+    return sorted(set(dates))
+
+def _batch_conflict():
+    db.session.rollback()
+    return jsonify({'error': 'Tilmeldingerne blev ændret samtidig. Prøv igen.'}), 409
+
+@bp.route("/week", methods=["POST"])
+@login_required
+@idempotent()
+def week():
+    """
+    Register and/or cancel several days in one transaction.
+
+    Body: {"lunch": {"register": [dates], "cancel": [dates]},
+           "breakfast": {"register": [dates], "cancel": [dates]}}
+    Returns the new clip balance and a per-date outcome for each meal, so the
+    dashboard can update itself without reloading.
+    """
+    data = request.get_json(silent=True) or {}
+    lunch_req = data.get('lunch') or {}
+    breakfast_req = data.get('breakfast') or {}
+
+    lunch_register = _parse_date_list(lunch_req.get('register'))
+    lunch_cancel = _parse_date_list(lunch_req.get('cancel'))
+    breakfast_register = _parse_date_list(breakfast_req.get('register'))
+    breakfast_cancel = _parse_date_list(breakfast_req.get('cancel'))
+    if None in (lunch_register, lunch_cancel, breakfast_register, breakfast_cancel):
+        return jsonify({'error': 'Ugyldig dato'}), 400
+    if set(lunch_register) & set(lunch_cancel) or set(breakfast_register) & set(breakfast_cancel):
+        return jsonify({'error': 'Samme dag kan ikke både tilmeldes og afmeldes'}), 400
+
+    user_id = current_user.id
+    today = datetime.today().date()
+    now = datetime.now().time()
+    lunch_result, breakfast_result = {}, {}
+    ledger_rows = []
+    debit = 0
+
+    def open_dates(dates, result):
+        keep = []
+        for d in dates:
+            if _is_locked(d, today, now):
+                result[d.isoformat()] = 'locked'
+            else:
+                keep.append(d)
+        return keep
+
+    # --- Lunch: register (own registration = slot 0) ---
+    to_register = open_dates(lunch_register, lunch_result)
+    if to_register:
+        existing = set(db.session.scalars(
+            select(LunchRegistration.date).where(
+                LunchRegistration.user_id == user_id,
+                LunchRegistration.slot == 0,
+                LunchRegistration.date.in_(to_register),
+            )
+        ))
+        new_dates = [d for d in to_register if d not in existing]
+        for d in existing:
+            lunch_result[d.isoformat()] = 'already_registered'
+        if new_dates:
+            try:
+                db.session.execute(insert(LunchRegistration),
+                                   [dict(user_id=user_id, date=d, slot=0) for d in new_dates])
+            except IntegrityError:
+                # Another request registered one of the days meanwhile
+                return _batch_conflict()
+        for d in new_dates:
+            lunch_result[d.isoformat()] = 'registered'
+            if not lunch.is_free(d):
+                debit += 1
+                ledger_rows.append(lunch.ledger_row(user_id, -1, d, f"Frokost {d.strftime('%d/%m')}"))
+
+    # --- Lunch: cancel (the whole day, including any +1 guests) ---
+    to_cancel = open_dates(lunch_cancel, lunch_result)
+    if to_cancel:
+        rows = db.session.execute(
+            select(LunchRegistration.id, LunchRegistration.date).where(
+                LunchRegistration.user_id == user_id,
+                LunchRegistration.date.in_(to_cancel),
+            )
+        ).all()
+        ids = [r.id for r in rows]
+        if ids:
+            deleted = db.session.execute(
+                delete(LunchRegistration)
+                .where(LunchRegistration.id.in_(ids))
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            if deleted != len(ids):
+                # A concurrent request removed some of them; let the client retry
+                return _batch_conflict()
+        cancelled = {r.date for r in rows}
+        for d in to_cancel:
+            lunch_result[d.isoformat()] = 'cancelled' if d in cancelled else 'not_registered'
+        for r in rows:
+            if not lunch.is_free(r.date):
+                debit -= 1
+                ledger_rows.append(lunch.ledger_row(user_id, +1, r.date, f"Afmeldt frokost {r.date.strftime('%d/%m')}"))
+
+    # --- Breakfast (Fridays only, free) ---
+    for d in breakfast_register + breakfast_cancel:
+        if d.weekday() != 4:
+            breakfast_result[d.isoformat()] = 'invalid'
+    to_register = open_dates([d for d in breakfast_register if d.weekday() == 4], breakfast_result)
+    if to_register:
+        existing = set(db.session.scalars(
+            select(BreakfastRegistration.date).where(
+                BreakfastRegistration.user_id == user_id,
+                BreakfastRegistration.date.in_(to_register),
+            )
+        ))
+        new_dates = [d for d in to_register if d not in existing]
+        if new_dates:
+            db.session.execute(insert(BreakfastRegistration),
+                               [dict(user_id=user_id, date=d) for d in new_dates])
+        for d in to_register:
+            breakfast_result[d.isoformat()] = 'already_registered' if d in existing else 'registered'
+    to_cancel = open_dates([d for d in breakfast_cancel if d.weekday() == 4], breakfast_result)
+    if to_cancel:
+        cancelled = set(db.session.scalars(
+            select(BreakfastRegistration.date).where(
+                BreakfastRegistration.user_id == user_id,
+                BreakfastRegistration.date.in_(to_cancel),
+            )
+        ))
+        db.session.execute(
+            delete(BreakfastRegistration)
+            .where(BreakfastRegistration.user_id == user_id,
+                   BreakfastRegistration.date.in_(to_cancel))
+            .execution_options(synchronize_session=False)
+        )
+        for d in to_cancel:
+            breakfast_result[d.isoformat()] = 'cancelled' if d in cancelled else 'not_registered'
+
+    # --- One credit update and one ledger insert for the whole batch ---
+    if debit > 0:
+        if not lunch.debit_credits(user_id, debit):
+            db.session.rollback()
+            return jsonify({'error': 'Ikke nok klip.', 'needed': debit}), 409
+    elif debit < 0:
+        lunch.refund_credits(user_id, -debit)
+    lunch.insert_ledger_rows(ledger_rows)
+
+    db.session.commit()
+
+    invalidate_user(user_id, "registrations")
+    credit = db.session.scalar(select(User.credit).where(User.id == user_id))
+    return jsonify({
+        'success': True,
+        'credit': credit,
+        'lunch': lunch_result,
+        'breakfast': breakfast_result,
+    })
+
+
+# -------------------------
+# Standing order
+# -------------------------
+
+@bp.route("/standing-order", methods=["POST"])
+@login_required
+def standing_order():
+    """Save the weekdays the user wants lunch every week (0 = Monday ... 4 = Friday)"""
+    mask = 0
+    for value in request.form.getlist('weekdays'):
+        try:
+            day = int(value)
+        except ValueError:
+            abort(400)
+        if not 0 <= day <= 4:
+            abort(400)
+        mask |= 1 << day
+
+    order = StandingOrder.query.filter_by(user_id=current_user.id).first()
+    if mask == 0:
+        if order:
+            db.session.delete(order)
+            db.session.commit()
+        invalidate_user(current_user.id, "standing_order")
+        flash("Din faste tilmelding er stoppet.")
+        return redirect(url_for('dashboard.view'))
+
+    if not order:
+        order = StandingOrder(user_id=current_user.id, start_date=datetime.today().date())
+        db.session.add(order)
+    order.weekday_mask = mask
+    order.end_date = None
+    db.session.commit()
+    invalidate_user(current_user.id, "standing_order")
+    flash("Din faste tilmelding er gemt. Den bruges fra næste uge.")
+    return redirect(url_for('dashboard.view'))
@@ -5,6 +5,7 @@ from werkzeug.security import generate_password_hash
 from datetime import datetime
 from flask_mail import Message
 from dgp_intra.extensions import db, mail
+from dgp_intra.services.dashboard import invalidate_shared
 
 bp = Blueprint("profile", __name__, url_prefix="/me")
 
@@ -41,6 +42,7 @@ def dob_consent():
             flash("Ugyldig fødselsdato.", "danger")
             return redirect(url_for('dashboard.view'))
     db.session.commit()
+    invalidate_shared("birthdays")
     flash("Dine indstillinger er opdateret.", "success")
     return redirect(url_for('dashboard.view'))
 
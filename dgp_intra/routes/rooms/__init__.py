@@ -1,40 +1,60 @@
 # dgp_intra/routes/rooms/__init__.py
-from flask import Blueprint, render_template, request, jsonify, flash, redirect, url_for, abort
+from flask import Blueprint, render_template, request, jsonify, flash, redirect, url_for, abort, current_app, Response
 from flask_login import login_required, current_user
 from dgp_intra.extensions import db
-from dgp_intra.models import Room, CleaningLog, CleaningStatus, MealRegistration, MealType
+from dgp_intra.models import Room, CleaningLog, CleaningStatus, MealRegistration, MealType, RoomArchiveSummary
+from dgp_intra.services import occupancy as occupancy_service
+from dgp_intra.utils import events
 from datetime import datetime, date
+from sqlalchemy import insert, select
 
 bp = Blueprint("rooms", __name__, url_prefix="/rooms")
 
+EVENT_CHANNEL = "rooms"
+MAX_BATCH_OPERATIONS = 200
+
+
+def _room_state(room):
+    """What the room board shows for one room (sent to open boards as a live event)"""
+    return {
+        'id': room.id,
+        'room_number': room.room_number,
+        'patient_count': room.patient_count,
+        'relative_count': room.relative_count,
+        'total_occupants': room.total_occupants,
+        'is_occupied': room.is_occupied,
+        'cleaning_status': room.cleaning_status.value,
+        'needs_cleaning': room.needs_cleaning,
+        'checking_out_tomorrow': room.checking_out_tomorrow,
+        'last_cleaned_at': room.last_cleaned_at.strftime('%Y-%m-%d %H:%M') if room.last_cleaned_at else None,
+    }
+
+
+def _publish_changes(room_states=()):
+    """
+    After a commit: drop the cached occupancy summary and push the new room
+    states to open boards. Returns the new summary for the response.
+    """
+    occupancy_service.invalidate()
+    summary = occupancy_service.summary().as_dict()
+    events.publish(EVENT_CHANNEL, "rooms", {
+        'rooms': list(room_states),
+        'summary': summary,
+    })
+    return summary
+
 
 @bp.route("/")
 @login_required
 def index():
     """Display room status board for all users"""
-    from datetime import timedelta
-    from dgp_intra.models import DailyArrivalForecast
+    # Read before the rooms: live events after this id are replayed onto the page
+    broker = events.get_broker()
+    last_event_id = broker.last_id(EVENT_CHANNEL) if broker else None
     
     # Get all rooms ordered by floor and room number
     rooms = Room.query.order_by(Room.floor, Room.room_number).all()
-    
-    # Calculate current statistics
-    total_rooms = len(rooms)
-    occupied_rooms = sum(1 for r in rooms if r.is_occupied)
-    total_patients = sum(r.patient_count for r in rooms)
-    total_relatives = sum(r.relative_count for r in rooms)
-    total_people = total_patients + total_relatives
-    rooms_need_cleaning = sum(1 for r in rooms if r.needs_cleaning)
-    
-    # Calculate tomorrow's forecast
-    checking_out_rooms = [r for r in rooms if r.checking_out_tomorrow]
-    leaving_tomorrow = sum(r.total_occupants for r in checking_out_rooms)
-    
-    tomorrow_date = date.today() + timedelta(days=1)
-    forecast = DailyArrivalForecast.query.filter_by(date=tomorrow_date).first()
-    arriving_tomorrow = forecast.expected_arrivals if forecast else 0
-    
-    tomorrow_total = total_people - leaving_tomorrow + arriving_tomorrow
+    occupancy = occupancy_service.summary()
     
     # Group rooms by floor
     rooms_by_floor = {}
@@ -48,143 +68,161 @@ def index():
         rooms_by_floor=rooms_by_floor,
         can_manage_occupancy=current_user.is_patient_admin,
         can_manage_cleaning=current_user.is_cleaning_staff,
+        live_events=broker is not None,
+        last_event_id=last_event_id,
         # Current statistics
-        total_rooms=total_rooms,
-        occupied_rooms=occupied_rooms,
-        total_patients=total_patients,
-        total_relatives=total_relatives,
-        total_people=total_people,
-        rooms_need_cleaning=rooms_need_cleaning,
+        total_rooms=occupancy.total_rooms,
+        occupied_rooms=occupancy.occupied_rooms,
+        total_patients=occupancy.total_patients,
+        total_relatives=occupancy.total_relatives,
+        total_people=occupancy.total_people,
+        rooms_need_cleaning=occupancy.rooms_need_cleaning,
         # Tomorrow forecast
-        leaving_tomorrow=leaving_tomorrow,
-        arriving_tomorrow=arriving_tomorrow,
-        tomorrow_total=tomorrow_total,
-        tomorrow_date=tomorrow_date
+        leaving_tomorrow=occupancy.leaving_tomorrow,
+        arriving_tomorrow=occupancy.arriving_tomorrow,
+        tomorrow_total=occupancy.tomorrow_total,
+        tomorrow_date=occupancy.tomorrow_date
     )
 
 
-@bp.route("/update/<int:room_id>", methods=["POST"])
-@login_required
-def update_room(room_id):
-    """Update room status (occupancy or cleaning)"""
-    room = Room.query.get_or_404(room_id)
-    
-    data = request.get_json()
-    action = data.get('action')
-    
+def _apply_room_action(room, action, data, logs, now):
+    """
+    Apply one room action for the current user without committing; CleaningLog
+    rows it creates are appended to `logs` for one bulk insert. Returns
+    (error, status) if the action is refused - the room is then unchanged -
+    or None.
+    """
     # Handle occupancy changes (patient admins only)
-    if action in ['set_occupancy']:
+    if action == 'set_occupancy':
         if not current_user.is_patient_admin:
-            return jsonify({'error': 'Ingen tilladelse'}), 403
+            return 'Ingen tilladelse', 403
         
-        patient_count = int(data.get('patient_count', 0))
-        relative_count = int(data.get('relative_count', 0))
+        try:
+            patient_count = int(data.get('patient_count', 0))
+            relative_count = int(data.get('relative_count', 0))
+        except (TypeError, ValueError):
+            return 'Ugyldigt antal', 400
         
         # Validate counts
         if patient_count < 0 or patient_count > 2:
-            return jsonify({'error': 'Ugyldig antal patienter'}), 400
+            return 'Ugyldig antal patienter', 400
         if relative_count < 0 or relative_count > 1:
-            return jsonify({'error': 'Ugyldig antal pårørende'}), 400
+            return 'Ugyldig antal pårørende', 400
         
         room.patient_count = patient_count
         room.relative_count = relative_count
-        room.last_occupancy_change = datetime.utcnow()
+        room.last_occupancy_change = now
         
         # If checking out (setting to 0), mark as needs cleaning
         if patient_count == 0 and relative_count == 0 and room.cleaning_status == CleaningStatus.CLEAN:
             room.cleaning_status = CleaningStatus.NEEDS_CLEANING
-        
-        db.session.commit()
-        
-        return jsonify({
-            'success': True,
-            'room': {
-                'id': room.id,
-                'room_number': room.room_number,
-                'patient_count': room.patient_count,
-                'relative_count': room.relative_count,
-                'total_occupants': room.total_occupants,
-                'is_occupied': room.is_occupied,
-                'cleaning_status': room.cleaning_status.value,
-                'needs_cleaning': room.needs_cleaning
-            }
-        })
     
     # Handle cleaning status changes (cleaning staff only)
     elif action == 'mark_cleaned':
         if not current_user.is_cleaning_staff:
-            return jsonify({'error': 'Ingen tilladelse'}), 403
+            return 'Ingen tilladelse', 403
         
-        # Create cleaning log entry
-        log = CleaningLog(
-            room_id=room.id,
-            cleaned_by_id=current_user.id,
-            status_before=room.cleaning_status,
-            status_after=CleaningStatus.CLEAN
-        )
-        db.session.add(log)
-        
-        # Update room status
+        logs.append(dict(room_id=room.id, cleaned_by_id=current_user.id, cleaned_at=now,
+                         status_before=room.cleaning_status, status_after=CleaningStatus.CLEAN))
         room.cleaning_status = CleaningStatus.CLEAN
-        room.last_cleaned_at = datetime.utcnow()
+        room.last_cleaned_at = now
         room.last_cleaned_by_id = current_user.id
-        
-        db.session.commit()
-        
-        return jsonify({
-            'success': True,
-            'room': {
-                'id': room.id,
-                'room_number': room.room_number,
-                'cleaning_status': room.cleaning_status.value,
-                'needs_cleaning': room.needs_cleaning,
-                'last_cleaned_at': room.last_cleaned_at.strftime('%Y-%m-%d %H:%M') if room.last_cleaned_at else None
-            }
-        })
     
     elif action == 'mark_needs_cleaning':
         if not current_user.is_patient_admin:
-            return jsonify({'error': 'Ingen tilladelse'}), 403
-        
-        # Create cleaning log entry
-        log = CleaningLog(
-            room_id=room.id,
-            cleaned_by_id=current_user.id,
-            status_before=room.cleaning_status,
-            status_after=CleaningStatus.NEEDS_CLEANING
-        )
-        db.session.add(log)
+            return 'Ingen tilladelse', 403
         
+        logs.append(dict(room_id=room.id, cleaned_by_id=current_user.id, cleaned_at=now,
+                         status_before=room.cleaning_status, status_after=CleaningStatus.NEEDS_CLEANING))
         room.cleaning_status = CleaningStatus.NEEDS_CLEANING
-        
-        db.session.commit()
-        
-        return jsonify({
-            'success': True,
-            'room': {
-                'id': room.id,
-                'room_number': room.room_number,
-                'cleaning_status': room.cleaning_status.value,
-                'needs_cleaning': room.needs_cleaning
-            }
-        })
     
     elif action == 'toggle_checkout_tomorrow':
         if not current_user.is_patient_admin:
-            return jsonify({'error': 'Ingen tilladelse'}), 403
-        
-        checkout_tomorrow = data.get('checkout_tomorrow', False)
-        room.checking_out_tomorrow = checkout_tomorrow
-        
-        db.session.commit()
+            return 'Ingen tilladelse', 403
         
-        return jsonify({
-            'success': True,
-            'checking_out_tomorrow': room.checking_out_tomorrow
-        })
+        room.checking_out_tomorrow = bool(data.get('checkout_tomorrow', False))
     
     else:
-        return jsonify({'error': 'Ugyldig handling'}), 400
+        return 'Ugyldig handling', 400
+    
+    return None
+
+
+@bp.route("/update/<int:room_id>", methods=["POST"])
+@login_required
+def update_room(room_id):
+    """Update room status (occupancy or cleaning)"""
+    room = Room.query.get_or_404(room_id)
+    
+    data = request.get_json(silent=True) or {}
+    logs = []
+    error = _apply_room_action(room, data.get('action'), data, logs, datetime.utcnow())
+    if error:
+        return jsonify({'error': error[0]}), error[1]
+    
+    # Read before the commit expires the room
+    state = _room_state(room)
+    if logs:
+        db.session.execute(insert(CleaningLog), logs)
+    db.session.commit()
+    summary = _publish_changes([state])
+    
+    return jsonify({
+        'success': True,
+        'room': state,
+        'summary': summary,
+        'checking_out_tomorrow': state['checking_out_tomorrow'],
+    })
+
+
+@bp.route("/update/batch", methods=["POST"])
+@login_required
+def update_rooms_batch():
+    """
+    Apply several room actions in one transaction.
+
+    Body: {"operations": [{"room_id": 12, "action": "set_occupancy", "patient_count": 0,
+                           "relative_count": 0}, {"room_id": 12, "action": "mark_cleaned"}, ...]}
+    Operations run in order with the same permission rules as update_room.
+    Refused ones are reported and skipped; the rest are committed together.
+    Returns one result per operation and the new occupancy summary.
+    """
+    data = request.get_json(silent=True) or {}
+    operations = data.get('operations')
+    if not isinstance(operations, list) or not operations or not all(isinstance(op, dict) for op in operations):
+        return jsonify({'error': 'Ugyldige ændringer'}), 400
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        return jsonify({'error': f'Højst {MAX_BATCH_OPERATIONS} ændringer ad gangen'}), 400
+    
+    room_ids = {op.get('room_id') for op in operations if isinstance(op.get('room_id'), int)}
+    rooms = {room.id: room for room in db.session.scalars(select(Room).where(Room.id.in_(room_ids)))}
+    
+    now = datetime.utcnow()
+    results, logs, changed = [], [], {}
+    for op in operations:
+        room = rooms.get(op.get('room_id'))
+        if room is None:
+            results.append({'room_id': op.get('room_id'), 'error': 'Værelset findes ikke'})
+            continue
+        error = _apply_room_action(room, op.get('action'), op, logs, now)
+        if error:
+            results.append({'room_id': room.id, 'error': error[0]})
+            continue
+        changed[room.id] = _room_state(room)
+        results.append({'room_id': room.id, 'success': True, 'room': changed[room.id]})
+    
+    summary = None
+    if changed:
+        if logs:
+            db.session.execute(insert(CleaningLog), logs)
+        db.session.commit()
+        summary = _publish_changes(changed.values())
+    
+    return jsonify({
+        'success': all(r.get('success') for r in results),
+        'results': results,
+        'summary': summary,
+    })
 
 
 @bp.route("/forecast/update", methods=["POST"])
@@ -221,10 +259,40 @@ def update_forecast():
         db.session.add(forecast)
     
     db.session.commit()
+    summary = _publish_changes()
     
     return jsonify({
         'success': True,
-        'expected_arrivals': expected_arrivals
+        'expected_arrivals': expected_arrivals,
+        'summary': summary,
+    })
+
+
+@bp.route("/events")
+@login_required
+def room_events():
+    """Server-sent events with room and forecast changes for the room board"""
+    broker = events.get_broker()
+    if broker is None:
+        # Live events are off; 204 tells EventSource to stop reconnecting
+        return '', 204
+    
+    after = request.headers.get('Last-Event-ID') or request.args.get('after')
+    try:
+        after_id = int(after)
+    except (TypeError, ValueError):
+        after_id = broker.last_id(EVENT_CHANNEL)
+    
+    # The stream outlives the request; give the DB connection back now
+    db.session.remove()
+    stream = events.event_stream(
+        broker, EVENT_CHANNEL, after_id,
+        keepalive=current_app.config.get('LIVE_EVENTS_KEEPALIVE', 15),
+        duration=current_app.config.get('LIVE_EVENTS_STREAM_SECONDS', 300),
+    )
+    return Response(stream, mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',  # no proxy buffering
     })
 
 
@@ -243,7 +311,15 @@ def cleaning_logs():
         .all()
     )
     
-    return render_template('rooms/cleaning_logs.html', logs=logs)
+    # Totals carried forward for rows moved to the archive (services/archive.py)
+    archived = (
+        db.session.query(RoomArchiveSummary, Room.room_number)
+        .join(Room, Room.id == RoomArchiveSummary.room_id)
+        .order_by(Room.floor, Room.room_number)
+        .all()
+    )
+    
+    return render_template('rooms/cleaning_logs.html', logs=logs, archived=archived)
 
 
 @bp.route("/meal-planning")
@@ -446,9 +522,6 @@ def meal_summary():
     if not current_user.is_kitchen_staff:
         abort(403)
     
-    from datetime import timedelta
-    from dgp_intra.models import DailyArrivalForecast
-    
     today = date.today()
     
     # Get all registrations for today
@@ -473,28 +546,18 @@ def meal_summary():
         totals[meal_key]['count'] += reg.people_count
         totals[meal_key]['billable'] += reg.billable_count
     
-    # Calculate current and tomorrow forecast
-    rooms = Room.query.all()
-    current_occupancy = sum(r.total_occupants for r in rooms)
-    
-    checking_out_rooms = [r for r in rooms if r.checking_out_tomorrow]
-    leaving_tomorrow = sum(r.total_occupants for r in checking_out_rooms)
-    
-    tomorrow_date = today + timedelta(days=1)
-    forecast = DailyArrivalForecast.query.filter_by(date=tomorrow_date).first()
-    arriving_tomorrow = forecast.expected_arrivals if forecast else 0
-    
-    tomorrow_forecast = current_occupancy - leaving_tomorrow + arriving_tomorrow
+    # Current and tomorrow occupancy
+    occupancy = occupancy_service.summary(today)
     
     return render_template(
         'rooms/meal_summary.html',
         by_meal=by_meal,
         totals=totals,
         today=today,
-        current_occupancy=current_occupancy,
-        tomorrow_forecast=tomorrow_forecast,
-        leaving_tomorrow=leaving_tomorrow,
-        arriving_tomorrow=arriving_tomorrow
+        current_occupancy=occupancy.total_people,
+        tomorrow_forecast=occupancy.tomorrow_total,
+        leaving_tomorrow=occupancy.leaving_tomorrow,
+        arriving_tomorrow=occupancy.arriving_tomorrow
     )
 
 # ============================================================================
@@ -509,23 +572,12 @@ def kitchen_dashboard():
         abort(403)
     
     from datetime import timedelta
-    from dgp_intra.models import User, LunchRegistration, BreakfastRegistration, DailyArrivalForecast
-    from sqlalchemy import func
+    from dgp_intra.models import User, LunchRegistration, BreakfastRegistration
     
     today = date.today()
     
     # Current and tomorrow occupancy
-    rooms = Room.query.all()
-    current_occupancy = sum(r.total_occupants for r in rooms)
-    
-    checking_out_rooms = [r for r in rooms if r.checking_out_tomorrow]
-    leaving_tomorrow = sum(r.total_occupants for r in checking_out_rooms)
-    
-    tomorrow_date = today + timedelta(days=1)
-    forecast = DailyArrivalForecast.query.filter_by(date=tomorrow_date).first()
-    arriving_tomorrow = forecast.expected_arrivals if forecast else 0
-    
-    tomorrow_forecast = current_occupancy - leaving_tomorrow + arriving_tomorrow
+    occupancy = occupancy_service.summary(today)
     
     # Get this week's lunch registrations (staff)
     week_start = today - timedelta(days=today.weekday())
@@ -572,10 +624,10 @@ def kitchen_dashboard():
     
     return render_template(
         'rooms/kitchen_dashboard.html',
-        current_occupancy=current_occupancy,
-        tomorrow_forecast=tomorrow_forecast,
-        leaving_tomorrow=leaving_tomorrow,
-        arriving_tomorrow=arriving_tomorrow,
+        current_occupancy=occupancy.total_people,
+        tomorrow_forecast=occupancy.tomorrow_total,
+        leaving_tomorrow=occupancy.leaving_tomorrow,
+        arriving_tomorrow=occupancy.arriving_tomorrow,
         grouped_registrations=grouped_registrations,
         breakfast_users=breakfast_users,
         breakfast_count=len(breakfast_users),
@@ -1,5 +1,8 @@
 # dgp_intra/routes/shared.py
-from datetime import date as date_cls, time
+from calendar import isleap
+from datetime import date as date_cls, time, timedelta
+from sqlalchemy import and_, or_
+from dgp_intra.models import User
 
 BREAKFAST_LOCK = time(9, 0)
 
@@ -16,3 +19,49 @@ def next_birthday(dob: date_cls, today: date_cls) -> date_cls:
     if this_year >= today:
         return this_year
     return _safe_date(today.year + 1, dob.month, dob.day)
+
+def _ordinal(d: date_cls) -> int:
+    return d.month * 100 + d.day
+
+def _birthday_ranges(today: date_cls, days: int):
+    """
+    Split [today, today + days] into (low, high) dob_ordinal ranges, one per
+    calendar year touched. In non-leap years Feb 29 birthdays are celebrated
+    on Feb 28 (see _safe_date), so a range ending on 0228 is widened to 0229.
+    """
+    end = today + timedelta(days=days)
+    if end.year == today.year:
+        segments = [(today.year, _ordinal(today), _ordinal(end))]
+    else:
+        segments = [(today.year, _ordinal(today), 1231), (end.year, 101, _ordinal(end))]
+
+    ranges = []
+    for year, low, high in segments:
+        if high == 228 and not isleap(year):
+            high = 229
+        ranges.append((low, high))
+    return ranges
+
+def find_upcoming_birthdays(today: date_cls, days: int = 30):
+    """
+    Users with a public birthday within the next `days` days, soonest first.
+    One range scan on (pub_dob, dob_ordinal); only matching users are loaded.
+    """
+    ranges = _birthday_ranges(today, days)
+    users = User.query.filter(
+        User.pub_dob == True,
+        User.dob.isnot(None),
+        or_(*[and_(User.dob_ordinal >= low, User.dob_ordinal <= high) for low, high in ranges]),
+    ).all()
+
+    result = []
+    for u in users:
+        nb = next_birthday(u.dob, today)
+        result.append({
+            "user": u,
+            "date": nb,
+            "in_days": (nb - today).days,
+            "age": nb.year - u.dob.year,
+        })
+    result.sort(key=lambda x: (x["date"], x["user"].name or ""))
+    return result
@@ -3,6 +3,8 @@ from flask import Blueprint, redirect, url_for, flash, request, abort
 from flask_login import login_required, current_user
 from dgp_intra.extensions import db
 from dgp_intra.models import Vacation
+from dgp_intra.services.dashboard import invalidate_shared, invalidate_user
+from dgp_intra.services.vacations import cancel_registrations_during_vacations
 from datetime import datetime
 
 bp = Blueprint("vacations", __name__, url_prefix="/vacations")
@@ -22,7 +24,12 @@ def add():
 
         vacation = Vacation(user_id=current_user.id, start_date=start_date, end_date=end_date)
         db.session.add(vacation)
+        db.session.flush()
+        # Drop (and refund) meals already booked inside the new absence
+        cancel_registrations_during_vacations(vacation_id=vacation.id)
         db.session.commit()
+        invalidate_user(current_user.id, "vacations", "registrations")
+        invalidate_shared("absentees")
         flash("Din ferie/fravær er registreret.", "success")
     except Exception as e:
         print(f"[Vacation Error] {e}")
@@ -37,5 +44,7 @@ def delete(vacation_id):
         abort(403)
     db.session.delete(vacation)
     db.session.commit()
+    invalidate_user(current_user.id, "vacations")
+    invalidate_shared("absentees")
     flash("Fraværet er slettet.", "success")
     return redirect(url_for('dashboard.view'))
@@ -0,0 +1,126 @@
+# dgp_intra/services/archive.py
+"""
+Move old rows out of the hot tables into archive tables.
+
+credit_transaction, cleaning_logs and meal_registrations rows older than the
+horizon are copied to their *_archive twin (same ids and columns) and deleted,
+in id-ordered batches with a commit after each so locks stay short. Their
+totals are carried forward per user (CreditLedgerSummary) and per room
+(RoomArchiveSummary). Ledger totals (services/credit.py) and exports include
+them, so balances and reports stay correct.
+
+PENDING ledger rows are never archived: they still await payment.
+"""
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import select, insert, delete, literal, DateTime
+from dgp_intra.extensions import db
+from dgp_intra.models import (
+    CreditTransaction, CreditTransactionArchive, CreditLedgerSummary, TxStatus,
+    CleaningLog, CleaningLogArchive, MealRegistration, MealRegistrationArchive,
+    RoomArchiveSummary, MealType,
+)
+
+PAID_MEALS = (MealType.LUNCH, MealType.DINNER)
+
+
+def _move(hot, archive, condition, carry, batch_size, now):
+    """Copy+delete rows of `hot` matching `condition` in batches; carry(rows) updates summaries"""
+    names = [c.name for c in archive.__table__.columns if c.name != "archived_at"]
+    hot_cols = [hot.__table__.c[name] for name in names]
+    moved = 0
+    while True:
+        rows = db.session.execute(
+            select(*hot_cols).where(condition).order_by(hot.id).limit(batch_size).with_for_update()
+        ).all()
+        if not rows:
+            break
+        ids = [r.id for r in rows]
+        db.session.execute(
+            insert(archive).from_select(
+                names + ["archived_at"],
+                select(*hot_cols, literal(now, DateTime)).where(hot.id.in_(ids)),
+            )
+        )
+        db.session.execute(delete(hot).where(hot.id.in_(ids)).execution_options(synchronize_session=False))
+        carry(rows)
+        db.session.commit()
+        moved += len(rows)
+        if len(rows) < batch_size:
+            break
+    return moved
+
+
+def _room_summary(summaries, room_id, cutoff):
+    summary = summaries.get(room_id) or db.session.get(RoomArchiveSummary, room_id)
+    if summary is None:
+        summary = RoomArchiveSummary(room_id=room_id, cleanings=0, meal_registrations=0, people_total=0,
+                                     patients_total=0, relatives_total=0, billable_total=0,
+                                     archived_through=cutoff)
+        db.session.add(summary)
+    summary.archived_through = max(summary.archived_through, cutoff)
+    summaries[room_id] = summary
+    return summary
+
+
+def archive_ledger(cutoff: datetime, batch_size: int, now: datetime) -> int:
+    def carry(rows):
+        for r in rows:
+            summary = db.session.get(CreditLedgerSummary, r.user_id)
+            if summary is None:
+                summary = CreditLedgerSummary(user_id=r.user_id, posted_total=0, tx_count=0,
+                                              archived_through=cutoff)
+                db.session.add(summary)
+            if r.status == TxStatus.POSTED:
+                summary.posted_total += r.delta_credits
+            summary.tx_count += 1
+            summary.last_tx_id = max(summary.last_tx_id or 0, r.id)
+            summary.archived_through = max(summary.archived_through, cutoff)
+
+    return _move(
+        CreditTransaction, CreditTransactionArchive,
+        (CreditTransaction.created_at < cutoff) & (CreditTransaction.status != TxStatus.PENDING),
+        carry, batch_size, now,
+    )
+
+
+def archive_cleaning_logs(cutoff: datetime, batch_size: int, now: datetime) -> int:
+    def carry(rows):
+        summaries = {}
+        for r in rows:
+            summary = _room_summary(summaries, r.room_id, cutoff)
+            summary.cleanings += 1
+            if summary.last_cleaned_at is None or r.cleaned_at > summary.last_cleaned_at:
+                summary.last_cleaned_at = r.cleaned_at
+
+    return _move(CleaningLog, CleaningLogArchive, CleaningLog.cleaned_at < cutoff, carry, batch_size, now)
+
+
+def archive_meal_registrations(cutoff: datetime, batch_size: int, now: datetime) -> int:
+    def carry(rows):
+        summaries = {}
+        for r in rows:
+            summary = _room_summary(summaries, r.room_id, cutoff)
+            summary.meal_registrations += 1
+            summary.people_total += r.people_count
+            summary.patients_total += r.patients_count
+            summary.relatives_total += r.relatives_count
+            if r.meal_type in PAID_MEALS:
+                summary.billable_total += r.relatives_count
+
+    return _move(MealRegistration, MealRegistrationArchive, MealRegistration.date < cutoff.date(),
+                 carry, batch_size, now)
+
+
+def archive_old_rows(horizon_days: int | None = None, now: datetime | None = None) -> dict:
+    """Archive everything older than the horizon (ARCHIVE_HORIZON_DAYS). Commits per batch."""
+    now = now or datetime.utcnow()
+    horizon_days = horizon_days or current_app.config.get("ARCHIVE_HORIZON_DAYS", 730)
+    batch_size = current_app.config.get("ARCHIVE_BATCH_SIZE", 5000)
+    cutoff = datetime.combine((now - timedelta(days=horizon_days)).date(), datetime.min.time())
+    return {
+        "cutoff": cutoff.isoformat(),
+        "credit_transaction": archive_ledger(cutoff, batch_size, now),
+        "cleaning_logs": archive_cleaning_logs(cutoff, batch_size, now),
+        "meal_registrations": archive_meal_registrations(cutoff, batch_size, now),
+    }
@@ -1,10 +1,10 @@
 from datetime import datetime
-from sqlalchemy import select, func
-from sqlalchemy.orm import with_for_update
-from flask_sqlalchemy import SQLAlchemy
-from models import CreditTransaction, TxType, TxStatus
-from models import User
-from extensions import db
+from sqlalchemy import select, func, update, insert, bindparam, case
+from sqlalchemy.exc import IntegrityError
+from dgp_intra.models import CreditTransaction, TxType, TxStatus, CreditBalance, CreditLedgerSummary
+from dgp_intra.models import User
+from dgp_intra.extensions import db
+from dgp_intra.utils.idempotency import next_idempotency_key
 
 def _lock_user_row(user_id: int) -> User:
     # MySQL/MariaDB: SELECT ... FOR UPDATE
@@ -13,10 +13,128 @@ def _lock_user_row(user_id: int) -> User:
     ).scalar_one()
     return user
 
+# -------------------------
+# Balance checkpoints
+# -------------------------
+
+def apply_balance_changes(changes: dict[int, tuple[int, int]]) -> None:
+    """
+    Fold ledger changes into the per-user CreditBalance checkpoints.
+    changes maps user_id -> (posted delta, pending delta). Call it whenever
+    transactions are inserted or change status, in the same session transaction.
+    Users without a checkpoint yet get one rebuilt from the ledger.
+    """
+    if not changes:
+        return
+    db.session.flush()  # the ledger rows must be visible to MAX(id) / rebuilds
+
+    bal = CreditBalance.__table__
+    latest_id = (
+        select(func.max(CreditTransaction.id))
+        .where(CreditTransaction.user_id == bindparam("uid"))
+        .scalar_subquery()
+    )
+    params = [
+        {"uid": uid, "posted": posted, "pending": pending}
+        for uid, (posted, pending) in sorted(changes.items())
+    ]
+    result = db.session.execute(
+        update(bal)
+        .where(bal.c.user_id == bindparam("uid"))
+        .values(
+            posted_total=bal.c.posted_total + bindparam("posted"),
+            pending_total=bal.c.pending_total + bindparam("pending"),
+            last_tx_id=latest_id,
+            updated_at=datetime.utcnow(),
+        ),
+        params,
+    )
+    if result.rowcount != len(params):
+        existing = set(db.session.scalars(
+            select(bal.c.user_id).where(bal.c.user_id.in_(changes.keys()))
+        ))
+        for uid in changes.keys() - existing:
+            rebuild_balance(uid)
+
+def apply_balance_change(user_id: int, posted: int = 0, pending: int = 0) -> None:
+    apply_balance_changes({user_id: (posted, pending)})
+
+def record_transaction(tx: CreditTransaction) -> CreditTransaction:
+    """Count a newly added transaction in its user's checkpoint (by its current status)"""
+    db.session.flush()
+    if tx.status == TxStatus.POSTED:
+        apply_balance_change(tx.user_id, posted=tx.delta_credits)
+    elif tx.status == TxStatus.PENDING:
+        apply_balance_change(tx.user_id, pending=tx.delta_credits)
+    return tx
+
+def _ledger_totals(user_id: int) -> dict:
+    posted, pending, last_id = db.session.execute(
+        select(
+            func.coalesce(func.sum(case((CreditTransaction.status == TxStatus.POSTED,
+                                         CreditTransaction.delta_credits), else_=0)), 0),
+            func.coalesce(func.sum(case((CreditTransaction.status == TxStatus.PENDING,
+                                         CreditTransaction.delta_credits), else_=0)), 0),
+            func.max(CreditTransaction.id),
+        ).where(CreditTransaction.user_id == user_id)
+    ).one()
+    archived = db.session.get(CreditLedgerSummary, user_id)
+    if archived is not None:
+        # Rows moved to the archive (services/archive.py); they are never PENDING
+        posted += archived.posted_total
+        last_id = last_id if last_id is not None else archived.last_tx_id
+    return {"posted_total": int(posted), "pending_total": int(pending), "last_tx_id": last_id}
+
+def rebuild_balance(user_id: int) -> CreditBalance:
+    """Recompute a user's checkpoint from the full ledger and store it"""
+    db.session.flush()
+    totals = _ledger_totals(user_id)
+    bal = db.session.get(CreditBalance, user_id)
+    if bal is None:
+        try:
+            with db.session.begin_nested():
+                bal = CreditBalance(user_id=user_id, **totals)
+                db.session.add(bal)
+            return bal
+        except IntegrityError:
+            # Created concurrently; fall through and overwrite with our totals
+            bal = db.session.get(CreditBalance, user_id)
+    for k, v in totals.items():
+        setattr(bal, k, v)
+    bal.updated_at = datetime.utcnow()
+    return bal
+
+def get_balance(user_id: int) -> CreditBalance:
+    """The user's checkpoint, built from the ledger on first use"""
+    return db.session.get(CreditBalance, user_id) or rebuild_balance(user_id)
+
+def verify_balance(user_id: int, repair: bool = False) -> dict:
+    """
+    Compare a user's checkpoint with a full recomputation from the ledger.
+    Returns {"user_id", "stored", "expected", "ok"}; with repair=True a
+    mismatching (or missing) checkpoint is overwritten. Does not commit.
+    """
+    expected = _ledger_totals(user_id)
+    bal = db.session.get(CreditBalance, user_id)
+    stored = None
+    if bal is not None:
+        stored = {"posted_total": bal.posted_total, "pending_total": bal.pending_total,
+                  "last_tx_id": bal.last_tx_id}
+    # No checkpoint is fine for a user without ledger rows; get_balance() builds it on demand
+    ok = stored == expected or (stored is None and expected["last_tx_id"] is None)
+    if repair and not ok:
+        rebuild_balance(user_id)
+    return {"user_id": user_id, "stored": stored, "expected": expected, "ok": ok}
+
+# -------------------------
+# Posting
+# -------------------------
+
 def post_transaction(tx: CreditTransaction, prevent_negative=True) -> CreditTransaction:
     """
-    Move a transaction from PENDING to POSTED and update the user's cached balance.
-    Wrap your call in the same DB transaction (session).
+    Move a transaction from PENDING to POSTED and update the user's cached balance
+    and balance checkpoint. The transaction must already be counted as pending
+    (see record_transaction). Wrap your call in the same DB transaction (session).
     """
     if tx.status != TxStatus.PENDING:
         return tx  # idempotent-ish
@@ -36,22 +154,27 @@ def post_transaction(tx: CreditTransaction, prevent_negative=True) -> CreditTran
     user.credit = (user.credit or 0) + tx.delta_credits
 
     db.session.add_all([tx, user])
+    apply_balance_change(tx.user_id, posted=tx.delta_credits, pending=-tx.delta_credits)
     return tx
 
 def create_purchase(user_id: int, credits: int, amount_dkk_ore: int | None = None,
                     note: str | None = None, created_by_id: int | None = None,
-                    post_immediately=False) -> CreditTransaction:
+                    post_immediately=False, source: str | None = None,
+                    idempotency_key: str | None = None) -> CreditTransaction:
     tx = CreditTransaction(
         user_id=user_id,
         delta_credits=credits,
         tx_type=TxType.PURCHASE,
         status=TxStatus.PENDING if not post_immediately else TxStatus.POSTED,
         amount_dkk_ore=amount_dkk_ore,
+        source=source,
         note=note,
         created_by_id=created_by_id,
+        idempotency_key=idempotency_key,
         posted_at=datetime.utcnow() if post_immediately else None,
     )
     db.session.add(tx)
+    record_transaction(tx)
 
     if post_immediately:
         # Keep cache in sync if we skipped PENDING
@@ -71,6 +194,7 @@ def charge_for_lunch(user_id: int, date_str: str, created_by_id: int | None = No
         created_by_id=created_by_id
     )
     db.session.add(tx)
+    record_transaction(tx)
     post_transaction(tx)  # will lock user and prevent negative by default
     return tx
 
@@ -84,6 +208,7 @@ def cancel_lunch_restore(user_id: int, date_str: str, created_by_id: int | None
         created_by_id=created_by_id
     )
     db.session.add(tx)
+    record_transaction(tx)
     post_transaction(tx, prevent_negative=False)  # adding credits
     return tx
 
@@ -98,5 +223,88 @@ def adjustment(user_id: int, delta: int, note: str | None = None,
         created_by_id=created_by_id
     )
     db.session.add(tx)
+    record_transaction(tx)
     post_transaction(tx, prevent_negative=(delta < 0))
     return tx
+
+def _lock_user_rows(user_ids) -> dict[int, int]:
+    """Lock many user rows in one SELECT ... FOR UPDATE, in id order; returns {id: credit}"""
+    rows = db.session.execute(
+        select(User.id, User.credit)
+        .where(User.id.in_(sorted(set(user_ids))))
+        .order_by(User.id)
+        .with_for_update()
+    ).all()
+    return {uid: credit or 0 for uid, credit in rows}
+
+def post_transactions(batch: list[dict], prevent_negative=True, created_by_id: int | None = None) -> int:
+    """
+    Post many new transactions at once. Each item is a dict with user_id,
+    delta_credits and tx_type, plus optional source, note, amount_dkk_ore and
+    created_by_id.
+
+    All affected users are locked with one SELECT ... FOR UPDATE ordered by id
+    (so concurrent batches cannot deadlock), deltas are applied in memory in
+    batch order, and the results are written with one executemany UPDATE of
+    the balances and one multi-row ledger INSERT. With prevent_negative, a debit
+    that would take a user below zero raises ValueError before anything is
+    written. Wrap your call in the same DB transaction (session). Returns rows written.
+    """
+    batch = [item for item in batch if item["delta_credits"] != 0]
+    if not batch:
+        return 0
+
+    balances = _lock_user_rows(item["user_id"] for item in batch)
+    posted = {}
+    for item in batch:
+        uid, delta = item["user_id"], item["delta_credits"]
+        if uid not in balances:
+            raise ValueError(f"Unknown user {uid}")
+        if prevent_negative and delta < 0 and balances[uid] + delta < 0:
+            raise ValueError("Insufficient credit")
+        balances[uid] += delta
+        posted[uid] = posted.get(uid, 0) + delta
+
+    now = datetime.utcnow()
+    users = User.__table__
+    db.session.execute(
+        update(users)
+        .where(users.c.id == bindparam("uid"))
+        .values(credit=bindparam("credit")),
+        [{"uid": uid, "credit": balances[uid]} for uid in sorted(posted)],
+    )
+    db.session.execute(insert(CreditTransaction), [
+        dict(
+            user_id=item["user_id"],
+            created_at=now,
+            posted_at=now,
+            delta_credits=item["delta_credits"],
+            tx_type=item["tx_type"],
+            status=TxStatus.POSTED,
+            amount_dkk_ore=item.get("amount_dkk_ore"),
+            source=item.get("source"),
+            created_by_id=item.get("created_by_id", created_by_id),
+            note=item.get("note"),
+            idempotency_key=item.get("idempotency_key") or next_idempotency_key(),
+        )
+        for item in batch
+    ])
+    apply_balance_changes({uid: (delta, 0) for uid, delta in posted.items()})
+    return len(batch)
+
+def refund_many(refunds: list[dict], created_by_id: int | None = None) -> int:
+    """
+    Post many REFUND transactions at once through post_transactions().
+    Each refund is a dict with user_id, credits (> 0), source and note.
+    """
+    return post_transactions([
+        dict(
+            user_id=r["user_id"],
+            delta_credits=r["credits"],
+            tx_type=TxType.REFUND,
+            source=r.get("source"),
+            note=r.get("note"),
+        )
+        for r in refunds
+        if r["credits"] > 0
+    ], prevent_negative=False, created_by_id=created_by_id)
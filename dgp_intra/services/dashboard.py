@@ -0,0 +1,145 @@
+# dgp_intra/services/dashboard.py
+"""
+Cached data fragments for the dashboard.
+
+Shared fragments (menu, absentees, birthdays, upcoming events) are the same for
+every user; per-user fragments (registrations, own vacations, standing order)
+are keyed by user id and only cached in Redis, since the user's next page view
+after a change may be served by another worker. Fragments hold plain dicts so
+they can live in Redis. Routes that write the underlying rows call
+invalidate_shared()/invalidate_user() after committing.
+"""
+from flask import current_app
+from dgp_intra.extensions import db
+from dgp_intra.models import (
+    LunchRegistration, BreakfastRegistration, WeeklyMenu, Vacation, User, Event, EventRegistration,
+    StandingOrder
+)
+from dgp_intra.routes.shared import find_upcoming_birthdays
+from dgp_intra.utils.cache import cached, bump
+
+SHARED_FRAGMENTS = ("menu", "absentees", "birthdays", "events")
+USER_FRAGMENTS = ("registrations", "vacations", "standing_order")
+
+
+def _ttl():
+    return current_app.config.get('DASHBOARD_CACHE_TTL', 300)
+
+
+def invalidate_shared(*fragments):
+    """Drop shared fragments for all users, e.g. invalidate_shared("menu")"""
+    bump(*(f"dashboard:{name}" for name in fragments or SHARED_FRAGMENTS))
+
+
+def invalidate_user(user_id, *fragments):
+    """Drop one user's private fragments, e.g. invalidate_user(7, "registrations")"""
+    bump(*(f"dashboard:{name}:{user_id}" for name in fragments or USER_FRAGMENTS))
+
+
+# -------------------------
+# Shared fragments
+# -------------------------
+
+def weekly_menu(iso_week):
+    def load():
+        menu = WeeklyMenu.query.filter_by(week=iso_week).first()
+        if not menu:
+            return None
+        return {day: getattr(menu, day) for day in ("monday", "tuesday", "wednesday", "thursday", "friday")}
+    return cached("dashboard:menu", (iso_week,), load, ttl=_ttl())
+
+
+def absentees(day):
+    def load():
+        rows = (
+            db.session.query(Vacation.start_date, Vacation.end_date, User.name)
+            .join(User, Vacation.user_id == User.id)
+            .filter(Vacation.start_date <= day, Vacation.end_date >= day)
+            .order_by(User.name)
+            .all()
+        )
+        return [{"name": name, "start_date": start, "end_date": end} for start, end, name in rows]
+    return cached("dashboard:absentees", (day.isoformat(),), load, ttl=_ttl())
+
+
+def birthdays(day, days=30):
+    def load():
+        return [
+            {"name": b["user"].name, "date": b["date"], "in_days": b["in_days"], "age": b["age"]}
+            for b in find_upcoming_birthdays(day, days=days)
+        ]
+    return cached("dashboard:birthdays", (day.isoformat(), days), load, ttl=_ttl())
+
+
+def upcoming_events(day, limit=2):
+    def load():
+        rows = (
+            db.session.query(Event, User.name)
+            .join(User, Event.organizer_id == User.id)
+            .filter(Event.date >= day)
+            .order_by(Event.date.asc(), Event.time.asc())
+            .limit(limit)
+            .all()
+        )
+        return [{
+            "id": e.id,
+            "name": e.name,
+            "date": e.date,
+            "time": e.time,
+            "deadline": e.deadline,
+            "organizer_name": organizer_name,
+        } for e, organizer_name in rows]
+    return cached("dashboard:events", (day.isoformat(), limit), load, ttl=_ttl())
+
+
+# -------------------------
+# Per-user fragments
+# -------------------------
+
+def registrations(user_id, dates):
+    """Lunch/breakfast dates within `dates` and the ids of events the user joined"""
+    first, last = dates[0], dates[-1]
+
+    def load():
+        lunch = {
+            d for (d,) in db.session.query(LunchRegistration.date)
+            .filter(LunchRegistration.user_id == user_id,
+                    LunchRegistration.date >= first,
+                    LunchRegistration.date <= last)
+            .distinct()
+        }
+        breakfast = {
+            d for (d,) in db.session.query(BreakfastRegistration.date)
+            .filter(BreakfastRegistration.user_id == user_id,
+                    BreakfastRegistration.date >= first,
+                    BreakfastRegistration.date <= last)
+            .distinct()
+        }
+        events = {
+            event_id for (event_id,) in db.session.query(EventRegistration.event_id)
+            .filter(EventRegistration.user_id == user_id)
+        }
+        return {"lunch": lunch, "breakfast": breakfast, "events": events}
+    return cached(f"dashboard:registrations:{user_id}", (first.isoformat(), last.isoformat()), load, ttl=_ttl(), shared_only=True)
+
+
+def vacations(user_id):
+    def load():
+        rows = (
+            db.session.query(Vacation.id, Vacation.start_date, Vacation.end_date)
+            .filter(Vacation.user_id == user_id)
+            .order_by(Vacation.start_date)
+            .all()
+        )
+        return [{"id": vid, "start_date": start, "end_date": end} for vid, start, end in rows]
+    return cached(f"dashboard:vacations:{user_id}", (), load, ttl=_ttl(), shared_only=True)
+
+
+def standing_order_weekdays(user_id):
+    """Weekdays (0-4) of the user's standing lunch order, empty if none"""
+    def load():
+        mask = db.session.scalar(
+            db.select(StandingOrder.weekday_mask).where(StandingOrder.user_id == user_id)
+        )
+        return [i for i in range(5) if (mask or 0) & (1 << i)]
+    return cached(f"dashboard:standing_order:{user_id}", (), load, ttl=_ttl(), shared_only=True)
@@ -0,0 +1,178 @@
+# dgp_intra/services/exports.py
+"""
+Streaming exports of the ledger and meal registrations for accounting.
+
+Rows are read as plain column tuples (no ORM objects) through a server-side
+cursor (yield_per) and encoded chunk by chunk, so memory use is constant no
+matter how many rows an export contains. Routes wrap the generators in a
+streamed Response. Ledger and meal exports include archived rows.
+"""
+import csv
+import enum
+import io
+import json
+import zlib
+from datetime import date, datetime, timedelta
+from sqlalchemy import select, union_all
+from sqlalchemy.orm import aliased
+from dgp_intra.extensions import db
+from dgp_intra.models import (
+    CreditTransaction, CreditTransactionArchive, LunchRegistration, MealRegistration,
+    MealRegistrationArchive, Room, User,
+)
+
+CHUNK_ROWS = 1000  # rows fetched per round trip and encoded per chunk
+
+
+def _transactions(first, last, user_id):
+    def part(tx):
+        stmt = (
+            select(
+                tx.id,
+                tx.user_id,
+                User.name.label("user_name"),
+                User.email.label("user_email"),
+                tx.created_at,
+                tx.posted_at,
+                tx.delta_credits,
+                tx.tx_type,
+                tx.status,
+                tx.amount_dkk_ore,
+                tx.source,
+                tx.note,
+                tx.created_by_id,
+            )
+            .join(User, User.id == tx.user_id)
+        )
+        if first:
+            stmt = stmt.where(tx.created_at >= datetime.combine(first, datetime.min.time()))
+        if last:
+            stmt = stmt.where(tx.created_at < datetime.combine(last + timedelta(days=1), datetime.min.time()))
+        if user_id:
+            stmt = stmt.where(tx.user_id == user_id)
+        return stmt
+
+    rows = union_all(part(CreditTransaction), part(CreditTransactionArchive)).subquery()
+    return select(rows).order_by(rows.c.created_at, rows.c.id)
+
+
+def _lunch(first, last, user_id):
+    stmt = (
+        select(
+            LunchRegistration.id,
+            LunchRegistration.date,
+            LunchRegistration.user_id,
+            User.name.label("user_name"),
+            User.email.label("user_email"),
+            LunchRegistration.slot,
+        )
+        .join(User, User.id == LunchRegistration.user_id)
+        .order_by(LunchRegistration.date, LunchRegistration.id)
+    )
+    if first:
+        stmt = stmt.where(LunchRegistration.date >= first)
+    if last:
+        stmt = stmt.where(LunchRegistration.date <= last)
+    if user_id:
+        stmt = stmt.where(LunchRegistration.user_id == user_id)
+    return stmt
+
+
+def _meals(first, last, user_id):
+    def part(meal):
+        registered_by = aliased(User)
+        stmt = (
+            select(
+                meal.id,
+                meal.date,
+                meal.meal_type,
+                Room.room_number,
+                meal.people_count,
+                meal.patients_count,
+                meal.relatives_count,
+                meal.registered_by_id,
+                registered_by.name.label("registered_by_name"),
+                meal.registered_at,
+            )
+            .join(Room, Room.id == meal.room_id)
+            .outerjoin(registered_by, registered_by.id == meal.registered_by_id)
+        )
+        if first:
+            stmt = stmt.where(meal.date >= first)
+        if last:
+            stmt = stmt.where(meal.date <= last)
+        if user_id:
+            stmt = stmt.where(meal.registered_by_id == user_id)
+        return stmt
+
+    rows = union_all(part(MealRegistration), part(MealRegistrationArchive)).subquery()
+    return select(rows).order_by(rows.c.date, rows.c.id)
+
+
+# name -> statement builder(first_date, last_date, user_id)
+EXPORTS = {
+    "transactions": _transactions,
+    "lunch": _lunch,
+    "meals": _meals,
+}
+
+FORMATS = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "jsonl": ("application/gzip", "jsonl.gz"),
+}
+
+
+def _plain(value):
+    if isinstance(value, enum.Enum):
+        return value.value
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+def _rows(stmt):
+    """(column names, iterator of plain-valued tuples) streamed from a server-side cursor"""
+    result = db.session.execute(stmt.execution_options(yield_per=CHUNK_ROWS))
+    columns = list(result.keys())
+
+    def rows():
+        try:
+            for partition in result.partitions():
+                yield [tuple(_plain(v) for v in row) for row in partition]
+        finally:
+            result.close()
+    return columns, rows()
+
+
+def csv_chunks(stmt):
+    columns, partitions = _rows(stmt)
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    buf.write("﻿")  # BOM so Excel opens æøå correctly
+    writer.writerow(columns)
+    for partition in partitions:
+        writer.writerows(partition)
+        yield buf.getvalue().encode("utf-8")
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode("utf-8")
+
+
+def jsonl_gzip_chunks(stmt):
+    columns, partitions = _rows(stmt)
+    gz = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 -> gzip container
+    for partition in partitions:
+        lines = "".join(
+            json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n" for row in partition
+        )
+        chunk = gz.compress(lines.encode("utf-8"))
+        if chunk:
+            yield chunk
+    yield gz.flush()
+
+
+def stream_export(name: str, fmt: str, first=None, last=None, user_id=None):
+    """Generator of encoded bytes for export `name` in format `fmt` (csv/jsonl)"""
+    stmt = EXPORTS[name](first, last, user_id)
+    return csv_chunks(stmt) if fmt == "csv" else jsonl_gzip_chunks(stmt)
@@ -0,0 +1,110 @@
+# dgp_intra/services/ledger_search.py
+"""
+Filtering and full-text search over CreditTransaction (source + note).
+
+Search is served by an index on every backend we run on:
+- MySQL: the FULLTEXT index ft_credit_transaction_source_note, queried with
+  MATCH ... AGAINST in boolean mode and ranked by its relevance score.
+- SQLite: the FTS5 shadow table credit_transaction_fts, kept in sync by
+  triggers (see models.py), ranked by bm25.
+Other databases fall back to ILIKE, newest first.
+
+Every search term must match, as a word prefix ("frok" finds "frokost").
+"""
+import re
+from datetime import datetime
+from sqlalchemy import or_, column, table, text
+from sqlalchemy.dialects.mysql import match
+from dgp_intra.extensions import db
+from dgp_intra.models import CreditTransaction, TxType, TxStatus
+
+FTS_TABLE = "credit_transaction_fts"
+MYSQL_MIN_TOKEN = 3  # innodb_ft_min_token_size; shorter terms are matched with LIKE
+
+_fts = table(FTS_TABLE, column("rowid"), column("rank"))
+
+
+def _parse_date(s: str | None):
+    if not s:
+        return None
+    try:
+        return datetime.strptime(s, "%Y-%m-%d")
+    except Exception:
+        return None
+
+
+def parse_filters(args) -> dict:
+    """The ledger filter parameters from a request's query string"""
+    return {
+        "type": args.get("type") or None,      # purchase/spend/adjustment/refund
+        "status": args.get("status") or None,  # pending/posted/canceled
+        "from": _parse_date(args.get("from")),
+        "to": _parse_date(args.get("to")),
+        "q": (args.get("q") or "").strip(),
+    }
+
+
+def apply_filters(query, filters: dict):
+    """Type/status/date filters (not the text search) applied to a CreditTransaction query"""
+    if filters.get("type"):
+        try:
+            query = query.filter(CreditTransaction.tx_type == TxType(filters["type"]))
+        except ValueError:
+            pass
+    if filters.get("status"):
+        try:
+            query = query.filter(CreditTransaction.status == TxStatus(filters["status"]))
+        except ValueError:
+            pass
+    if filters.get("from"):
+        query = query.filter(CreditTransaction.created_at >= filters["from"])
+    if filters.get("to"):
+        end_of = filters["to"].replace(hour=23, minute=59, second=59, microsecond=999999)
+        query = query.filter(CreditTransaction.created_at <= end_of)
+    return query
+
+
+def search_terms(qtext: str) -> list[str]:
+    return re.findall(r"\w+", (qtext or "").lower())
+
+
+def _like_all(query, terms):
+    for term in terms:
+        like = f"%{term}%"
+        query = query.filter(or_(CreditTransaction.source.ilike(like),
+                                 CreditTransaction.note.ilike(like)))
+    return query
+
+
+def search(query, qtext: str):
+    """
+    Restrict a CreditTransaction query to rows matching qtext and order it by
+    relevance (best first, then newest). Returns the query unchanged when
+    qtext has no searchable terms.
+    """
+    terms = search_terms(qtext)
+    if not terms:
+        return query
+    newest = (CreditTransaction.created_at.desc(), CreditTransaction.id.desc())
+    dialect = db.session.get_bind().dialect.name
+
+    if dialect == "mysql":
+        long_terms = [t for t in terms if len(t) >= MYSQL_MIN_TOKEN]
+        query = _like_all(query, [t for t in terms if len(t) < MYSQL_MIN_TOKEN])
+        if not long_terms:
+            return query.order_by(*newest)
+        score = match(
+            CreditTransaction.source, CreditTransaction.note,
+            against=" ".join(f"+{t}*" for t in long_terms),
+        ).in_boolean_mode()
+        return query.filter(score).order_by(score.desc(), *newest)
+
+    if dialect == "sqlite":
+        fts_query = " ".join(f'"{t}"*' for t in terms)
+        return (
+            query.join(_fts, _fts.c.rowid == CreditTransaction.id)
+            .filter(text(f"{FTS_TABLE} MATCH :fts_query").bindparams(fts_query=fts_query))
+            .order_by(_fts.c.rank, *newest)
+        )
+
+    return _like_all(query, terms).order_by(*newest)
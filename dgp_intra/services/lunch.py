@@ -0,0 +1,77 @@
+# dgp_intra/services/lunch.py
+"""
+Set-based helpers for lunch registrations and the credits they consume.
+
+The cached balance on User is only ever changed with conditional UPDATEs
+(`credit = credit - n WHERE credit >= n`), so the database decides whether a
+debit fits and no row is locked while Python code runs. Call these inside the
+same session transaction as the registration insert/delete and commit once.
+"""
+from datetime import datetime
+from sqlalchemy import update, insert
+from dgp_intra.extensions import db
+from dgp_intra.models import User, CreditTransaction, TxType, TxStatus
+from dgp_intra.services import credit
+from dgp_intra.utils.idempotency import next_idempotency_key
+
+FREE_WEEKDAY = 2  # Wednesday lunch is free
+
+
+def is_free(reg_date) -> bool:
+    return reg_date.weekday() == FREE_WEEKDAY
+
+
+def debit_credits(user_id: int, n: int = 1) -> bool:
+    """Take n clips from the user if they have them; False if the balance is too low"""
+    if n <= 0:
+        return True
+    result = db.session.execute(
+        update(User)
+        .where(User.id == user_id, User.credit >= n)
+        .values(credit=User.credit - n)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+
+def refund_credits(user_id: int, n: int = 1) -> None:
+    if n <= 0:
+        return
+    db.session.execute(
+        update(User)
+        .where(User.id == user_id)
+        .values(credit=User.credit + n)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def ledger_row(user_id: int, delta: int, reg_date, note: str, created_by_id: int | None = None) -> dict:
+    """
+    A posted ledger entry for lunch spend/refund, as a dict for insert_ledger_rows().
+    delta: negative for spend, positive for refund
+    """
+    now = datetime.utcnow()
+    return dict(
+        user_id=user_id,
+        created_at=now,
+        posted_at=now,
+        delta_credits=delta,
+        tx_type=TxType.SPEND if delta < 0 else TxType.REFUND,
+        status=TxStatus.POSTED,
+        amount_dkk_ore=None,
+        source=f"lunch:{reg_date.isoformat()}",
+        created_by_id=created_by_id if created_by_id is not None else user_id,
+        note=note,
+        idempotency_key=next_idempotency_key(),
+    )
+
+
+def insert_ledger_rows(rows: list[dict]) -> None:
+    """Write many posted ledger rows with a single multi-row INSERT"""
+    if not rows:
+        return
+    db.session.execute(insert(CreditTransaction), rows)
+    per_user = {}
+    for row in rows:
+        per_user[row["user_id"]] = per_user.get(row["user_id"], 0) + row["delta_credits"]
+    credit.apply_balance_changes({uid: (delta, 0) for uid, delta in per_user.items()})
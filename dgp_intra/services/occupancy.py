@@ -0,0 +1,93 @@
+# dgp_intra/services/occupancy.py
+"""
+House occupancy figures shared by the room board, the kitchen pages and the
+admin dashboard.
+
+All counts come from one aggregate query over rooms (tomorrow's arrival
+forecast rides along as a scalar subquery), and the result is cached per day
+in the shared Redis cache. Without Redis it is computed on every call, since
+an invalidate() in one worker would not reach the others' local caches.
+Routes that change room occupancy, cleaning status, check-outs or the
+forecast call invalidate() after committing.
+"""
+from dataclasses import dataclass, asdict
+from datetime import date, timedelta
+
+from flask import current_app
+from sqlalchemy import case, func, select
+
+from dgp_intra.extensions import db
+from dgp_intra.models import Room, CleaningStatus, DailyArrivalForecast
+from dgp_intra.utils.cache import cached, bump
+
+NAMESPACE = "occupancy"
+
+
+@dataclass(frozen=True)
+class OccupancySummary:
+    total_rooms: int = 0
+    occupied_rooms: int = 0
+    total_patients: int = 0
+    total_relatives: int = 0
+    rooms_need_cleaning: int = 0
+    leaving_tomorrow: int = 0      # occupants of rooms checking out tomorrow
+    arriving_tomorrow: int = 0     # from tomorrow's DailyArrivalForecast
+    tomorrow_date: date | None = None
+
+    @property
+    def total_people(self):
+        return self.total_patients + self.total_relatives
+
+    @property
+    def tomorrow_total(self):
+        return self.total_people - self.leaving_tomorrow + self.arriving_tomorrow
+
+    def as_dict(self):
+        """Plain dict (with the derived totals) for JSON and live events"""
+        return dict(asdict(self), total_people=self.total_people, tomorrow_total=self.tomorrow_total,
+                    tomorrow_date=self.tomorrow_date.isoformat() if self.tomorrow_date else None)
+
+
+def invalidate():
+    bump(NAMESPACE)
+
+
+def _load(tomorrow):
+    patients = func.coalesce(Room.patient_count, 0)
+    relatives = func.coalesce(Room.relative_count, 0)
+    arrivals = (
+        select(DailyArrivalForecast.expected_arrivals)
+        .where(DailyArrivalForecast.date == tomorrow)
+        .scalar_subquery()
+    )
+    row = db.session.execute(
+        select(
+            func.count(Room.id),
+            func.sum(case((patients + relatives > 0, 1), else_=0)),
+            func.sum(patients),
+            func.sum(relatives),
+            func.sum(case((Room.cleaning_status == CleaningStatus.NEEDS_CLEANING, 1), else_=0)),
+            func.sum(case((Room.checking_out_tomorrow.is_(True), patients + relatives), else_=0)),
+            arrivals,
+        )
+    ).one()
+    # SUM over no rooms is NULL, and there may be no forecast yet
+    total, occupied, n_patients, n_relatives, need_cleaning, leaving, arriving = (int(v or 0) for v in row)
+    return OccupancySummary(
+        total_rooms=total,
+        occupied_rooms=occupied,
+        total_patients=n_patients,
+        total_relatives=n_relatives,
+        rooms_need_cleaning=need_cleaning,
+        leaving_tomorrow=leaving,
+        arriving_tomorrow=arriving,
+        tomorrow_date=tomorrow,
+    )
+
+
+def summary(today=None):
+    """OccupancySummary for today (cached in Redis until a room or the forecast changes)"""
+    tomorrow = (today or date.today()) + timedelta(days=1)
+    ttl = current_app.config.get('DASHBOARD_CACHE_TTL', 300)
+    return cached(NAMESPACE, (tomorrow.isoformat(),), lambda: _load(tomorrow), ttl=ttl,
+                  shared_only=True)
@@ -0,0 +1,358 @@
+# dgp_intra/services/payments.py
+"""
+MobilePay (Vipps ePayment) clip purchases.
+
+Each purchase is a PaymentIntent, looked up by its unique reference. Vipps
+reports state changes by webhook (routes/klippekort: webhook); they are
+recorded on the intent and drive its state machine. The browser's status
+polls are answered from the intent. Vipps is only asked directly
+(lookup_payment) when an open intent has had no news for
+VIPPS_STATUS_STALE_SECONDS, and then by one poller per window.
+
+Clips are granted at capture as a POSTED purchase in the ledger, linked from
+the intent (ledger_tx_id). Payments whose browser went away are settled in
+the background by settle_stale_payments().
+"""
+import base64
+import hashlib
+import hmac
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+from flask import current_app
+from sqlalchemy import select, update
+from dgp_intra.extensions import db
+from dgp_intra.models import CreditTransaction, TxType, TxStatus, PaymentIntent, PaymentState
+from dgp_intra.services.credit import create_purchase, post_transactions
+from dgp_intra.utils.cache import get_cache
+
+SIGNATURE_MAX_AGE = timedelta(minutes=5)
+CAPTURE_LOCK_TTL = 30   # seconds one caller may spend capturing a payment
+CAPTURE_WAIT = 10       # seconds other callers wait for that capture
+
+# Vipps states that end a payment without money changing hands
+FAILED_STATES = {"ABORTED", "EXPIRED", "CANCELLED", "TERMINATED"}
+OPEN_STATES = (PaymentState.CREATED, PaymentState.AUTHORIZED)
+
+
+def source_for(reference: str) -> str:
+    return f"mobilepay:{reference}"
+
+
+def find_intent(reference: str, lock: bool = False) -> PaymentIntent | None:
+    stmt = select(PaymentIntent).where(PaymentIntent.reference == reference)
+    stmt = stmt.execution_options(populate_existing=True)  # always the committed state
+    if lock:
+        stmt = stmt.with_for_update()
+    return db.session.execute(stmt).scalars().first()
+
+
+def latest_intent(user_id: int) -> PaymentIntent | None:
+    return (
+        PaymentIntent.query.filter_by(user_id=user_id)
+        .order_by(PaymentIntent.created_at.desc(), PaymentIntent.id.desc())
+        .first()
+    )
+
+
+def create_intent(user_id: int, reference: str, clips: int, amount_dkk_ore: int) -> PaymentIntent:
+    intent = PaymentIntent(reference=reference, user_id=user_id, clips=clips,
+                           amount_dkk_ore=amount_dkk_ore, state=PaymentState.CREATED)
+    db.session.add(intent)
+    return intent
+
+
+def is_stale(intent: PaymentIntent) -> bool:
+    """An open intent without news (webhook or lookup) for the stale window"""
+    window = current_app.config.get("VIPPS_STATUS_STALE_SECONDS", 15)
+    return datetime.utcnow() - intent.updated_at >= timedelta(seconds=window)
+
+
+def claim_lookup(reference: str) -> bool:
+    """True for at most one caller per reference per stale window"""
+    window = current_app.config.get("VIPPS_STATUS_STALE_SECONDS", 15)
+    return get_cache().add(f"vipps:lookup:{reference}", 1, ttl=window)
+
+
+# -------------------------
+# State changes
+# -------------------------
+
+def _legacy_tx(intent: PaymentIntent) -> CreditTransaction | None:
+    """The PENDING zero-delta ledger row that purchases made before PaymentIntent started with"""
+    if intent.ledger_tx_id is None:
+        return None
+    tx = db.session.get(CreditTransaction, intent.ledger_tx_id)
+    return tx if tx is not None and tx.status == TxStatus.PENDING else None
+
+
+def _retire_legacy_tx(intent: PaymentIntent) -> None:
+    """
+    Cancel the legacy zero-delta row of a captured payment; the clips are
+    booked as a new row, since ledger deltas never change after insert.
+    """
+    tx = _legacy_tx(intent)
+    if tx is not None:
+        tx.status = TxStatus.CANCELED
+        tx.note = "MobilePay betaling gennemført - bogført som ny postering"
+
+
+def _close(reference: str, state: PaymentState, vipps_state: str, now: datetime) -> PaymentIntent | None:
+    """
+    Move an open intent to a final state with one conditional UPDATE, so only
+    one caller wins even where SELECT ... FOR UPDATE is a no-op (SQLite).
+    Returns the intent if this caller closed it, else None.
+    """
+    closed = db.session.execute(
+        update(PaymentIntent)
+        .where(PaymentIntent.reference == reference, PaymentIntent.state.in_(OPEN_STATES))
+        .values(state=state, vipps_state=vipps_state, completed_at=now, updated_at=now)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    return find_intent(reference) if closed else None
+
+
+def complete_payment(reference: str) -> PaymentIntent | None:
+    """Grant the clips of a captured payment; a no-op unless the intent is open. Commits."""
+    intent = _close(reference, PaymentState.CAPTURED, "CAPTURED", datetime.utcnow())
+    if intent is None:
+        db.session.commit()
+        return find_intent(reference)
+
+    _retire_legacy_tx(intent)
+    note = f"MobilePay betaling gennemført - {intent.clips} klip"
+    # Keyed by the reference: a second grant fails on the unique index at INSERT
+    tx = create_purchase(intent.user_id, intent.clips, amount_dkk_ore=intent.amount_dkk_ore,
+                         note=note, created_by_id=intent.user_id, post_immediately=True,
+                         source=source_for(reference), idempotency_key=source_for(reference))
+    intent.ledger_tx_id = tx.id
+    db.session.commit()
+    return intent
+
+
+def fail_payment(reference: str, vipps_state: str) -> PaymentIntent | None:
+    """Close an open intent after Vipps reported `vipps_state`. Commits."""
+    intent = _close(reference, PaymentState.FAILED, vipps_state, datetime.utcnow())
+    if intent is None:
+        db.session.commit()
+        return find_intent(reference)
+    tx = _legacy_tx(intent)
+    if tx is not None:
+        tx.status = TxStatus.CANCELED
+        tx.note = f"MobilePay betaling afbrudt ({vipps_state.lower()})"
+    db.session.commit()
+    return intent
+
+
+def _record_vipps_state(reference: str, vipps_state: str) -> PaymentIntent | None:
+    intent = find_intent(reference, lock=True)
+    if intent is not None:
+        intent.vipps_state = vipps_state
+        intent.updated_at = datetime.utcnow()
+        if vipps_state == "AUTHORIZED":
+            intent.advance(PaymentState.AUTHORIZED)
+    db.session.commit()  # never hold the row lock across a Vipps call
+    return intent
+
+
+def _capture_lock(reference: str) -> str:
+    return f"vipps:capture:{reference}"
+
+
+def capture_once(client, reference: str) -> PaymentIntent | None:
+    """
+    Capture an authorized payment and grant its clips, one caller at a time per
+    reference (webhook, status polls, settlement). The others wait for that
+    caller's result instead of calling Vipps again; if it failed, the payment
+    stays AUTHORIZED for the next attempt.
+    """
+    cache = get_cache()
+    lock_key = _capture_lock(reference)
+    if not cache.add(lock_key, 1, ttl=CAPTURE_LOCK_TTL):
+        waited = False
+        deadline = time.time() + CAPTURE_WAIT
+        while time.time() < deadline and cache.get(lock_key) is not None:
+            waited = True
+            time.sleep(0.1)
+        intent = find_intent(reference)
+        db.session.commit()
+        if waited or intent is None or intent.state not in OPEN_STATES:
+            return intent
+        # Lock never seen (cache down): the Idempotency-Key and complete_payment keep this safe
+
+    try:
+        intent = find_intent(reference)
+        if intent is None or intent.state not in OPEN_STATES:
+            return intent
+        client.capture_payment(reference)
+        return complete_payment(reference)
+    finally:
+        cache.delete(lock_key)
+
+
+def apply_payment_state(client, reference: str, vipps_state: str) -> PaymentIntent | None:
+    """
+    Act on a Vipps state (from webhook or lookup): capture authorized payments,
+    grant captured ones, close failed ones.
+    """
+    intent = _record_vipps_state(reference, vipps_state)
+    if intent is None or intent.state not in OPEN_STATES:
+        return intent
+    if vipps_state == "AUTHORIZED":
+        return capture_once(client, reference)
+    if vipps_state == "CAPTURED":
+        return complete_payment(reference)
+    if vipps_state in FAILED_STATES:
+        return fail_payment(reference, vipps_state)
+    return intent
+
+
+def lookup_payment(client, reference: str) -> PaymentIntent | None:
+    """Ask Vipps for the state of a stale payment and act on it"""
+    payment = client.get_payment(reference)
+    return apply_payment_state(client, reference, payment['state'])
+
+
+# -------------------------
+# Background settlement
+# -------------------------
+
+def _check_with_vipps(app, client, reference: str) -> tuple[str, bool]:
+    """
+    (Vipps state, whether we captured it) for one payment, capturing it if
+    authorized (runs in a worker thread). A payment someone else is capturing
+    is left to them. Our capture lock is held until settle_stale_payments()
+    has booked the result.
+    """
+    with app.app_context():
+        state = client.get_payment(reference)['state']
+        if state == "AUTHORIZED" and get_cache().add(_capture_lock(reference), 1, ttl=CAPTURE_LOCK_TTL):
+            try:
+                client.capture_payment(reference)
+            except Exception:
+                get_cache().delete(_capture_lock(reference))
+                raise
+            return "CAPTURED", True
+        return state, False
+
+
+def settle_stale_payments(older_than_minutes: int | None = None, now: datetime | None = None) -> dict:
+    """
+    Settle open intents older than PAYMENT_SETTLE_AFTER_MINUTES whose browser
+    stopped polling: ask Vipps about all of them at once on a bounded thread
+    pool (VIPPS_SETTLE_WORKERS), capture the authorized ones, then book every
+    captured payment with one post_transactions() call. Commits.
+    """
+    now = now or datetime.utcnow()
+    older_than_minutes = older_than_minutes or current_app.config.get("PAYMENT_SETTLE_AFTER_MINUTES", 10)
+    limit = current_app.config.get("PAYMENT_SETTLE_BATCH", 200)
+    references = db.session.execute(
+        select(PaymentIntent.reference)
+        .where(PaymentIntent.state.in_(OPEN_STATES),
+               PaymentIntent.created_at < now - timedelta(minutes=older_than_minutes))
+        .order_by(PaymentIntent.id)
+        .limit(limit)
+    ).scalars().all()
+    result = {"checked": len(references), "captured": 0, "failed": 0, "open": 0, "errors": 0}
+    if not references:
+        return result
+
+    from dgp_intra.routes.klippekort.vipps import VippsClient
+    app = current_app._get_current_object()
+    client = VippsClient()
+    states, captured_here = {}, set()
+    workers = current_app.config.get("VIPPS_SETTLE_WORKERS", 8)
+    with ThreadPoolExecutor(max_workers=min(workers, len(references))) as pool:
+        futures = {ref: pool.submit(_check_with_vipps, app, client, ref) for ref in references}
+        for ref, future in futures.items():
+            try:
+                states[ref], captured = future.result()
+                if captured:
+                    captured_here.add(ref)
+            except Exception as e:
+                current_app.logger.error(f"Could not settle payment {ref}: {e}")
+                result["errors"] += 1
+
+    # Webhooks may have settled some meanwhile: only touch intents that are still open
+    intents = db.session.execute(
+        select(PaymentIntent)
+        .where(PaymentIntent.reference.in_(list(states)), PaymentIntent.state.in_(OPEN_STATES))
+        .order_by(PaymentIntent.id)
+        .with_for_update()
+    ).scalars().all()
+    purchases = []
+    for intent in intents:
+        state = states[intent.reference]
+        if state == "CAPTURED":
+            if _close(intent.reference, PaymentState.CAPTURED, state, now) is None:
+                continue  # booked by a webhook or poll meanwhile
+            result["captured"] += 1
+            _retire_legacy_tx(intent)
+            purchases.append(intent)
+        elif state in FAILED_STATES:
+            if _close(intent.reference, PaymentState.FAILED, state, now) is None:
+                continue
+            result["failed"] += 1
+            tx = _legacy_tx(intent)
+            if tx is not None:
+                tx.status = TxStatus.CANCELED
+                tx.note = f"MobilePay betaling afbrudt ({state.lower()})"
+        else:
+            intent.vipps_state, intent.updated_at = state, now
+            result["open"] += 1
+
+    post_transactions([
+        dict(
+            user_id=intent.user_id,
+            delta_credits=intent.clips,
+            tx_type=TxType.PURCHASE,
+            amount_dkk_ore=intent.amount_dkk_ore,
+            source=source_for(intent.reference),
+            note=f"MobilePay betaling gennemført - {intent.clips} klip",
+            created_by_id=intent.user_id,
+            idempotency_key=source_for(intent.reference),
+        )
+        for intent in purchases
+    ], prevent_negative=False)
+    if purchases:
+        ledger_ids = dict(db.session.execute(
+            select(CreditTransaction.idempotency_key, CreditTransaction.id)
+            .where(CreditTransaction.idempotency_key.in_([source_for(i.reference) for i in purchases]))
+        ).all())
+        for intent in purchases:
+            intent.ledger_tx_id = ledger_ids.get(source_for(intent.reference))
+    db.session.commit()
+    cache = get_cache()
+    for ref in captured_here:
+        cache.delete(_capture_lock(ref))
+    return result
+
+
+# -------------------------
+# Webhook verification
+# -------------------------
+
+def verify_webhook(secret: str, method: str, path_and_query: str, host: str, headers, body: bytes) -> bool:
+    """
+    Check a Vipps webhook's HMAC-SHA256 Authorization header: the signature
+    covers method, path, x-ms-date, host and the body's SHA-256.
+    """
+    content_hash = base64.b64encode(hashlib.sha256(body).digest()).decode()
+    if not hmac.compare_digest(headers.get("x-ms-content-sha256", ""), content_hash):
+        return False
+
+    date_header = headers.get("x-ms-date", "")
+    try:
+        sent_at = parsedate_to_datetime(date_header)
+    except (TypeError, ValueError):
+        return False
+    if sent_at.tzinfo is None:
+        sent_at = sent_at.replace(tzinfo=timezone.utc)
+    if abs(datetime.now(timezone.utc) - sent_at) > SIGNATURE_MAX_AGE:
+        return False
+
+    signed = f"{method}\n{path_and_query}\n{date_header};{host};{content_hash}"
+    signature = base64.b64encode(hmac.new(secret.encode(), signed.encode(), hashlib.sha256).digest()).decode()
+    expected = f"HMAC-SHA256 SignedHeaders=x-ms-date;host;x-ms-content-sha256&Signature={signature}"
+    return hmac.compare_digest(headers.get("Authorization", ""), expected)
@@ -0,0 +1,181 @@
+# dgp_intra/services/reconciliation.py
+"""
+Incremental check that the cached User.credit agrees with the ledger.
+
+Each run reads only the ledger rows added since the stored watermark and adds
+their deltas to a per-user expected balance (CreditReconciliation); then the
+expected balances are compared with User.credit. A user's baseline is their
+cached credit when the job first sees them, since older balances predate
+the ledger. Drift therefore means a change to User.credit without a
+matching ledger row, e.g. deduct_credits.py or a bug.
+
+The watermark alone would lose rows whose id was handed out before the
+watermark but committed after it (concurrent transactions). Such ids are
+kept in ReconciliationState.open_gaps and re-checked on later runs until
+they appear or expire (rolled back).
+
+Canceled transactions are not counted. Reading each row once is exact
+because a row's effect never changes after insert: CreditTransaction
+refuses changes to delta_credits and cancelling a row that has a delta, so
+corrections and late grants are always new rows.
+"""
+import json
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import select, update, insert, bindparam, func
+from dgp_intra.extensions import db
+from dgp_intra.models import (
+    CreditTransaction, TxStatus, User, CreditReconciliation, ReconciliationState
+)
+
+STATE_NAME = "credit"
+GAP_TTL = timedelta(minutes=10)  # uncommitted ids older than this are assumed rolled back
+
+
+def _load_gaps(state) -> dict[int, datetime]:
+    if not state.open_gaps:
+        return {}
+    return {int(k): datetime.fromisoformat(v) for k, v in json.loads(state.open_gaps).items()}
+
+
+def _dump_gaps(gaps: dict[int, datetime]) -> str | None:
+    return json.dumps({str(k): v.isoformat() for k, v in sorted(gaps.items())}) if gaps else None
+
+
+def _get_state():
+    state = db.session.get(ReconciliationState, STATE_NAME, with_for_update=True)
+    if state is None:
+        # First run: start from the current end of the ledger; every user's
+        # baseline is taken from their cached credit below.
+        latest = db.session.scalar(select(func.max(CreditTransaction.id))) or 0
+        state = ReconciliationState(name=STATE_NAME, watermark_tx_id=latest, last_processed=0,
+                                    last_mismatches=0)
+        db.session.add(state)
+    return state
+
+
+def run_reconciliation(repair: bool = False, now: datetime | None = None) -> dict:
+    """
+    Process new ledger rows, then flag users whose cached credit differs from
+    the expected balance, or repair them if repair=True. Does not commit.
+    """
+    now = now or datetime.utcnow()
+    batch_size = current_app.config.get("RECONCILE_BATCH_SIZE", 5000)
+    state = _get_state()
+    watermark = state.watermark_tx_id
+    gaps = _load_gaps(state)
+
+    cols = (CreditTransaction.id, CreditTransaction.user_id, CreditTransaction.delta_credits,
+            CreditTransaction.status)
+    new_rows = db.session.execute(
+        select(*cols).where(CreditTransaction.id > watermark).order_by(CreditTransaction.id).limit(batch_size)
+    ).all()
+    late_rows = db.session.execute(
+        select(*cols).where(CreditTransaction.id.in_(gaps.keys()))
+    ).all() if gaps else []
+
+    # Advance the watermark; remember skipped ids in case they commit later
+    seen = {r.id for r in new_rows}
+    new_watermark = max(seen, default=watermark)
+    for tx_id in range(watermark + 1, new_watermark):
+        if tx_id not in seen:
+            gaps[tx_id] = now
+    for r in late_rows:
+        gaps.pop(r.id, None)
+    gaps = {tx_id: first_seen for tx_id, first_seen in gaps.items() if now - first_seen < GAP_TTL}
+
+    deltas = {}
+    for r in (*new_rows, *late_rows):
+        if r.status != TxStatus.CANCELED:
+            deltas[r.user_id] = deltas.get(r.user_id, 0) + r.delta_credits
+
+    rec = CreditReconciliation.__table__
+    if deltas:
+        tracked = set(db.session.scalars(select(rec.c.user_id).where(rec.c.user_id.in_(deltas.keys()))))
+        params = [{"uid": uid, "d": d} for uid, d in sorted(deltas.items()) if uid in tracked]
+        if params:
+            db.session.execute(
+                update(rec)
+                .where(rec.c.user_id == bindparam("uid"))
+                .values(expected_credit=rec.c.expected_credit + bindparam("d"), updated_at=now),
+                params,
+            )
+
+    # Users seen for the first time: their cached credit (which already
+    # includes any rows above) becomes the baseline
+    untracked = db.session.execute(
+        select(User.id, User.credit).where(~select(rec.c.user_id).where(rec.c.user_id == User.id).exists())
+    ).all()
+    if untracked:
+        db.session.execute(insert(rec), [
+            {"user_id": uid, "expected_credit": credit or 0, "updated_at": now} for uid, credit in untracked
+        ])
+
+    # Compare (the user table is small; the ledger is never scanned)
+    flagged, cleared, repaired = 0, 0, 0
+    for uid, credit, expected, mismatch in db.session.execute(
+        select(User.id, User.credit, rec.c.expected_credit, rec.c.mismatch)
+        .join(rec, rec.c.user_id == User.id)
+    ):
+        diff = (credit or 0) - expected
+        if diff and repair:
+            if _set_credit(uid, expected, observed=credit):
+                repaired += 1
+                diff = 0
+        if diff:
+            flagged += 1
+            if diff != mismatch:
+                db.session.execute(
+                    update(rec).where(rec.c.user_id == uid)
+                    .values(mismatch=diff, flagged_at=func.coalesce(rec.c.flagged_at, now))
+                )
+        elif mismatch is not None:
+            cleared += 1
+            db.session.execute(update(rec).where(rec.c.user_id == uid).values(mismatch=None, flagged_at=None))
+
+    state.watermark_tx_id = new_watermark
+    state.open_gaps = _dump_gaps(gaps)
+    state.last_run_at = now
+    state.last_processed = len(new_rows) + len(late_rows)
+    state.last_mismatches = flagged
+
+    return {
+        "processed": state.last_processed,
+        "watermark": new_watermark,
+        "open_gaps": len(gaps),
+        "new_users": len(untracked),
+        "mismatches": flagged,
+        "cleared": cleared,
+        "repaired": repaired,
+    }
+
+
+def _set_credit(user_id: int, credit: int, observed=None) -> bool:
+    """Overwrite User.credit, only if it still holds `observed` when given"""
+    stmt = update(User).where(User.id == user_id).values(credit=credit)
+    if observed is not None:
+        stmt = stmt.where(User.credit == observed)
+    return db.session.execute(stmt.execution_options(synchronize_session=False)).rowcount == 1
+
+
+def repair_user(user_id: int) -> bool:
+    """Set the user's cached credit to the expected (ledger) balance. Does not commit."""
+    rec = db.session.get(CreditReconciliation, user_id, with_for_update=True)
+    if rec is None:
+        return False
+    _set_credit(user_id, rec.expected_credit)
+    rec.mismatch = None
+    rec.flagged_at = None
+    return True
+
+
+def accept_user(user_id: int) -> bool:
+    """Accept the user's cached credit as correct and make it the new baseline. Does not commit."""
+    rec = db.session.get(CreditReconciliation, user_id, with_for_update=True)
+    user = db.session.get(User, user_id)
+    if rec is None or user is None:
+        return False
+    rec.expected_credit = user.credit or 0
+    rec.mismatch = None
+    rec.flagged_at = None
+    return True
@@ -0,0 +1,83 @@
+# dgp_intra/services/vacations.py
+"""
+Cancel meal registrations that fall inside a user's recorded absence.
+
+One query per meal finds the rows inside a vacation (an EXISTS range check);
+they are deleted by id and lunch clips are refunded in bulk through
+services/credit.refund_many().
+Days that are already locked for the kitchen (past days, today after 09:00)
+are left alone.
+"""
+from datetime import datetime, timedelta, time
+from sqlalchemy import select, delete
+from dgp_intra.extensions import db
+from dgp_intra.models import LunchRegistration, BreakfastRegistration, Vacation
+from dgp_intra.services import credit, lunch
+
+REGISTRATION_LOCK = time(9, 0)  # same cut-off as the lunch and breakfast routes
+
+
+def _first_open_day(now=None):
+    now = now or datetime.now()
+    today = now.date()
+    return today if now.time() < REGISTRATION_LOCK else today + timedelta(days=1)
+
+
+def _overlapping(model, first_day, user_id=None, vacation_id=None):
+    """(id, user_id, date) of registrations inside any matching vacation"""
+    covered = (
+        select(Vacation.id)
+        .where(Vacation.user_id == model.user_id,
+               Vacation.start_date <= model.date,
+               Vacation.end_date >= model.date)
+    )
+    if vacation_id is not None:
+        covered = covered.where(Vacation.id == vacation_id)
+    # EXISTS rather than a join: no duplicates from overlapping vacations, and
+    # FOR UPDATE locks only the registration rows (MariaDB has no FOR UPDATE OF)
+    query = (
+        select(model.id, model.user_id, model.date)
+        .where(model.date >= first_day, covered.exists())
+        .with_for_update()
+    )
+    if user_id is not None:
+        query = query.where(model.user_id == user_id)
+    return db.session.execute(query).all()
+
+
+def cancel_registrations_during_vacations(user_id=None, vacation_id=None, now=None):
+    """
+    Delete lunch/breakfast registrations covered by vacations and refund the
+    paid lunches. Limit to one user or one vacation, or run for everyone.
+    Does not commit; returns the set of affected user ids.
+    """
+    first_day = _first_open_day(now)
+
+    lunch_rows = _overlapping(LunchRegistration, first_day, user_id, vacation_id)
+    breakfast_rows = _overlapping(BreakfastRegistration, first_day, user_id, vacation_id)
+
+    if lunch_rows:
+        db.session.execute(
+            delete(LunchRegistration)
+            .where(LunchRegistration.id.in_([r.id for r in lunch_rows]))
+            .execution_options(synchronize_session=False)
+        )
+    if breakfast_rows:
+        db.session.execute(
+            delete(BreakfastRegistration)
+            .where(BreakfastRegistration.id.in_([r.id for r in breakfast_rows]))
+            .execution_options(synchronize_session=False)
+        )
+
+    credit.refund_many([
+        dict(
+            user_id=r.user_id,
+            credits=1,
+            source=f"lunch:{r.date.isoformat()}",
+            note=f"Afmeldt frokost {r.date.strftime('%d/%m')} (fravær)",
+        )
+        for r in lunch_rows
+        if not lunch.is_free(r.date)
+    ])
+
+    return {r.user_id for r in lunch_rows} | {r.user_id for r in breakfast_rows}
@@ -0,0 +1,15 @@
+# dgp_intra/tasks/archive.py
+import datetime
+from dgp_intra.services import archive
+
+
+def archive_old_rows():
+    """
+    Monthly: move ledger, cleaning-log and meal rows older than
+    ARCHIVE_HORIZON_DAYS into the archive tables. See services/archive.py.
+    """
+    print("[Archive] Running at:", datetime.datetime.now().isoformat())
+    result = archive.archive_old_rows()
+    print(f"[Archive] Before {result['cutoff']}: {result['credit_transaction']} ledger rows, "
+          f"{result['cleaning_logs']} cleaning logs, {result['meal_registrations']} meal registrations archived")
+    return result
@@ -0,0 +1,17 @@
+# dgp_intra/tasks/payments.py
+import datetime
+from dgp_intra.services.payments import settle_stale_payments
+
+
+def settle_pending_payments():
+    """
+    Every few minutes: ask Vipps about MobilePay payments left open (the user
+    closed the tab, a webhook got lost) and capture or cancel them.
+    See services/payments.py.
+    """
+    print("[Payments] Running at:", datetime.datetime.now().isoformat())
+    result = settle_stale_payments()
+
+    print(f"[Payments] {result['checked']} stale payments: {result['captured']} captured, "
+          f"{result['failed']} failed, {result['open']} still open, {result['errors']} errors")
+    return result
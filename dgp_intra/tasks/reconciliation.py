@@ -0,0 +1,21 @@
+# dgp_intra/tasks/reconciliation.py
+import datetime
+from flask import current_app
+from dgp_intra.extensions import db
+from dgp_intra.services.reconciliation import run_reconciliation
+
+
+def reconcile_balances():
+    """
+    Every few minutes: fold new ledger rows into the expected balances and
+    flag (or, with RECONCILE_AUTO_REPAIR, repair) users whose cached credit
+    has drifted. See services/reconciliation.py.
+    """
+    print("[Reconciliation] Running at:", datetime.datetime.now().isoformat())
+    result = run_reconciliation(repair=current_app.config.get("RECONCILE_AUTO_REPAIR", False))
+    db.session.commit()
+
+    print(f"[Reconciliation] {result['processed']} ledger rows up to #{result['watermark']}, "
+          f"{result['mismatches']} mismatches, {result['repaired']} repaired, "
+          f"{result['open_gaps']} open gaps")
+    return result
@@ -0,0 +1,158 @@
+# dgp_intra/tasks/standing_orders.py
+import datetime
+from datetime import date, timedelta
+from sqlalchemy import select, insert, update, bindparam
+from sqlalchemy.exc import IntegrityError
+from dgp_intra.extensions import db
+from dgp_intra.models import StandingOrder, LunchRegistration, Vacation, User
+from dgp_intra.services import lunch
+from dgp_intra.services.dashboard import invalidate_user
+
+
+def _next_monday(today):
+    return today + timedelta(days=7 - today.weekday())
+
+
+def _book_per_user(plans):
+    """
+    Insert each user's planned days in its own savepoint, leaving out days
+    that got registered meanwhile. A user who still conflicts is skipped this
+    week instead of failing the run for everyone. Returns the booked days.
+    """
+    booked = {}
+    for user_id, plan in sorted(plans.items()):
+        taken = set(db.session.scalars(
+            select(LunchRegistration.date).where(
+                LunchRegistration.user_id == user_id,
+                LunchRegistration.slot == 0,
+                LunchRegistration.date.in_(plan),
+            )
+        ))
+        days = [d for d in plan if d not in taken]
+        if not days:
+            continue
+        try:
+            with db.session.begin_nested():
+                db.session.execute(insert(LunchRegistration),
+                                   [dict(user_id=user_id, date=d, slot=0) for d in days])
+        except IntegrityError:
+            print(f"[Standing Orders] User {user_id} changed registrations during the run; skipped")
+            continue
+        booked[user_id] = days
+    return booked
+
+
+def materialize_standing_orders(week_start=None):
+    """
+    Turn standing orders into LunchRegistration rows (and ledger debits) for
+    one week, next week by default. Set-based: a handful of queries and bulk
+    writes regardless of how many users have an order. Intended to run
+    off-peak from Celery beat.
+
+    Days covered by a Vacation and days the user already registered are
+    skipped; paid days are only booked while the user has clips left.
+    """
+    print("[Standing Orders] Running at:", datetime.datetime.now().isoformat())
+    week_start = week_start or _next_monday(date.today())
+    days = [week_start + timedelta(days=i) for i in range(5)]
+    week_end = days[-1]
+
+    orders = db.session.scalars(
+        select(StandingOrder).where(
+            StandingOrder.weekday_mask != 0,
+            StandingOrder.start_date <= week_end,
+            (StandingOrder.end_date.is_(None)) | (StandingOrder.end_date >= week_start),
+        )
+    ).all()
+    if not orders:
+        print("[Standing Orders] No active standing orders.")
+        return {"registered": 0, "users": 0, "skipped_no_credit": 0}
+
+    user_ids = sorted({o.user_id for o in orders})
+
+    # Lock the affected users in id order so concurrent batches cannot deadlock,
+    # and read their balances once.
+    credit = dict(db.session.execute(
+        select(User.id, User.credit)
+        .where(User.id.in_(user_ids))
+        .order_by(User.id)
+        .with_for_update()
+    ).all())
+
+    vacations = {}
+    for user_id, start, end in db.session.execute(
+        select(Vacation.user_id, Vacation.start_date, Vacation.end_date).where(
+            Vacation.user_id.in_(user_ids),
+            Vacation.start_date <= week_end,
+            Vacation.end_date >= week_start,
+        )
+    ):
+        vacations.setdefault(user_id, []).append((start, end))
+
+    existing = set(db.session.execute(
+        select(LunchRegistration.user_id, LunchRegistration.date).where(
+            LunchRegistration.user_id.in_(user_ids),
+            LunchRegistration.slot == 0,
+            LunchRegistration.date >= week_start,
+            LunchRegistration.date <= week_end,
+        )
+    ).all())
+
+    plans = {}  # user_id -> days to book
+    skipped_no_credit = 0
+    for order in orders:
+        balance = credit.get(order.user_id) or 0
+        away = vacations.get(order.user_id, [])
+        for day in days:
+            if not order.covers(day) or (order.user_id, day) in existing:
+                continue
+            if any(start <= day <= end for start, end in away):
+                continue
+            if not lunch.is_free(day):
+                if balance < 1:
+                    skipped_no_credit += 1
+                    continue
+                balance -= 1
+            plans.setdefault(order.user_id, []).append(day)
+
+    registrations = [dict(user_id=uid, date=day, slot=0) for uid, plan in plans.items() for day in plan]
+    if registrations:
+        try:
+            with db.session.begin_nested():
+                db.session.execute(insert(LunchRegistration), registrations)
+        except IntegrityError:
+            # A user registered one of these days since we looked; book user by user
+            plans = _book_per_user(plans)
+            registrations = [dict(user_id=uid, date=day, slot=0) for uid, plan in plans.items() for day in plan]
+
+    # Charge only for what was actually booked
+    ledger_rows, debits = [], {}
+    for user_id, plan in plans.items():
+        for day in plan:
+            if not lunch.is_free(day):
+                debits[user_id] = debits.get(user_id, 0) + 1
+                ledger_rows.append(lunch.ledger_row(
+                    user_id, -1, day, f"Fast tilmelding frokost {day.strftime('%d/%m')}"
+                ))
+
+    if debits:
+        db.session.execute(
+            update(User.__table__)
+            .where(User.__table__.c.id == bindparam("uid"))
+            .values(credit=User.__table__.c.credit - bindparam("n")),
+            [{"uid": uid, "n": n} for uid, n in sorted(debits.items())],
+        )
+    lunch.insert_ledger_rows(ledger_rows)
+    db.session.commit()
+
+    booked_users = {r["user_id"] for r in registrations}
+    for user_id in booked_users:
+        invalidate_user(user_id, "registrations")
+
+    print(f"[Standing Orders] Week of {week_start}: {len(registrations)} registrations for "
+          f"{len(booked_users)} users, {skipped_no_credit} days skipped for lack of credit")
+    return {
+        "registered": len(registrations),
+        "users": len(booked_users),
+        "skipped_no_credit": skipped_no_credit,
+    }
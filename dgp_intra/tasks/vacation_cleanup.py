@@ -0,0 +1,21 @@
+# dgp_intra/tasks/vacation_cleanup.py
+import datetime
+from dgp_intra.extensions import db
+from dgp_intra.services.dashboard import invalidate_user
+from dgp_intra.services.vacations import cancel_registrations_during_vacations
+
+
+def cancel_vacation_registrations():
+    """
+    Nightly sweep: cancel and refund registrations that ended up inside a
+    vacation after it was recorded (e.g. booked by a standing order).
+    """
+    print("[Vacation Cleanup] Running at:", datetime.datetime.now().isoformat())
+    affected = cancel_registrations_during_vacations()
+    db.session.commit()
+
+    for user_id in affected:
+        invalidate_user(user_id, "registrations")
+
+    print(f"[Vacation Cleanup] Cancelled registrations for {len(affected)} users")
+    return {"users": len(affected)}
@@ -0,0 +1,213 @@
+"""
+Small key/value cache used for shared page fragments and API tokens.
+
+Uses Redis when CACHE_REDIS_URL is configured and reachable, otherwise an
+in-process LRU dict. Values are pickled, so anything picklable can be stored
+(plain dicts/lists/dates - not ORM objects).
+
+Invalidation is generation based: keys used by `cached()` embed a counter for
+their namespace, and `bump()` increments it, orphaning every key in that
+namespace at once without scanning for them.
+
+The in-process fallback is private to one gunicorn worker, so a bump() only
+reaches the worker that made it. Without Redis, `cached()` therefore keeps
+values for CACHE_LOCAL_TTL seconds at most, skips `shared_only` values
+entirely, and Redis is tried again every CACHE_REDIS_RETRY seconds.
+"""
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+
+class LocalCache:
+    """In-process LRU cache with per-key expiry (one per gunicorn worker)"""
+
+    shared = False
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._generations = {}  # kept outside the LRU so bumps are never lost
+        self._lock = threading.Lock()
+
+    def _expired(self, expires_at):
+        return expires_at is not None and expires_at <= time.monotonic()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if self._expired(expires_at):
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def add(self, key, value, ttl=None):
+        """Set only if the key is absent; returns True if it was set"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and not self._expired(item[1]):
+                return False
+            self._data[key] = (value, time.monotonic() + ttl if ttl else None)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def incr(self, key):
+        with self._lock:
+            self._generations[key] = self._generations.get(key, 0) + 1
+            return self._generations[key]
+
+    def generation(self, key):
+        return self._generations.get(key, 0)
+
+
+class RedisCache:
+    """Redis-backed cache shared by all workers; errors degrade to cache misses"""
+
+    shared = True
+
+    def __init__(self, client, prefix="dgp:"):
+        self.client = client
+        self.prefix = prefix
+
+    def _k(self, key):
+        return f"{self.prefix}{key}"
+
+    def get(self, key):
+        import redis
+        try:
+            raw = self.client.get(self._k(key))
+        except redis.RedisError:
+            return None
+        return pickle.loads(raw) if raw is not None else None
+
+    def set(self, key, value, ttl=None):
+        import redis
+        try:
+            self.client.set(self._k(key), pickle.dumps(value), ex=ttl)
+        except redis.RedisError:
+            pass
+
+    def add(self, key, value, ttl=None):
+        import redis
+        try:
+            return bool(self.client.set(self._k(key), pickle.dumps(value), ex=ttl, nx=True))
+        except redis.RedisError:
+            return False
+
+    def delete(self, key):
+        import redis
+        try:
+            self.client.delete(self._k(key))
+        except redis.RedisError:
+            pass
+
+    def incr(self, key):
+        import redis
+        try:
+            return self.client.incr(self._k(key))
+        except redis.RedisError:
+            return None
+
+    def generation(self, key):
+        import redis
+        try:
+            raw = self.client.get(self._k(key))
+        except redis.RedisError:
+            return None
+        return int(raw) if raw is not None else 0
+
+
+_create_lock = threading.Lock()
+
+
+def _create_cache(app, fallback=None):
+    """RedisCache if Redis answers, else `fallback` (or a new LocalCache) until the next retry"""
+    url = app.config.get('CACHE_REDIS_URL')
+    if url:
+        try:
+            import redis
+            client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+            client.ping()
+            if fallback is not None:
+                app.logger.info("Redis cache reachable again; leaving the in-process cache")
+            return RedisCache(client)
+        except Exception as e:
+            if fallback is None:
+                app.logger.warning(f"Redis cache unavailable ({e}); using in-process cache")
+        app.extensions['dgp_cache_retry_at'] = time.monotonic() + app.config.get('CACHE_REDIS_RETRY', 30)
+    return fallback or LocalCache(max_entries=app.config.get('CACHE_LOCAL_MAX_ENTRIES', 1024))
+
+
+def _stale(app, cache):
+    """True if there is no cache yet, or it is the fallback and Redis is due another try"""
+    if cache is None:
+        return True
+    return not cache.shared and time.monotonic() >= app.extensions.get('dgp_cache_retry_at', float('inf'))
+
+
+def get_cache():
+    """Return the cache for the current app, creating it on first use"""
+    app = current_app._get_current_object()
+    cache = app.extensions.get('dgp_cache')
+    if _stale(app, cache):
+        with _create_lock:  # threads must not each end up with their own LocalCache
+            cache = app.extensions.get('dgp_cache')
+            if _stale(app, cache):
+                cache = app.extensions['dgp_cache'] = _create_cache(app, fallback=cache)
+    return cache
+
+
+def is_shared():
+    """True if cached values and bump()s are seen by every worker (Redis)"""
+    return get_cache().shared
+
+
+def bump(*namespaces):
+    """Invalidate every key built from the given namespaces"""
+    cache = get_cache()
+    for namespace in namespaces:
+        cache.incr(f"gen:{namespace}")
+
+
+def cached(namespace, parts, loader, ttl=300, shared_only=False):
+    """
+    Return the cached value for (namespace, parts) or compute it with loader().
+
+    Without Redis, other workers' bump()s are not seen: values are then kept
+    for CACHE_LOCAL_TTL seconds at most, and not at all with shared_only=True
+    (for values a user expects to see changed right after their own write).
+    """
+    cache = get_cache()
+    if not cache.shared:
+        if shared_only:
+            return loader()
+        ttl = min(ttl, current_app.config.get('CACHE_LOCAL_TTL', 5))
+    gen = cache.generation(f"gen:{namespace}")
+    if gen is None:
+        # Redis went away mid-request: don't cache under a bogus generation
+        return loader()
+    k = f"{namespace}@{gen}:" + ":".join(str(p) for p in parts)
+    hit = cache.get(k)
+    if hit is not None:
+        return hit[0]
+    value = loader()
+    cache.set(k, (value,), ttl=ttl)  # wrapped so a cached None is still a hit
+    return value
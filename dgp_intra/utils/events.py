@@ -0,0 +1,246 @@
+"""
+Small publish/subscribe broker for live page updates (server-sent events).
+
+Every event on a channel gets an increasing id and is kept in a short backlog,
+so a client that reconnects with its last seen id gets exactly what it missed
+- or None when the backlog no longer reaches back that far, in which case it
+should reload the page.
+
+Uses Redis when CACHE_REDIS_URL is configured and reachable (events reach
+browsers connected to any worker). Without Redis, live events are off (pages
+reload after changes instead) unless LIVE_EVENTS_IN_PROCESS is set: the
+in-process broker only works when the app runs as a single process (the dev
+server), since each gunicorn worker would have its own ids and backlog.
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+
+from flask import current_app
+
+
+class LocalBroker:
+    """In-process broker: one backlog per channel, waiters woken by a condition"""
+
+    def __init__(self, backlog=200):
+        self.backlog = backlog
+        self._cond = threading.Condition()
+        self._wakeups = 0           # bumped on every publish, so waiters never miss one
+        self._channels = {}         # channel -> [last id, deque of events]
+
+    def _notify(self):
+        with self._cond:
+            self._wakeups += 1
+            self._cond.notify_all()
+
+    def publish(self, channel, event_type, data):
+        payload = json.dumps(data, default=str)
+        with self._cond:
+            state = self._channels.setdefault(channel, [0, deque(maxlen=self.backlog)])
+            state[0] += 1
+            event_id = state[0]
+            state[1].append({"id": event_id, "type": event_type, "data": payload})
+        self._notify()
+        return event_id
+
+    def last_id(self, channel):
+        with self._cond:
+            return self._channels.get(channel, [0])[0]
+
+    def since(self, channel, after_id):
+        """Events with id > after_id, or None if some of them are gone"""
+        with self._cond:
+            last, events = self._channels.get(channel, [0, ()])
+            if after_id > last or (events and events[0]["id"] > after_id + 1):
+                return None
+            return [e for e in events if e["id"] > after_id]
+
+    def wait(self, channel, after_id, timeout):
+        """Like since(), but blocks up to `timeout` seconds while there is nothing new"""
+        with self._cond:
+            seen = self._wakeups
+        events = self.since(channel, after_id)
+        if events != []:
+            return events
+        self._listen()
+        with self._cond:
+            self._cond.wait_for(lambda: self._wakeups != seen, timeout)
+        return self.since(channel, after_id)
+
+    def _listen(self):
+        pass
+
+
+# Assign the id, store the event and wake subscribers in one step, so
+# concurrent publishers can never make ids appear out of order.
+PUBLISH_SCRIPT = """
+local id = redis.call('INCR', KEYS[1])
+redis.call('ZADD', KEYS[2], id, id .. ':' .. ARGV[1] .. ':' .. ARGV[2])
+redis.call('ZREMRANGEBYRANK', KEYS[2], 0, -tonumber(ARGV[3]) - 1)
+redis.call('PUBLISH', KEYS[3], id)
+return id
+"""
+
+
+class RedisBroker(LocalBroker):
+    """
+    Events live in a sorted set per channel (score = id); PUBLISH only wakes
+    the listener thread of each process, which then wakes its waiting streams.
+    Waiters re-read Redis on every wakeup and timeout, so a dropped pub/sub
+    connection delays updates but never loses them. Errors degrade to "no
+    new events".
+    """
+
+    def __init__(self, client, url, backlog=200, prefix="dgp:events:"):
+        super().__init__(backlog)
+        self.client = client
+        self.url = url
+        self.prefix = prefix
+        self._publish = client.register_script(PUBLISH_SCRIPT)
+        self._listener_pid = None
+        self._listener_lock = threading.Lock()
+
+    def _keys(self, channel):
+        base = f"{self.prefix}{channel}"
+        return f"{base}:seq", f"{base}:log", base
+
+    def publish(self, channel, event_type, data):
+        import redis
+        try:
+            return int(self._publish(keys=self._keys(channel),
+                                     args=[event_type, json.dumps(data, default=str), self.backlog]))
+        except redis.RedisError as e:
+            current_app.logger.warning(f"Could not publish {event_type} event on {channel}: {e}")
+            return None
+
+    def last_id(self, channel):
+        import redis
+        try:
+            return int(self.client.get(self._keys(channel)[0]) or 0)
+        except redis.RedisError:
+            return 0
+
+    def since(self, channel, after_id):
+        import redis
+        seq_key, log_key, _ = self._keys(channel)
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            pipe.get(seq_key)
+            pipe.zrange(log_key, 0, 0, withscores=True)
+            pipe.zrangebyscore(log_key, f"({after_id}", "+inf")
+            last, oldest, members = pipe.execute()
+        except redis.RedisError:
+            return []
+        if after_id > int(last or 0) or (oldest and oldest[0][1] > after_id + 1):
+            return None
+        events = []
+        for member in members:
+            event_id, event_type, payload = member.decode().split(":", 2)
+            events.append({"id": int(event_id), "type": event_type, "data": payload})
+        return events
+
+    def _listen(self):
+        """Start this process's pub/sub listener (again after a fork)"""
+        pid = os.getpid()
+        if self._listener_pid == pid:
+            return
+        with self._listener_lock:
+            if self._listener_pid != pid:
+                self._listener_pid = pid
+                threading.Thread(target=self._run_listener, name="event-listener", daemon=True).start()
+
+    def _run_listener(self):
+        import redis
+        while True:
+            try:
+                client = redis.Redis.from_url(self.url, socket_connect_timeout=0.5, health_check_interval=30)
+                pubsub = client.pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe(f"{self.prefix}*")
+                while True:
+                    if pubsub.get_message(timeout=30) is not None:
+                        self._notify()
+            except redis.RedisError:
+                time.sleep(1)  # waiters keep polling Redis on their timeouts meanwhile
+
+
+_create_lock = threading.Lock()
+
+
+def _create_broker(app, fallback=None):
+    """RedisBroker if Redis answers, else `fallback` (None or a LocalBroker) until the next retry"""
+    backlog = app.config.get('LIVE_EVENTS_BACKLOG', 200)
+    url = app.config.get('CACHE_REDIS_URL')
+    if url:
+        try:
+            import redis
+            client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+            client.ping()
+            if 'dgp_events' in app.extensions:
+                app.logger.info("Redis reachable again; live events enabled")
+            return RedisBroker(client, url, backlog=backlog)
+        except Exception as e:
+            if 'dgp_events' not in app.extensions:
+                mode = "using in-process broker" if app.config.get('LIVE_EVENTS_IN_PROCESS') else "live events off"
+                app.logger.warning(f"Redis unavailable for live events ({e}); {mode}")
+        app.extensions['dgp_events_retry_at'] = time.monotonic() + app.config.get('CACHE_REDIS_RETRY', 30)
+    if fallback is None and app.config.get('LIVE_EVENTS_IN_PROCESS'):
+        fallback = LocalBroker(backlog=backlog)
+    return fallback
+
+
+def _stale(app):
+    """True if there is no broker yet, or Redis is due another try"""
+    if 'dgp_events' not in app.extensions:
+        return True
+    return (not isinstance(app.extensions['dgp_events'], RedisBroker)
+            and time.monotonic() >= app.extensions.get('dgp_events_retry_at', float('inf')))
+
+
+def get_broker():
+    """
+    Return the event broker for the current app, creating it on first use.
+    None means live events are off (no Redis and LIVE_EVENTS_IN_PROCESS unset).
+    """
+    app = current_app._get_current_object()
+    if _stale(app):
+        with _create_lock:
+            if _stale(app):
+                app.extensions['dgp_events'] = _create_broker(app, fallback=app.extensions.get('dgp_events'))
+    return app.extensions['dgp_events']
+
+
+def publish(channel, event_type, data):
+    """Publish an event (call after the change is committed); returns its id, or None"""
+    broker = get_broker()
+    if broker is None:
+        return None
+    return broker.publish(channel, event_type, data)
+
+
+def _format(event):
+    lines = "".join(f"data: {line}\n" for line in event["data"].splitlines() or [""])
+    return f"id: {event['id']}\nevent: {event['type']}\n{lines}\n"
+
+
+def event_stream(broker, channel, after_id, keepalive=15, duration=300):
+    """
+    Generator of text/event-stream chunks for events after `after_id`.
+    Ends after `duration` seconds (the browser reconnects with Last-Event-ID),
+    or with a `resync` event when the client has fallen too far behind.
+    Does not need an app or request context.
+    """
+    yield "retry: 3000\n\n"
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        events = broker.wait(channel, after_id, timeout=min(keepalive, max(deadline - time.monotonic(), 0)))
+        if events is None:
+            yield "event: resync\ndata: {}\n\n"
+            return
+        if not events:
+            yield ": keepalive\n\n"
+            continue
+        for event in events:
+            yield _format(event)
+        after_id = events[-1]["id"]
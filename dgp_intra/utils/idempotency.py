@@ -0,0 +1,130 @@
+"""
+Idempotency keys for requests that change credit.
+
+Clients send a key with every credit-mutating request: an `Idempotency-Key`
+header (fetch) or a hidden `idempotency_key` form field, rendered with
+`{{ idempotency_field() }}`. The `@idempotent()` view decorator then
+- replays the stored response when the same user repeats a key,
+- answers "in progress" while the first request with that key is still running,
+- exposes the key to the view, so every CreditTransaction it writes carries
+  `idempotency_key` (see next_idempotency_key()). The unique index on that column
+  is the backstop when the response cache is unavailable.
+"""
+import hashlib
+import uuid
+from functools import wraps
+
+from flask import current_app, g, has_app_context, request, make_response, jsonify, flash, redirect, url_for
+from flask_login import current_user
+from markupsafe import Markup
+from sqlalchemy.exc import IntegrityError
+
+from dgp_intra.extensions import db
+from dgp_intra.utils.cache import get_cache
+
+HEADER = "Idempotency-Key"
+FORM_FIELD = "idempotency_key"
+CONSTRAINT = "uq_credit_transaction_idempotency_key"
+_IN_FLIGHT = "in-flight"
+
+
+def idempotency_field():
+    """Hidden form input with a fresh key (a Jinja global)"""
+    return Markup(f'<input type="hidden" name="{FORM_FIELD}" value="{uuid.uuid4().hex}">')
+
+
+def _request_key():
+    key = request.headers.get(HEADER) or request.form.get(FORM_FIELD)
+    return key.strip()[:128] if key else None
+
+
+def next_idempotency_key():
+    """
+    Key for the next CreditTransaction written by this request, or None outside
+    an idempotent request. Rows are numbered in write order, so a replayed
+    request produces the same keys.
+    """
+    base = g.get("idempotency_base") if has_app_context() else None
+    if base is None:
+        return None
+    g.idempotency_seq = g.get("idempotency_seq", 0) + 1
+    return f"{base}:{g.idempotency_seq}"
+
+
+def _is_duplicate_key(error: IntegrityError) -> bool:
+    return CONSTRAINT in str(error.orig) or "idempotency_key" in str(error.orig)
+
+
+def _already_done():
+    if request.is_json or request.accept_mimetypes.best == "application/json":
+        return jsonify({"success": False, "status": "duplicate",
+                        "message": "Denne handling er allerede udført."}), 409
+    flash("Denne handling er allerede udført.")
+    return redirect(request.referrer or url_for('dashboard.view'))
+
+
+def _in_progress():
+    if request.is_json or request.accept_mimetypes.best == "application/json":
+        return jsonify({"success": False, "status": "pending",
+                        "message": "Handlingen behandles allerede..."}), 409
+    flash("Handlingen behandles allerede...")
+    return redirect(request.referrer or url_for('dashboard.view'))
+
+
+def idempotent(key_func=None, store_if=None, in_progress=None):
+    """
+    Make a view idempotent per (user, endpoint, key).
+
+    key_func:    derive the key from the request instead of the header/form field
+    store_if:    predicate on the response; only matching responses are replayed
+                 (default: everything below 500)
+    in_progress: response while a request with the same key is running
+    Requests without a key run normally.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key = key_func() if key_func else _request_key()
+            if not key:
+                return view(*args, **kwargs)
+
+            user_id = current_user.get_id() if current_user.is_authenticated else "anon"
+            digest = hashlib.sha256(f"{user_id}:{request.endpoint}:{key}".encode()).hexdigest()
+            cache_key = f"idem:{digest}"
+            ttl = current_app.config.get("IDEMPOTENCY_TTL", 86400)
+            cache = get_cache()
+
+            stored = cache.get(cache_key)
+            if stored is None and not cache.add(cache_key, _IN_FLIGHT, ttl=60):
+                stored = cache.get(cache_key)
+            if stored == _IN_FLIGHT:
+                return in_progress() if in_progress else _in_progress()
+            if stored is not None:
+                body, status, headers = stored
+                return current_app.response_class(body, status=status, headers=headers)
+
+            g.idempotency_base, g.idempotency_seq = digest[:48], 0
+            try:
+                response = make_response(view(*args, **kwargs))
+            except IntegrityError as e:
+                db.session.rollback()
+                cache.delete(cache_key)
+                if _is_duplicate_key(e):
+                    return _already_done()
+                raise
+            except Exception:
+                cache.delete(cache_key)
+                raise
+            finally:
+                g.pop("idempotency_base", None)
+
+            keep = response.status_code < 500 and (store_if is None or store_if(response))
+            if keep and not response.is_streamed:
+                headers = [(k, v) for k, v in response.headers.items()
+                           if k in ("Content-Type", "Location")]
+                cache.set(cache_key, (response.get_data(), response.status_code, headers), ttl=ttl)
+            else:
+                cache.delete(cache_key)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,100 @@
+"""
+Keyset (cursor) pagination for newest-first lists.
+
+Instead of OFFSET/COUNT, each page is fetched with a range condition on
+(timestamp, id) starting from the last row the user saw, so every page costs
+the same no matter how deep it is, and rows inserted meanwhile do not shift
+the pages. Cursors are opaque url-safe strings encoding that (timestamp, id).
+"""
+import base64
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from sqlalchemy import and_, or_, func, select
+
+
+def encode_cursor(ts: datetime, row_id: int) -> str:
+    raw = f"{ts.isoformat()}|{row_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str | None):
+    """(timestamp, id) from a cursor, or None if it is missing or malformed"""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        ts, row_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(ts), int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+@dataclass
+class KeysetPage:
+    items: list = field(default_factory=list)
+    next_cursor: str | None = None   # pass as ?after= for older rows
+    prev_cursor: str | None = None   # pass as ?before= for newer rows
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+
+def keyset_paginate(query, ts_col, id_col, after=None, before=None, per_page=20) -> KeysetPage:
+    """
+    Page through `query` newest first by (ts_col, id_col).
+
+    after:  cursor of the last row on the current page -> the next (older) page
+    before: cursor of the first row on the current page -> the previous (newer) page
+    Without either, the first page is returned. The query should be backed by an
+    index ending in (ts_col, id_col) for its filters.
+    """
+    after_key, before_key = decode_cursor(after), decode_cursor(before)
+
+    if before_key is not None:
+        ts, row_id = before_key
+        rows = (
+            query.filter(or_(ts_col > ts, and_(ts_col == ts, id_col > row_id)))
+            .order_by(ts_col.asc(), id_col.asc())
+            .limit(per_page + 1)
+            .all()
+        )
+        if len(rows) <= per_page:
+            # Reached the newest rows: show a full first page instead of a short one
+            return keyset_paginate(query, ts_col, id_col, per_page=per_page)
+        items = list(reversed(rows[:per_page]))
+        has_newer, has_older = True, True
+    else:
+        q = query
+        if after_key is not None:
+            ts, row_id = after_key
+            q = q.filter(or_(ts_col < ts, and_(ts_col == ts, id_col < row_id)))
+        rows = q.order_by(ts_col.desc(), id_col.desc()).limit(per_page + 1).all()
+        items = rows[:per_page]
+        has_older = len(rows) > per_page
+        has_newer = after_key is not None
+
+    page = KeysetPage(items=items)
+    if items:
+        ts_attr, id_attr = ts_col.key, id_col.key
+        first, last = items[0], items[-1]
+        if has_older:
+            page.next_cursor = encode_cursor(getattr(last, ts_attr), getattr(last, id_attr))
+        if has_newer:
+            page.prev_cursor = encode_cursor(getattr(first, ts_attr), getattr(first, id_attr))
+    return page
+
+
+def capped_count(query, id_col, cap=1000):
+    """
+    Number of rows in `query`, counting at most cap + 1 of them. Returns
+    (count, exact): exact is False when there are more than `cap` rows.
+    """
+    limited = query.order_by(None).with_entities(id_col).limit(cap + 1).subquery()
+    n = query.session.execute(select(func.count()).select_from(limited)).scalar()
+    return min(n, cap), n <= cap
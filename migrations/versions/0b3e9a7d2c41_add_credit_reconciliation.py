@@ -0,0 +1,46 @@
+"""Add credit reconciliation watermark and expected balances
+
+Revision ID: 0b3e9a7d2c41
+Revises: f6c2d8e4a1b3
+Create Date: 2026-10-17 18:12:30.927415
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0b3e9a7d2c41'
+down_revision: Union[str, None] = 'f6c2d8e4a1b3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('reconciliation_state',
+    sa.Column('name', sa.String(length=32), nullable=False),
+    sa.Column('watermark_tx_id', sa.Integer(), nullable=False),
+    sa.Column('open_gaps', sa.Text(), nullable=True),
+    sa.Column('last_run_at', sa.DateTime(), nullable=True),
+    sa.Column('last_processed', sa.Integer(), nullable=False),
+    sa.Column('last_mismatches', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    op.create_table('credit_reconciliation',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('expected_credit', sa.Integer(), nullable=False),
+    sa.Column('mismatch', sa.Integer(), nullable=True),
+    sa.Column('flagged_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('credit_reconciliation')
+    op.drop_table('reconciliation_state')
@@ -0,0 +1,114 @@
+"""Add archive tables and carried-forward summaries
+
+Revision ID: 1d6a4f8c0e57
+Revises: 0b3e9a7d2c41
+Create Date: 2026-10-17 19:31:04.551862
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '1d6a4f8c0e57'
+down_revision: Union[str, None] = '0b3e9a7d2c41'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('credit_transaction_archive',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('posted_at', sa.DateTime(), nullable=True),
+    sa.Column('delta_credits', sa.Integer(), nullable=False),
+    sa.Column('tx_type', sa.Enum('PURCHASE', 'SPEND', 'ADJUSTMENT', 'REFUND', name='txtype'), nullable=False),
+    sa.Column('status', sa.Enum('PENDING', 'POSTED', 'CANCELED', name='txstatus'), nullable=False),
+    sa.Column('amount_dkk_ore', sa.Integer(), nullable=True),
+    sa.Column('source', sa.String(length=64), nullable=True),
+    sa.Column('created_by_id', sa.Integer(), nullable=True),
+    sa.Column('note', sa.String(length=280), nullable=True),
+    sa.Column('archived_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('credit_transaction_archive', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_credit_transaction_archive_created_at'), ['created_at'], unique=False)
+        batch_op.create_index(batch_op.f('ix_credit_transaction_archive_user_id'), ['user_id'], unique=False)
+
+    op.create_table('credit_ledger_summary',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('posted_total', sa.Integer(), nullable=False),
+    sa.Column('tx_count', sa.Integer(), nullable=False),
+    sa.Column('last_tx_id', sa.Integer(), nullable=True),
+    sa.Column('archived_through', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+
+    op.create_table('cleaning_logs_archive',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('room_id', sa.Integer(), nullable=False),
+    sa.Column('cleaned_by_id', sa.Integer(), nullable=False),
+    sa.Column('cleaned_at', sa.DateTime(), nullable=False),
+    sa.Column('status_before', sa.Enum('CLEAN', 'NEEDS_CLEANING', name='cleaningstatus'), nullable=False),
+    sa.Column('status_after', sa.Enum('CLEAN', 'NEEDS_CLEANING', name='cleaningstatus'), nullable=False),
+    sa.Column('notes', sa.Text(), nullable=True),
+    sa.Column('archived_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('cleaning_logs_archive', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_cleaning_logs_archive_cleaned_at'), ['cleaned_at'], unique=False)
+        batch_op.create_index(batch_op.f('ix_cleaning_logs_archive_room_id'), ['room_id'], unique=False)
+
+    op.create_table('meal_registrations_archive',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('room_id', sa.Integer(), nullable=False),
+    sa.Column('meal_type', sa.Enum('BREAKFAST', 'LUNCH', 'DINNER', name='mealtype'), nullable=False),
+    sa.Column('date', sa.Date(), nullable=False),
+    sa.Column('people_count', sa.Integer(), nullable=False),
+    sa.Column('patients_count', sa.Integer(), nullable=False),
+    sa.Column('relatives_count', sa.Integer(), nullable=False),
+    sa.Column('registered_by_id', sa.Integer(), nullable=False),
+    sa.Column('registered_at', sa.DateTime(), nullable=False),
+    sa.Column('archived_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('meal_registrations_archive', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_meal_registrations_archive_date'), ['date'], unique=False)
+        batch_op.create_index(batch_op.f('ix_meal_registrations_archive_room_id'), ['room_id'], unique=False)
+
+    op.create_table('room_archive_summary',
+    sa.Column('room_id', sa.Integer(), nullable=False),
+    sa.Column('cleanings', sa.Integer(), nullable=False),
+    sa.Column('last_cleaned_at', sa.DateTime(), nullable=True),
+    sa.Column('meal_registrations', sa.Integer(), nullable=False),
+    sa.Column('people_total', sa.Integer(), nullable=False),
+    sa.Column('patients_total', sa.Integer(), nullable=False),
+    sa.Column('relatives_total', sa.Integer(), nullable=False),
+    sa.Column('billable_total', sa.Integer(), nullable=False),
+    sa.Column('archived_through', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['room_id'], ['rooms.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('room_id')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('room_archive_summary')
+    with op.batch_alter_table('meal_registrations_archive', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_meal_registrations_archive_room_id'))
+        batch_op.drop_index(batch_op.f('ix_meal_registrations_archive_date'))
+    op.drop_table('meal_registrations_archive')
+    with op.batch_alter_table('cleaning_logs_archive', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_cleaning_logs_archive_room_id'))
+        batch_op.drop_index(batch_op.f('ix_cleaning_logs_archive_cleaned_at'))
+    op.drop_table('cleaning_logs_archive')
+    op.drop_table('credit_ledger_summary')
+    with op.batch_alter_table('credit_transaction_archive', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_credit_transaction_archive_user_id'))
+        batch_op.drop_index(batch_op.f('ix_credit_transaction_archive_created_at'))
+    op.drop_table('credit_transaction_archive')
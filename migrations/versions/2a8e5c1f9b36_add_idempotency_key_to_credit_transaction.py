@@ -0,0 +1,32 @@
+"""Add idempotency_key to credit_transaction
+
+Revision ID: 2a8e5c1f9b36
+Revises: 1d6a4f8c0e57
+Create Date: 2026-10-17 20:08:45.213690
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '2a8e5c1f9b36'
+down_revision: Union[str, None] = '1d6a4f8c0e57'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table('credit_transaction', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('idempotency_key', sa.String(length=64), nullable=True))
+        batch_op.create_unique_constraint('uq_credit_transaction_idempotency_key', ['idempotency_key'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('credit_transaction', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_credit_transaction_idempotency_key', type_='unique')
+        batch_op.drop_column('idempotency_key')
@@ -0,0 +1,36 @@
+"""Add composite (user_id, date) indexes to lunch and breakfast registrations
+
+Revision ID: 3c7e1a9d5b42
+Revises: 2d8b55d18da3
+Create Date: 2026-10-17 09:12:41.118204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3c7e1a9d5b42'
+down_revision: Union[str, None] = '2d8b55d18da3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table('lunch_registration', schema=None) as batch_op:
+        batch_op.create_index('ix_lunch_registration_user_id_date', ['user_id', 'date'], unique=False)
+
+    with op.batch_alter_table('breakfast_registration', schema=None) as batch_op:
+        batch_op.create_index('ix_breakfast_registration_user_id_date', ['user_id', 'date'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('breakfast_registration', schema=None) as batch_op:
+        batch_op.drop_index('ix_breakfast_registration_user_id_date')
+
+    with op.batch_alter_table('lunch_registration', schema=None) as batch_op:
+        batch_op.drop_index('ix_lunch_registration_user_id_date')
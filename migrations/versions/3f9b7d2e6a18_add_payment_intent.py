@@ -0,0 +1,73 @@
+"""Add payment_intent for MobilePay purchases
+
+Revision ID: 3f9b7d2e6a18
+Revises: 2a8e5c1f9b36
+Create Date: 2026-10-17 21:02:17.480236
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f9b7d2e6a18'
+down_revision: Union[str, None] = '2a8e5c1f9b36'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+PRICE_PER_CLIP_ORE = 24 * 100  # KLIPPEKORT_PRICE_PER_CLIP default, for rows that never got their clips
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    payment_intent = op.create_table('payment_intent',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('reference', sa.String(length=64), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('clips', sa.Integer(), nullable=False),
+    sa.Column('amount_dkk_ore', sa.Integer(), nullable=False),
+    sa.Column('state', sa.Enum('CREATED', 'AUTHORIZED', 'CAPTURED', 'FAILED', name='paymentstate'), nullable=False),
+    sa.Column('vipps_state', sa.String(length=20), nullable=True),
+    sa.Column('ledger_tx_id', sa.Integer(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.Column('completed_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('reference')
+    )
+    with op.batch_alter_table('payment_intent', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_payment_intent_state'), ['state'], unique=False)
+        batch_op.create_index('ix_payment_intent_user_created', ['user_id', 'created_at'], unique=False)
+
+    # One intent per existing MobilePay ledger row
+    rows = op.get_bind().execute(sa.text(
+        "SELECT id, user_id, created_at, posted_at, delta_credits, status, amount_dkk_ore, source "
+        "FROM credit_transaction WHERE source LIKE 'mobilepay:%'"
+    ).columns(created_at=sa.DateTime(), posted_at=sa.DateTime())).fetchall()
+    states = {'POSTED': 'CAPTURED', 'CANCELED': 'FAILED', 'PENDING': 'CREATED'}
+    op.bulk_insert(payment_intent, [
+        {
+            'reference': r.source.split(':', 1)[1],
+            'user_id': r.user_id,
+            'clips': r.delta_credits if r.delta_credits > 0 else (r.amount_dkk_ore or 0) // PRICE_PER_CLIP_ORE,
+            'amount_dkk_ore': r.amount_dkk_ore or 0,
+            'state': states[r.status],
+            'ledger_tx_id': r.id,
+            'created_at': r.created_at,
+            'updated_at': r.posted_at or r.created_at,
+            'completed_at': r.posted_at,
+        }
+        for r in rows
+    ])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('payment_intent', schema=None) as batch_op:
+        batch_op.drop_index('ix_payment_intent_user_created')
+        batch_op.drop_index(batch_op.f('ix_payment_intent_state'))
+
+    op.drop_table('payment_intent')
@@ -0,0 +1,42 @@
+"""Add dob_ordinal birthday index to user
+
+Revision ID: 8f4b2c6e1d07
+Revises: 3c7e1a9d5b42
+Create Date: 2026-10-17 10:03:18.552910
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8f4b2c6e1d07'
+down_revision: Union[str, None] = '3c7e1a9d5b42'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('dob_ordinal', sa.SmallInteger(), nullable=True))
+        batch_op.create_index('ix_user_pub_dob_dob_ordinal', ['pub_dob', 'dob_ordinal'], unique=False)
+
+    # Backfill month * 100 + day for existing birthdays
+    user = sa.table('user', sa.column('id', sa.Integer), sa.column('dob', sa.Date),
+                    sa.column('dob_ordinal', sa.SmallInteger))
+    conn = op.get_bind()
+    rows = conn.execute(sa.select(user.c.id, user.c.dob).where(user.c.dob.isnot(None))).fetchall()
+    for user_id, dob in rows:
+        conn.execute(
+            user.update().where(user.c.id == user_id).values(dob_ordinal=dob.month * 100 + dob.day)
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_index('ix_user_pub_dob_dob_ordinal')
+        batch_op.drop_column('dob_ordinal')
@@ -0,0 +1,49 @@
+"""Add slot to lunch_registration and make (user_id, date, slot) unique
+
+Revision ID: a51d3f0c9e66
+Revises: 8f4b2c6e1d07
+Create Date: 2026-10-17 11:26:05.340187
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a51d3f0c9e66'
+down_revision: Union[str, None] = '8f4b2c6e1d07'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table('lunch_registration', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('slot', sa.SmallInteger(), server_default='0', nullable=False))
+
+    # Existing "+1" rows are duplicates of (user_id, date); number them 1, 2, ...
+    # in insertion order so the first row stays the user's own registration.
+    reg = sa.table('lunch_registration', sa.column('id', sa.Integer), sa.column('user_id', sa.Integer),
+                   sa.column('date', sa.Date), sa.column('slot', sa.SmallInteger))
+    conn = op.get_bind()
+    rows = conn.execute(
+        sa.select(reg.c.id, reg.c.user_id, reg.c.date).order_by(reg.c.user_id, reg.c.date, reg.c.id)
+    ).fetchall()
+    prev, slot = None, 0
+    for reg_id, user_id, reg_date in rows:
+        slot = slot + 1 if (user_id, reg_date) == prev else 0
+        prev = (user_id, reg_date)
+        if slot:
+            conn.execute(reg.update().where(reg.c.id == reg_id).values(slot=slot))
+
+    with op.batch_alter_table('lunch_registration', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_lunch_registration_user_date_slot', ['user_id', 'date', 'slot'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('lunch_registration', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_lunch_registration_user_date_slot', type_='unique')
+        batch_op.drop_column('slot')
@@ -0,0 +1,48 @@
+"""Add credit_balance checkpoint table
+
+Revision ID: d4b9f1a6e250
+Revises: c2e8d4a7f913
+Create Date: 2026-10-17 15:02:11.480233
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd4b9f1a6e250'
+down_revision: Union[str, None] = 'c2e8d4a7f913'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('credit_balance',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('posted_total', sa.Integer(), nullable=False),
+    sa.Column('pending_total', sa.Integer(), nullable=False),
+    sa.Column('last_tx_id', sa.Integer(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+
+    # Backfill one checkpoint per user that has ledger rows
+    op.execute("""
+        INSERT INTO credit_balance (user_id, posted_total, pending_total, last_tx_id, updated_at)
+        SELECT user_id,
+               COALESCE(SUM(CASE WHEN status = 'POSTED' THEN delta_credits ELSE 0 END), 0),
+               COALESCE(SUM(CASE WHEN status = 'PENDING' THEN delta_credits ELSE 0 END), 0),
+               MAX(id),
+               CURRENT_TIMESTAMP
+        FROM credit_transaction
+        GROUP BY user_id
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('credit_balance')
@@ -0,0 +1,30 @@
+"""Add (user_id, created_at, id) index for ledger keyset pagination
+
+Revision ID: e1a7c3f58d92
+Revises: d4b9f1a6e250
+Create Date: 2026-10-17 16:20:37.115094
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e1a7c3f58d92'
+down_revision: Union[str, None] = 'd4b9f1a6e250'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table('credit_transaction', schema=None) as batch_op:
+        batch_op.create_index('ix_credit_transaction_user_created_id', ['user_id', 'created_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('credit_transaction', schema=None) as batch_op:
+        batch_op.drop_index('ix_credit_transaction_user_created_id')
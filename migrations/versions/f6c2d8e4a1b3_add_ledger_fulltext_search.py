@@ -0,0 +1,58 @@
+"""Add full-text search index on credit_transaction source/note
+
+Revision ID: f6c2d8e4a1b3
+Revises: e1a7c3f58d92
+Create Date: 2026-10-17 17:05:48.602917
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f6c2d8e4a1b3'
+down_revision: Union[str, None] = 'e1a7c3f58d92'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Same statements as models.CREDIT_TRANSACTION_FTS_DDL (copied: migrations must not change with the app)
+SQLITE_FTS_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS credit_transaction_fts USING fts5("
+    "source, note, content='credit_transaction', content_rowid='id')",
+    "CREATE TRIGGER IF NOT EXISTS credit_transaction_fts_ai AFTER INSERT ON credit_transaction BEGIN "
+    "INSERT INTO credit_transaction_fts(rowid, source, note) VALUES (new.id, new.source, new.note); END",
+    "CREATE TRIGGER IF NOT EXISTS credit_transaction_fts_ad AFTER DELETE ON credit_transaction BEGIN "
+    "INSERT INTO credit_transaction_fts(credit_transaction_fts, rowid, source, note) "
+    "VALUES ('delete', old.id, old.source, old.note); END",
+    "CREATE TRIGGER IF NOT EXISTS credit_transaction_fts_au AFTER UPDATE OF source, note ON credit_transaction BEGIN "
+    "INSERT INTO credit_transaction_fts(credit_transaction_fts, rowid, source, note) "
+    "VALUES ('delete', old.id, old.source, old.note); "
+    "INSERT INTO credit_transaction_fts(rowid, source, note) VALUES (new.id, new.source, new.note); END",
+)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    dialect = op.get_bind().dialect.name
+    if dialect == 'mysql':
+        op.create_index('ft_credit_transaction_source_note', 'credit_transaction',
+                        ['source', 'note'], unique=False, mysql_prefix='FULLTEXT')
+    elif dialect == 'sqlite':
+        for stmt in SQLITE_FTS_DDL:
+            op.execute(stmt)
+        # Index the rows that already exist
+        op.execute("INSERT INTO credit_transaction_fts(credit_transaction_fts) VALUES ('rebuild')")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    dialect = op.get_bind().dialect.name
+    if dialect == 'mysql':
+        op.drop_index('ft_credit_transaction_source_note', table_name='credit_transaction')
+    elif dialect == 'sqlite':
+        for trigger in ('credit_transaction_fts_ai', 'credit_transaction_fts_ad', 'credit_transaction_fts_au'):
+            op.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        op.execute("DROP TABLE IF EXISTS credit_transaction_fts")
@@ -2,6 +2,8 @@
 from dgp_intra import create_app
 
 app = create_app()
+# The dev server is one process, so live events work without Redis
+app.config['LIVE_EVENTS_IN_PROCESS'] = True
 
 if __name__ == '__main__':
     app.run(debug=True)
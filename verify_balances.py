@@ -0,0 +1,45 @@
+# verify_balances.py
+#
+# Compare every user's credit_balance checkpoint with a full recomputation
+# from the ledger. Usage:
+#   python verify_balances.py               # report mismatches
+#   python verify_balances.py --repair      # ...and rebuild them
+#   python verify_balances.py --user 42     # only one user
+
+from dgp_intra import create_app
+from dgp_intra.extensions import db
+from dgp_intra.models import User
+from dgp_intra.services.credit import verify_balance
+from dotenv import load_dotenv
+import argparse
+
+# Load environment variables and app
+load_dotenv()
+app = create_app()
+
+parser = argparse.ArgumentParser(description="Verify credit balance checkpoints against the ledger")
+parser.add_argument("--user", type=int, help="Only check this user id")
+parser.add_argument("--repair", action="store_true", help="Rebuild checkpoints that do not match")
+args = parser.parse_args()
+
+with app.app_context():
+    if args.user:
+        user_ids = [args.user]
+    else:
+        user_ids = db.session.scalars(db.select(User.id).order_by(User.id)).all()
+
+    mismatches = 0
+    for user_id in user_ids:
+        result = verify_balance(user_id, repair=args.repair)
+        if not result["ok"]:
+            mismatches += 1
+            print(f"User {user_id}: stored {result['stored']} != ledger {result['expected']}")
+
+    if args.repair:
+        db.session.commit()
+
+    if mismatches:
+        action = "repaired" if args.repair else "found"
+        print(f"\n⚠️  {mismatches} mismatching checkpoint(s) {action} out of {len(user_ids)} users.")
+    else:
+        print(f"\n✅ Done. All {len(user_ids)} checkpoints match the ledger.")
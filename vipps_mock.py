@@ -0,0 +1,307 @@
+# vipps_mock.py
+#
+# Local stand-in for the Vipps MobilePay endpoints VippsClient uses
+# (accesstoken, create, get, capture, cancel), for development and
+# bench_payments.py. Nothing leaves the machine. Usage:
+#   python vipps_mock.py                                 # http://localhost:8000
+#   python vipps_mock.py --latency-ms 80 --jitter-ms 40  # slower upstream
+#   python vipps_mock.py --fail-rate 0.05 --hang-rate 0.01
+#   python vipps_mock.py --webhook-url http://localhost:5000/klippekort/webhook --webhook-secret s3cret
+#
+# A payment stays CREATED until the "user" approves or rejects it:
+#   POST /mock/approve/<reference>   -> AUTHORIZED
+#   POST /mock/reject/<reference>    -> ABORTED
+# (GET on the redirectUrl approves too, so a browser flow just works.)
+# Behaviour can be changed while running: POST /mock/config with a JSON body
+# of any settings below; GET /mock/stats returns call counts per endpoint.
+
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import random
+import threading
+import time
+import uuid
+from email.utils import formatdate
+from urllib.parse import urlsplit
+
+import requests
+from flask import Flask, jsonify, request, redirect
+
+
+DEFAULTS = {
+    "latency_ms": 0,        # added to every API call
+    "jitter_ms": 0,         # uniform 0..jitter_ms on top
+    "fail_rate": 0.0,       # share of API calls answered 503
+    "hang_rate": 0.0,       # share of API calls that stall for hang_seconds
+    "hang_seconds": 30,
+    "token_ttl": 3600,      # expires_in of issued access tokens
+    "auto_approve_ms": None,  # approve created payments by themselves after this delay
+    "webhook_url": None,
+    "webhook_secret": None,
+}
+
+
+def create_mock_app(**settings):
+    app = Flask("vipps_mock")
+    config = dict(DEFAULTS, **{k: v for k, v in settings.items() if v is not None})
+    payments = {}       # reference -> payment dict
+    idempotent = {}     # (endpoint, Idempotency-Key) -> (body, status)
+    tokens = {}         # token -> expires at (epoch)
+    stats = {}
+    lock = threading.Lock()
+
+    def count(name):
+        with lock:
+            stats[name] = stats.get(name, 0) + 1
+
+    def upstream_behaviour():
+        """Latency and injected failures; returns an error response or None"""
+        delay = config["latency_ms"] + random.uniform(0, config["jitter_ms"])
+        if delay:
+            time.sleep(delay / 1000)
+        if config["hang_rate"] and random.random() < config["hang_rate"]:
+            time.sleep(config["hang_seconds"])
+        if config["fail_rate"] and random.random() < config["fail_rate"]:
+            count("injected_503")
+            return jsonify({"title": "Service Unavailable (injected)"}), 503
+        return None
+
+    def authorized():
+        token = request.headers.get("Authorization", "").removeprefix("Bearer ")
+        expires_at = tokens.get(token)
+        return expires_at is not None and expires_at > time.time()
+
+    def send_webhook(payment, name):
+        if not (config["webhook_url"] and config["webhook_secret"]):
+            return
+        body = json.dumps({
+            "msn": "mock",
+            "reference": payment["reference"],
+            "pspReference": payment["pspReference"],
+            "name": name,
+            "amount": payment["amount"],
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "idempotencyKey": None,
+            "success": True,
+        }).encode()
+        url = urlsplit(config["webhook_url"])
+        path = url.path + (f"?{url.query}" if url.query else "")
+        date = formatdate(usegmt=True)
+        content_hash = base64.b64encode(hashlib.sha256(body).digest()).decode()
+        signed = f"POST\n{path}\n{date};{url.netloc};{content_hash}"
+        signature = base64.b64encode(
+            hmac.new(config["webhook_secret"].encode(), signed.encode(), hashlib.sha256).digest()
+        ).decode()
+        headers = {
+            "Content-Type": "application/json",
+            "x-ms-date": date,
+            "x-ms-content-sha256": content_hash,
+            "Authorization": f"HMAC-SHA256 SignedHeaders=x-ms-date;host;x-ms-content-sha256&Signature={signature}",
+        }
+
+        def deliver():
+            try:
+                requests.post(config["webhook_url"], data=body, headers=headers, timeout=10)
+                count("webhook_sent")
+            except requests.RequestException:
+                count("webhook_failed")
+        threading.Thread(target=deliver, daemon=True).start()
+
+    def set_state(reference, state, event=None):
+        with lock:
+            payment = payments.get(reference)
+            if payment is None or payment["state"] != "CREATED":
+                return payment
+            payment["state"] = state
+        send_webhook(payment, event or state)
+        return payment
+
+    def with_idempotency(endpoint, handler):
+        """Replay the first answer for a repeated Idempotency-Key, like Vipps does"""
+        key = request.headers.get("Idempotency-Key")
+        if key and (endpoint, key) in idempotent:
+            count(f"{endpoint} (replayed)")
+            body, status = idempotent[(endpoint, key)]
+            return jsonify(body), status
+        body, status = handler()
+        if key and status < 500:
+            idempotent[(endpoint, key)] = (body, status)
+        return jsonify(body), status
+
+    # ---- ePayment API ----
+
+    @app.post("/accesstoken/get")
+    def access_token():
+        count("accesstoken")
+        failure = upstream_behaviour()
+        if failure:
+            return failure
+        # client_id/client_secret are not checked: WSGI servers drop headers with underscores
+        if not request.headers.get("Ocp-Apim-Subscription-Key"):
+            return jsonify({"error": "invalid_client"}), 401
+        token = uuid.uuid4().hex
+        tokens[token] = time.time() + config["token_ttl"]
+        return jsonify({"token_type": "Bearer", "expires_in": str(config["token_ttl"]), "access_token": token})
+
+    @app.post("/epayment/v1/payments")
+    def create_payment():
+        count("create")
+        failure = upstream_behaviour()
+        if failure:
+            return failure
+        if not authorized():
+            return jsonify({"title": "Unauthorized"}), 401
+
+        def handler():
+            data = request.get_json(silent=True) or {}
+            reference = data.get("reference")
+            if not reference or not data.get("amount"):
+                return {"title": "Bad Request", "detail": "reference and amount are required"}, 400
+            with lock:
+                if reference in payments:
+                    return {"title": "Conflict", "detail": f"reference {reference} already used"}, 409
+                payments[reference] = {
+                    "reference": reference,
+                    "pspReference": uuid.uuid4().hex[:12],
+                    "amount": data["amount"],
+                    "state": "CREATED",
+                    "captured": 0,
+                    "returnUrl": data.get("returnUrl"),
+                }
+            if config["auto_approve_ms"] is not None:
+                threading.Timer(config["auto_approve_ms"] / 1000, set_state,
+                                args=(reference, "AUTHORIZED")).start()
+            return {"reference": reference, "redirectUrl": f"{request.host_url}mock/approve/{reference}"}, 201
+        return with_idempotency("create", handler)
+
+    @app.get("/epayment/v1/payments/<reference>")
+    def get_payment(reference):
+        count("get")
+        failure = upstream_behaviour()
+        if failure:
+            return failure
+        if not authorized():
+            return jsonify({"title": "Unauthorized"}), 401
+        payment = payments.get(reference)
+        if payment is None:
+            return jsonify({"title": "Not Found"}), 404
+        return jsonify({
+            "reference": reference,
+            "pspReference": payment["pspReference"],
+            "state": payment["state"],
+            "amount": payment["amount"],
+            "aggregate": {
+                "authorizedAmount": payment["amount"] if payment["state"] == "AUTHORIZED" else {"currency": "DKK", "value": 0},
+                "capturedAmount": {"currency": "DKK", "value": payment["captured"]},
+            },
+        })
+
+    @app.post("/epayment/v1/payments/<reference>/capture")
+    def capture_payment(reference):
+        count("capture")
+        failure = upstream_behaviour()
+        if failure:
+            return failure
+        if not authorized():
+            return jsonify({"title": "Unauthorized"}), 401
+
+        def handler():
+            with lock:
+                payment = payments.get(reference)
+                if payment is None:
+                    return {"title": "Not Found"}, 404
+                # Like the real API, the state stays AUTHORIZED; the captured amount grows
+                if payment["state"] != "AUTHORIZED" or payment["captured"]:
+                    return {"title": "Bad Request", "detail": "payment cannot be captured"}, 400
+                payment["captured"] = payment["amount"]["value"]
+            send_webhook(payment, "CAPTURED")
+            return {"reference": reference, "state": payment["state"],
+                    "aggregate": {"capturedAmount": {"currency": "DKK", "value": payment["captured"]}}}, 200
+        return with_idempotency("capture", handler)
+
+    @app.post("/epayment/v1/payments/<reference>/cancel")
+    def cancel_payment(reference):
+        count("cancel")
+        failure = upstream_behaviour()
+        if failure:
+            return failure
+        if not authorized():
+            return jsonify({"title": "Unauthorized"}), 401
+
+        def handler():
+            with lock:
+                payment = payments.get(reference)
+                if payment is None:
+                    return {"title": "Not Found"}, 404
+                if payment["captured"]:
+                    return {"title": "Bad Request", "detail": "payment is captured"}, 400
+                payment["state"] = "ABORTED"
+            send_webhook(payment, "CANCELLED")
+            return {"reference": reference, "state": "ABORTED"}, 200
+        return with_idempotency("cancel", handler)
+
+    # ---- mock controls ----
+
+    @app.route("/mock/approve/<reference>", methods=["GET", "POST"])
+    def approve(reference):
+        payment = set_state(reference, "AUTHORIZED")
+        if payment is None:
+            return jsonify({"title": "Not Found"}), 404
+        if request.method == "GET" and payment.get("returnUrl"):
+            return redirect(payment["returnUrl"])
+        return jsonify({"reference": reference, "state": payment["state"]})
+
+    @app.post("/mock/reject/<reference>")
+    def reject(reference):
+        payment = set_state(reference, "ABORTED")
+        if payment is None:
+            return jsonify({"title": "Not Found"}), 404
+        return jsonify({"reference": reference, "state": payment["state"]})
+
+    @app.route("/mock/config", methods=["GET", "POST"])
+    def mock_config():
+        if request.method == "POST":
+            changes = request.get_json(silent=True) or {}
+            config.update({k: v for k, v in changes.items() if k in DEFAULTS})
+        return jsonify(config)
+
+    @app.get("/mock/stats")
+    def mock_stats():
+        with lock:
+            return jsonify({"calls": dict(stats), "payments": len(payments)})
+
+    @app.post("/mock/reset")
+    def mock_reset():
+        with lock:
+            payments.clear()
+            idempotent.clear()
+            stats.clear()
+        return jsonify({"ok": True})
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the Vipps ePayment API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency-ms", type=float)
+    parser.add_argument("--jitter-ms", type=float)
+    parser.add_argument("--fail-rate", type=float, help="share of calls answered 503 (0-1)")
+    parser.add_argument("--hang-rate", type=float, help="share of calls that stall (0-1)")
+    parser.add_argument("--hang-seconds", type=float)
+    parser.add_argument("--token-ttl", type=int)
+    parser.add_argument("--auto-approve-ms", type=float, help="approve payments without a user")
+    parser.add_argument("--webhook-url")
+    parser.add_argument("--webhook-secret")
+    args = parser.parse_args()
+
+    app = create_mock_app(**{k: v for k, v in vars(args).items() if k not in ("host", "port")})
+    app.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()